@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'web.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,8 +52,6 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'django.middleware.cache.UpdateCacheMiddleware',
-    'django.middleware.cache.FetchFromCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'qmc.urls'
@@ -89,6 +88,32 @@ DATABASES = {
     }
 }
 
+# SQLite production profile, on by default when DEBUG is off
+# (QMC_SQLITE_PROFILE=production|default overrides): WAL so readers don't
+# block the writer, NORMAL sync (safe under WAL), a 64MB page cache and
+# 256MB memory map per connection, and connections kept open between
+# requests. IMMEDIATE transactions take the write lock up front instead of
+# failing with "database is locked" on upgrade. Development and tests keep
+# SQLite's defaults, so the checked-in database stays in rollback-journal mode.
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA temp_store=MEMORY',
+]
+SQLITE_PRODUCTION = {
+    'CONN_MAX_AGE': int(os.environ.get('QMC_CONN_MAX_AGE', 600)),
+    'CONN_HEALTH_CHECKS': True,
+    'OPTIONS': {
+        'init_command': ';'.join(SQLITE_PRAGMAS),
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': 20,
+    },
+}
+if os.environ.get('QMC_SQLITE_PROFILE', 'default' if DEBUG else 'production') == 'production':
+    DATABASES['default'].update(SQLITE_PRODUCTION)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -145,6 +170,16 @@ LOGIN_URL = 'login'       # Where to send user when login is required
 # Pastel API Settings
 PASTEL_API_URL = 'http://your-pastel-api-url/api/v1'
 PASTEL_API_KEY = 'your-api-key'
+PASTEL_API_TIMEOUT = 10  # Seconds per request
+PASTEL_SYNC_WORKERS = 8  # Concurrent requests (and pooled connections) for bulk syncs
+PASTEL_SYNC_WINDOW_DAYS = 7  # Invoice reconciliation fetches the range in windows of this many days
+PASTEL_PUSH_BATCH_SIZE = 100  # Documents sent to Pastel per request by the incremental sync
+PASTEL_SYNC_LOCAL_DOCUMENTS = False  # Save new documents as PENDING_SYNC so the sync pushes them
+
+# Local mirror of Pastel items and customers: seconds before a copy is revalidated
+PASTEL_ITEMS_TTL = 24 * 60 * 60
+PASTEL_CUSTOMERS_TTL = 60 * 60
+PASTEL_CACHE_BACKGROUND_REFRESH = True  # Serve stale copies while revalidating in a thread
 
 # Cylinder Item Codes (examples)
 CYLINDER_ITEM_CODES = [
@@ -156,13 +191,23 @@ CYLINDER_ITEM_CODES = [
 # Add these settings for static file caching
 STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'
 
-# Add cache settings
+# Shared by every worker process; API reads are cached under per-customer versions (web/api_cache.py)
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('QMC_CACHE_DIR', str(BASE_DIR / '.cache')),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
     }
 }
+API_CACHE_TIMEOUT = int(os.environ.get('QMC_API_CACHE_TIMEOUT', 300))
+# Streamed bodies larger than this (the fleet holdings report) are sent but not cached
+API_CACHE_MAX_STREAMED_BYTES = int(os.environ.get('QMC_API_CACHE_MAX_STREAMED_BYTES', 1024 * 1024))
+
+# Where generate_statements and the statements endpoint write month-end statements
+STATEMENTS_DIR = os.environ.get('QMC_STATEMENTS_DIR', str(BASE_DIR / 'statements'))
+
+# Files written by background jobs (web.jobs), one directory per job
+JOBS_DIR = os.environ.get('QMC_JOBS_DIR', str(BASE_DIR / 'job_files'))
 
 STATICFILES_FINDERS = [
     'django.contrib.staticfiles.finders.FileSystemFinder',
@@ -180,3 +225,34 @@ MESSAGE_TAGS = {
     messages.WARNING: 'alert-warning',
     messages.ERROR: 'alert-danger',
 }
+
+# Logging and tracing
+# Hot-path tracing goes to the 'web.trace' logger; set QMC_TRACE_LEVEL=DEBUG to
+# enable it, and QMC_TRACE_SAMPLE_RATE to the fraction of requests to trace.
+TRACE_SAMPLE_RATE = float(os.environ.get('QMC_TRACE_SAMPLE_RATE', '0.01'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {
+            'format': '{asctime} {levelname} {name} {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        'web': {
+            'handlers': ['console'],
+            'level': os.environ.get('QMC_LOG_LEVEL', 'INFO'),
+        },
+        'web.trace': {
+            'level': os.environ.get('QMC_TRACE_LEVEL', 'WARNING'),
+        },
+    },
+}
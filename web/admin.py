@@ -1,18 +1,115 @@
+from urllib.parse import parse_qsl
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db.models import Max
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
+from . import ledger
 from .models import Customer, Document, CylinderMovement
 
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts exactly up to ``count_limit`` rows. Past that an unfiltered table is
+    estimated from its highest id, an index lookup, and a filtered list stops
+    at the limit, so a changelist never counts millions of rows.
+    """
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list.order_by()
+        counted = queryset[:self.count_limit + 1].count()
+        if counted <= self.count_limit:
+            return counted
+        if not queryset.query.where:
+            return max(queryset.aggregate(highest=Max('pk'))['highest'] or 0, counted)
+        return self.count_limit
+
+
+class AccountNumberFilter(admin.SimpleListFilter):
+    """A text box for a customer's account number instead of a link per customer"""
+    title = 'customer account'
+    parameter_name = 'account'
+    template = 'admin/web/input_filter.html'
+    field_path = 'customer__account_number'
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.field_path: self.value().strip()})
+        return queryset
+
+    def choices(self, changelist):
+        others = changelist.get_query_string(remove=[self.parameter_name, 'p'])
+        yield {
+            'selected': self.value() is None,
+            'query_string': others,
+            'display': 'All',
+            'value': self.value() or '',
+            'hidden': parse_qsl(others.lstrip('?')),
+        }
+
+
+class MovementAccountNumberFilter(AccountNumberFilter):
+    field_path = 'document__customer__account_number'
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables that grow without bound"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+
+
 @admin.register(Customer)
-class CustomerAdmin(admin.ModelAdmin):
-    list_display = ('name', 'account_number', 'created_at')
+class CustomerAdmin(LargeTableAdmin):
+    list_display = ('name', 'account_number', 'holdings', 'created_at')
     search_fields = ('name', 'account_number')
 
+    def get_queryset(self, request):
+        # Holdings come from the maintained balance row, joined into the list query
+        return super().get_queryset(request).annotate(holdings=Coalesce('balance__balance', 0))
+
+    @admin.display(ordering='holdings')
+    def holdings(self, obj):
+        return obj.holdings
+
+
 @admin.register(Document)
-class DocumentAdmin(admin.ModelAdmin):
-    list_display = ('document_number', 'document_type', 'customer', 'document_date', 'created_by')
-    list_filter = ('document_type', 'document_date', 'customer')
+class DocumentAdmin(LargeTableAdmin):
+    list_display = ('document_number', 'document_type', 'customer', 'document_date', 'received', 'returned',
+                    'created_by')
+    list_filter = ('document_type', AccountNumberFilter)
+    list_select_related = ('customer', 'created_by')
     search_fields = ('document_number', 'customer__name')
+    date_hierarchy = 'document_date'
+    autocomplete_fields = ('customer',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            received=ledger.movement_total('R'),
+            returned=ledger.movement_total('E'),
+        )
+
+    @admin.display(description='Received')
+    def received(self, obj):
+        return obj.received
+
+    @admin.display(description='Returned')
+    def returned(self, obj):
+        return obj.returned
+
 
 @admin.register(CylinderMovement)
-class CylinderMovementAdmin(admin.ModelAdmin):
+class CylinderMovementAdmin(LargeTableAdmin):
     list_display = ('document', 'movement_type', 'quantity')
-    list_filter = ('movement_type', 'document__document_type')
+    list_filter = ('movement_type', 'document__document_type', MovementAccountNumberFilter)
+    # The document's __str__ reads its customer
+    list_select_related = ('document__customer',)
+    autocomplete_fields = ('document',)
@@ -0,0 +1,173 @@
+"""
+Application cache for the customer read endpoints.
+
+Payloads live in the shared cache backend under keys that carry a version:
+one per customer, bumped on any change to that customer's documents or
+details, and one for fleet-wide views, bumped on any change at all. A bump
+makes the old entries unreachable, so invalidation is exact and stale
+entries simply expire. The versions themselves are cache
+entries; if one is evicted it restarts from the clock, never from a value
+an old key could still match.
+
+The ``a``-prefixed helpers are for async views: they take coroutine
+builders and keep cache I/O off the event loop.
+"""
+import hashlib
+import time
+from typing import Awaitable, Callable, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+
+PREFIX = 'qmc:api'
+FLEET = '*'
+
+
+def _version_key(scope: str) -> str:
+    return f'{PREFIX}:version:{scope}'
+
+
+def _fresh_version() -> int:
+    return time.time_ns()
+
+
+def versions(*scopes: str) -> tuple:
+    """Current versions of the given scopes (customer account numbers or FLEET), in one cache read"""
+    keys = [_version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    result = []
+    for key in keys:
+        value = found.get(key)
+        if value is None:
+            cache.add(key, _fresh_version(), None)
+            value = cache.get(key)
+        result.append(value)
+    return tuple(result)
+
+
+def _bump(scope: str):
+    key = _version_key(scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _fresh_version(), None)
+
+
+def _bump_now_and_on_commit(*scopes: str):
+    # The second bump drops anything a concurrent reader cached from the
+    # pre-commit state under the first one; a rollback only costs a cache miss
+    def bump():
+        for scope in scopes:
+            _bump(scope)
+    bump()
+    transaction.on_commit(bump)
+
+
+def customer_changed(account_number: str):
+    """Invalidate a customer's cached reads and the fleet views"""
+    _bump_now_and_on_commit(account_number, FLEET)
+
+
+def everything_changed():
+    """Invalidate every cached read (after a full ledger rebuild)"""
+    _bump_now_and_on_commit('epoch')
+
+
+def make_key(name: str, scopes: tuple, *parts) -> str:
+    """Cache key for an endpoint payload under the current versions of its scopes"""
+    stamp = '.'.join(str(version) for version in versions('epoch', *scopes))
+    return ':'.join([PREFIX, name, stamp, *(str(part) for part in parts)])
+
+
+def etag(name: str, scopes: tuple, *parts) -> Optional[str]:
+    """
+    Entity tag for an endpoint response, derived from the same versions as its
+    cache key; None when the backend keeps no versions (e.g. a dummy cache).
+    """
+    stamp = versions('epoch', *scopes)
+    if None in stamp:
+        return None
+    raw = ':'.join([name, *(str(version) for version in stamp), *(str(part) for part in parts)])
+    return hashlib.sha1(raw.encode()).hexdigest()[:24]
+
+
+def timeout() -> int:
+    return getattr(settings, 'API_CACHE_TIMEOUT', 300)
+
+
+def get_or_build(key: str, build: Callable[[], Optional[dict]]):
+    """Return the cached payload for ``key`` or build it; ``None`` results are not cached"""
+    payload = cache.get(key)
+    if payload is None:
+        payload = build()
+        if payload is not None:
+            cache.set(key, payload, timeout())
+    return payload
+
+
+async def amake_key(name: str, scopes: tuple, *parts) -> str:
+    return await sync_to_async(make_key)(name, scopes, *parts)
+
+
+async def aget_or_build(key: str, build: Callable[[], Awaitable[Optional[dict]]]):
+    payload = await cache.aget(key)
+    if payload is None:
+        payload = await build()
+        if payload is not None:
+            await cache.aset(key, payload, timeout())
+    return payload
+
+
+def cached_json(key: str) -> Optional[HttpResponse]:
+    """A stored streamed body, ready to send, or None"""
+    body = cache.get(key)
+    if body is None:
+        return None
+    return HttpResponse(body, content_type='application/json')
+
+
+async def acached_json(key: str) -> Optional[HttpResponse]:
+    return await sync_to_async(cached_json)(key)
+
+
+def max_streamed_bytes() -> int:
+    return getattr(settings, 'API_CACHE_MAX_STREAMED_BYTES', 1024 * 1024)
+
+
+def store_streamed(response, key: str):
+    """
+    Keep a copy of a StreamingJsonResponse body as it goes out, unless the
+    stream failed. A body past API_CACHE_MAX_STREAMED_BYTES is not cached and
+    its copy is dropped, so a large stream still runs in flat memory.
+    """
+    limit = max_streamed_bytes()
+
+    def keep(chunks, size, chunk):
+        # Returns the copy so far, or None once it is over the limit
+        if chunks is None or size + len(chunk) > limit:
+            return None
+        chunks.append(chunk)
+        return chunks
+
+    def tee(content):
+        chunks, size = [], 0
+        for chunk in content:
+            chunks = keep(chunks, size, chunk)
+            size += len(chunk)
+            yield chunk
+        if chunks is not None and not getattr(response, 'failed', False):
+            cache.set(key, b''.join(chunks), timeout())
+
+    async def atee(content):
+        chunks, size = [], 0
+        async for chunk in content:
+            chunks = keep(chunks, size, chunk)
+            size += len(chunk)
+            yield chunk
+        if chunks is not None and not getattr(response, 'failed', False):
+            await cache.aset(key, b''.join(chunks), timeout())
+
+    response.streaming_content = (atee if response.is_async else tee)(response.streaming_content)
+    return response
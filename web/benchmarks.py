@@ -0,0 +1,263 @@
+"""
+Scaling benchmarks for the cylinder API endpoints.
+
+Each scale builds a synthetic dataset, drives the endpoints through the Django
+test client and records latency percentiles, query counts and peak Python
+memory per request. ``growth`` fits log(p50 latency) against log(movements):
+about 0 means flat cost, about 1 means the endpoint grows linearly with history.
+
+``load_test`` replays the dashboard's parallel fetches under concurrency,
+once through the WSGI handler with a pool of worker threads and once through
+the ASGI handler with every request in flight on one event loop, and reports
+throughput for each.
+"""
+import asyncio
+import math
+import queue
+import statistics
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from .models import Customer
+from .synthetic import clear_dataset, generate_dataset
+
+REPORT_DATE = '2024-12-31'
+
+
+def _endpoints(account_number: str) -> Dict[str, Callable[[], tuple]]:
+    return {
+        'dashboard': lambda: (reverse('dashboard'), {'account_number': account_number}),
+        'get_customer_info': lambda: (reverse('get_customer_info'), {'account_number': account_number}),
+        'get_customer_documents': lambda: (
+            reverse('get_customer_documents'), {'account_number': account_number}
+        ),
+        'get_monthly_holdings': lambda: (
+            reverse('get_monthly_holdings'), {'account_number': account_number, 'year': 2020}
+        ),
+        'get_monthly_holdings_fleet': lambda: (reverse('get_monthly_holdings'), {'year': 2020}),
+        'get_monthly_holdings_report': lambda: (
+            reverse('monthly_holdings_report'), {'date': REPORT_DATE}
+        ),
+    }
+
+
+def _percentile(samples: List[float], percent: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _dashboard_burst(account_number: str) -> List[tuple]:
+    """The read requests the dashboard fires together when a customer is opened"""
+    return [
+        (reverse('get_customer_info'), {'account_number': account_number}),
+        (reverse('get_customer_documents'), {'account_number': account_number}),
+        (reverse('get_monthly_holdings'), {'account_number': account_number, 'year': 2020}),
+        (reverse('get_customer_details', args=[account_number]), {}),
+        (reverse('check_document_number'), {'document_number': 'IN999999'}),
+    ]
+
+
+async def _adrain(response) -> int:
+    if not response.streaming:
+        return len(response.content)
+    if response.is_async:
+        return sum([len(chunk) async for chunk in response.streaming_content])
+    return sum(len(chunk) for chunk in response.streaming_content)
+
+
+def _fetch(client: Client, url: str, params: Dict):
+    """GET an endpoint and read the whole body, including streamed responses"""
+    response = client.get(url, params)
+    if response.streaming and response.is_async:
+        size = async_to_sync(_adrain)(response)
+    elif response.streaming:
+        size = sum(len(chunk) for chunk in response.streaming_content)
+    else:
+        size = len(response.content)
+    return response, size
+
+
+def measure(client: Client, url: str, params: Dict, repeat: int) -> Dict:
+    """Latency percentiles, query count and peak memory for one endpoint"""
+    _fetch(client, url, params)  # Warm up caches and lazy imports
+
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response, size = _fetch(client, url, params)
+        latencies.append(time.perf_counter() - start)
+
+    with CaptureQueriesContext(connection) as captured:
+        _fetch(client, url, params)
+    # Read them now: the next request start resets the connection's query log
+    queries = captured.captured_queries
+
+    tracemalloc.start()
+    _fetch(client, url, params)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'queries': len(queries),
+        'db_ms': round(sum(float(query['time']) for query in queries) * 1000, 3),
+        'peak_memory_kb': round(peak / 1024, 1),
+        'response_bytes': size,
+    }
+
+
+def growth_exponent(points: List[tuple]) -> Optional[float]:
+    """Least-squares slope of log(latency) against log(movements)"""
+    points = [(math.log(x), math.log(y)) for x, y in points if x > 0 and y > 0]
+    if len(points) < 2:
+        return None
+    mean_x = statistics.mean(x for x, _ in points)
+    mean_y = statistics.mean(y for _, y in points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if not spread:
+        return None
+    return round(sum((x - mean_x) * (y - mean_y) for x, y in points) / spread, 3)
+
+
+def run(scales: List[int], customers: int, repeat: int,
+        endpoints: Optional[List[str]] = None, log: Callable[[str], None] = print) -> Dict:
+    """Run every endpoint at every scale and return the machine-readable results"""
+    # Measure the views themselves, not the API response cache
+    uncached = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+    results = []
+    with override_settings(CACHES=uncached):
+        for movements in scales:
+            log(f'Generating {movements} movements over {customers} customers...')
+            dataset = generate_dataset(movements, customers=customers)
+            busiest = Customer.objects.annotate(
+                document_total=Count('documents')
+            ).order_by('-document_total').values_list('account_number', flat=True).first()
+
+            client = Client()
+            client.force_login(User.objects.get(username='synthetic'))
+            timings = {}
+            for name, target in _endpoints(busiest).items():
+                if endpoints and name not in endpoints:
+                    continue
+                url, params = target()
+                timings[name] = measure(client, url, params, repeat)
+                log(f"  {name}: p50 {timings[name]['p50_ms']}ms, "
+                    f"{timings[name]['queries']} queries, {timings[name]['peak_memory_kb']}KB peak")
+
+            results.append({**dataset, 'endpoints': timings})
+            clear_dataset()
+
+    growth = {}
+    for name in results[0]['endpoints'] if results else []:
+        growth[name] = growth_exponent([
+            (result['movements'], result['endpoints'][name]['p50_ms']) for result in results
+        ])
+    return {'scales': results, 'growth': growth}
+
+
+def _throughput(latencies: List[float], elapsed: float, errors: int) -> Dict:
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 3),
+    }
+
+
+def load_wsgi(user: User, targets: List[tuple], workers: int) -> Dict:
+    """Serve ``targets`` through the WSGI handler from ``workers`` threads"""
+    pending = queue.SimpleQueue()
+    for target in targets:
+        pending.put(target)
+    latencies, errors = [], []
+
+    def worker(client):
+        try:
+            while True:
+                try:
+                    url, params = pending.get_nowait()
+                except queue.Empty:
+                    return
+                start = time.perf_counter()
+                response, _ = _fetch(client, url, params)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors.append(url)
+        finally:
+            connection.close()
+
+    clients = [Client() for _ in range(workers)]
+    for client in clients:
+        client.force_login(user)
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return _throughput(latencies, time.perf_counter() - start, len(errors))
+
+
+def load_asgi(user: User, targets: List[tuple], concurrency: int) -> Dict:
+    """Serve ``targets`` through the ASGI handler, ``concurrency`` at a time on one event loop"""
+    latencies, errors = [], []
+
+    async def run_all():
+        client = AsyncClient()
+        await client.aforce_login(user)
+        slots = asyncio.Semaphore(concurrency)
+
+        async def fetch(url, params):
+            async with slots:
+                start = time.perf_counter()
+                response = await client.get(url, params)
+                await _adrain(response)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors.append(url)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(fetch(url, params) for url, params in targets))
+        return time.perf_counter() - start
+
+    elapsed = async_to_sync(run_all)()
+    return _throughput(latencies, elapsed, len(errors))
+
+
+def load_test(movements: int, customers: int, bursts: int, concurrency: int,
+              log: Callable[[str], None] = print) -> Dict:
+    """Replay ``bursts`` dashboard bursts over the busiest customers through WSGI and ASGI"""
+    uncached = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+    with override_settings(CACHES=uncached):
+        log(f'Generating {movements} movements over {customers} customers...')
+        dataset = generate_dataset(movements, customers=customers)
+        accounts = list(Customer.objects.annotate(
+            document_total=Count('documents')
+        ).order_by('-document_total').values_list('account_number', flat=True)[:bursts])
+        targets = [target for i in range(bursts) for target in _dashboard_burst(accounts[i % len(accounts)])]
+        user = User.objects.get(username='synthetic')
+
+        results = {}
+        for name, run_load in (('wsgi', load_wsgi), ('asgi', load_asgi)):
+            run_load(user, _dashboard_burst(accounts[0]), concurrency)  # Warm up
+            results[name] = run_load(user, targets, concurrency)
+            log(f"  {name}: {results[name]['requests_per_second']} req/s, "
+                f"p50 {results[name]['p50_ms']}ms, p95 {results[name]['p95_ms']}ms, "
+                f"{results[name]['errors']} error(s)")
+        clear_dataset()
+    return {**dataset, 'concurrency': concurrency, 'bursts': bursts, 'results': results}
@@ -0,0 +1,87 @@
+"""
+Live document changes for open dashboards, as server-sent events.
+
+Document writes record a compact ChangeEvent in the same transaction, so an
+event exists exactly when its change has committed. Streams read events back
+in id order, for one customer or fleet-wide. SQLite serialises writers, so
+id order is commit order and a client resuming from Last-Event-ID misses
+nothing. After each commit the newest id is put in the cache, and streams
+only query when it moves.
+"""
+import asyncio
+from datetime import timedelta
+from typing import AsyncIterator, Dict, List, Optional
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .models import ChangeEvent
+from .streaming import dumps
+
+LATEST_KEY = 'qmc:events:latest'
+BATCH_SIZE = 200
+RETENTION = timedelta(days=1)
+PRUNE_EVERY = 1000
+
+
+def publish(account_number: str, kind: str, payload: Dict) -> ChangeEvent:
+    """Record a change inside the writer's transaction"""
+    event = ChangeEvent.objects.create(account_number=account_number, kind=kind, payload=payload)
+    transaction.on_commit(lambda: cache.set(LATEST_KEY, event.id, None))
+    if event.id % PRUNE_EVERY == 0:
+        # Clients more than a day behind reload anyway
+        ChangeEvent.objects.filter(created_at__lt=timezone.now() - RETENTION).delete()
+    return event
+
+
+def encode(event: ChangeEvent) -> bytes:
+    data = dumps({'account_number': event.account_number, **event.payload})
+    return b'id: %d\nevent: %s\ndata: %s\n\n' % (event.id, event.kind.encode(), data)
+
+
+def preamble(last_id: int, retry_ms: int) -> bytes:
+    # The id-only block sets the client's Last-Event-ID even if no event follows
+    return b'retry: %d\nid: %d\n\n' % (retry_ms, last_id)
+
+
+async def latest_id() -> int:
+    return await ChangeEvent.objects.order_by('-id').values_list('id', flat=True).afirst() or 0
+
+
+async def since(account_number: Optional[str], last_id: int) -> List[ChangeEvent]:
+    """The next events after ``last_id``, for one customer or (account_number None) all of them"""
+    events = ChangeEvent.objects.filter(id__gt=last_id)
+    if account_number:
+        events = events.filter(account_number=account_number)
+    return [event async for event in events.order_by('id')[:BATCH_SIZE]]
+
+
+async def stream(account_number: Optional[str], last_id: int) -> AsyncIterator[bytes]:
+    """
+    Emit events after ``last_id`` as they commit, with a keep-alive comment
+    when idle. The stream ends after EVENTS_STREAM_SECONDS; EventSource then
+    reconnects and resumes from the last id it received.
+    """
+    poll = getattr(settings, 'EVENTS_POLL_SECONDS', 1.0)
+    keepalive = getattr(settings, 'EVENTS_KEEPALIVE_SECONDS', 15)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + getattr(settings, 'EVENTS_STREAM_SECONDS', 300)
+
+    yield preamble(last_id, getattr(settings, 'EVENTS_RETRY_MS', 3000))
+    checked = 0
+    quiet_since = loop.time()
+    while loop.time() < deadline:
+        marker = await cache.aget(LATEST_KEY)
+        if marker is None or marker > checked:
+            events = await since(account_number, last_id)
+            if events:
+                last_id = events[-1].id
+                quiet_since = loop.time()
+                yield b''.join(encode(event) for event in events)
+            if len(events) == BATCH_SIZE:
+                continue
+            checked = marker or 0
+        if loop.time() - quiet_since >= keepalive:
+            quiet_since = loop.time()
+            yield b': keep-alive\n\n'
+        await asyncio.sleep(poll)
@@ -54,18 +54,7 @@ class DocumentForm(forms.ModelForm):
     def clean(self):
         cleaned_data = super().clean()
         doc_type = cleaned_data.get('document_type')
-        received = cleaned_data.get('cylinders_received')
-        returned = cleaned_data.get('cylinders_returned')
-        
-        # Validate movements based on document type
-        if doc_type == 'NR':
-            if received:
-                raise forms.ValidationError("Return Slips cannot have received cylinders")
-            if not returned:
-                raise forms.ValidationError("Return Slips must have returned cylinders")
-        elif doc_type == 'IN':
-            if not (received or returned):
-                raise forms.ValidationError("Tax Invoice must have either received or returned cylinders")
+        validate_movements(doc_type, cleaned_data.get('cylinders_received'), cleaned_data.get('cylinders_returned'))
 
         # Handle document number formatting
         doc_num = cleaned_data.get('document_number', '')
@@ -80,21 +69,8 @@ class DocumentForm(forms.ModelForm):
                     return cleaned_data
             
             # For new documents or changed numbers
-            if doc_num.isdigit():
-                doc_num = f"{doc_type}{doc_num.zfill(6)}"
-            else:
-                # Validate prefix matches document type
-                if not doc_num.startswith(doc_type):
-                    raise forms.ValidationError(f"Document number must start with {doc_type}")
-                
-                # Extract and validate number part
-                num_part = doc_num[2:]
-                if not num_part.isdigit():
-                    raise forms.ValidationError("Document number must end with digits")
-                
-                # Format with proper padding
-                doc_num = f"{doc_type}{num_part.zfill(6)}"
-            
+            doc_num = normalize_document_number(doc_num, doc_type)
+
             # Check for duplicates only for new documents or changed numbers
             if not self.instance or self.instance.document_number != doc_num:
                 if Document.objects.filter(document_number=doc_num).exists():
@@ -104,6 +80,37 @@ class DocumentForm(forms.ModelForm):
 
         return cleaned_data
 
+def validate_movements(doc_type, received, returned):
+    """Movement rules per document type, shared by the form and batch entry"""
+    if doc_type == 'NR':
+        if received:
+            raise forms.ValidationError("Return Slips cannot have received cylinders")
+        if not returned:
+            raise forms.ValidationError("Return Slips must have returned cylinders")
+    elif doc_type == 'IN':
+        if not (received or returned):
+            raise forms.ValidationError("Tax Invoice must have either received or returned cylinders")
+
+def normalize_document_number(doc_num, doc_type):
+    """Clean a typed document number into PREFIX + six digits"""
+    # Remove any spaces or special characters
+    doc_num = ''.join(c for c in doc_num if c.isalnum()).upper()
+
+    if doc_num.isdigit():
+        return f"{doc_type}{doc_num.zfill(6)}"
+
+    # Validate prefix matches document type
+    if not doc_num.startswith(doc_type):
+        raise forms.ValidationError(f"Document number must start with {doc_type}")
+
+    # Extract and validate number part
+    num_part = doc_num[2:]
+    if not num_part.isdigit():
+        raise forms.ValidationError("Document number must end with digits")
+
+    # Format with proper padding
+    return f"{doc_type}{num_part.zfill(6)}"
+
 class CylinderMovementForm(forms.ModelForm):
     class Meta:
         model = CylinderMovement
@@ -0,0 +1,220 @@
+"""
+Bulk import of Pastel invoice lines as documents and cylinder movements.
+
+Rows have the shape produced by ``PastelService.check_cylinder_movements``
+(invoice_number, date, customer, item_code, quantity, optionally
+movement_type). Everything is validated up front with set-based lookups;
+a document with any bad line is left out and each bad line is reported,
+the rest is written with bulk inserts in chunked transactions.
+"""
+import csv
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+from django.contrib.auth.models import User
+from django.db import transaction
+from . import ledger
+from .models import Customer, CylinderMovement, Document, DocumentSequence, document_number_value
+from .services import existing_document_numbers
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+LOOKUP_CHUNK_SIZE = 500
+
+
+def read_rows(path: str) -> List[Dict]:
+    """Load import rows from a JSON list or a CSV file with a header row"""
+    with open(path, newline='', encoding='utf-8') as handle:
+        if path.lower().endswith('.json'):
+            rows = json.load(handle)
+            if not isinstance(rows, list):
+                raise ValueError('JSON import file must contain a list of rows')
+            return rows
+        return list(csv.DictReader(handle))
+
+
+def _parse_row(row: Dict) -> Dict:
+    """Normalise one import row, raising ValueError with a readable message"""
+    number = ''.join(c for c in str(row.get('invoice_number') or '') if c.isalnum()).upper()
+    if not number:
+        raise ValueError('Missing invoice number')
+    document_type = 'NR' if number.startswith('NR') else 'IN'
+
+    try:
+        document_date = datetime.strptime(str(row.get('date') or '')[:10], '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f"Invalid date {row.get('date')!r}, expected YYYY-MM-DD")
+
+    account = str(row.get('customer') or '').strip()
+    if not account:
+        raise ValueError('Missing customer account')
+
+    try:
+        quantity = int(row.get('quantity'))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid quantity {row.get('quantity')!r}")
+    if quantity <= 0:
+        raise ValueError('Quantity must be positive')
+
+    movement_type = (row.get('movement_type') or ('E' if document_type == 'NR' else 'R')).upper()
+    if movement_type not in ('R', 'E'):
+        raise ValueError(f"Invalid movement type {movement_type!r}")
+    if document_type == 'NR' and movement_type != 'E':
+        raise ValueError('Return Slips can only receive empty cylinders')
+
+    return {
+        'number': number,
+        'document_type': document_type,
+        'date': document_date,
+        'account': account,
+        'item_code': (row.get('item_code') or '').strip() or None,
+        'movement_type': movement_type,
+        'quantity': quantity,
+    }
+
+
+def _customers_by_account(accounts: Iterable[str]) -> Dict[str, Customer]:
+    accounts = list(set(accounts))
+    customers = {}
+    for i in range(0, len(accounts), LOOKUP_CHUNK_SIZE):
+        customers.update(Customer.objects.in_bulk(
+            accounts[i:i + LOOKUP_CHUNK_SIZE], field_name='account_number'
+        ))
+    return customers
+
+
+def validate(rows: Iterable[Dict]) -> Tuple[Dict[str, Dict], Dict]:
+    """
+    Group rows into documents ready to write.
+    Returns (documents by number, summary with skipped numbers and per-row errors).
+    """
+    documents = OrderedDict()
+    errors = []
+    rejected = set()
+
+    for index, row in enumerate(rows, start=1):
+        try:
+            line = _parse_row(row)
+        except ValueError as e:
+            errors.append({'row': index, 'invoice_number': row.get('invoice_number'), 'error': str(e)})
+            if row.get('invoice_number'):
+                rejected.add(''.join(c for c in str(row['invoice_number']) if c.isalnum()).upper())
+            continue
+
+        document = documents.setdefault(line['number'], {
+            'number': line['number'],
+            'document_type': line['document_type'],
+            'date': line['date'],
+            'account': line['account'],
+            'lines': [],
+            'rows': [],
+        })
+        if (document['date'], document['account']) != (line['date'], line['account']):
+            errors.append({
+                'row': index,
+                'invoice_number': line['number'],
+                'error': 'Date or customer differs from earlier lines of this document',
+            })
+            rejected.add(line['number'])
+            continue
+        document['lines'].append(line)
+        document['rows'].append(index)
+
+    customers = _customers_by_account(document['account'] for document in documents.values())
+    for number, document in documents.items():
+        customer = customers.get(document['account'])
+        if customer is None:
+            errors.extend(
+                {'row': index, 'invoice_number': number, 'error': f"Customer {document['account']} not found"}
+                for index in document['rows']
+            )
+            rejected.add(number)
+        document['customer'] = customer
+
+    skipped = existing_document_numbers(documents)
+    valid = OrderedDict(
+        (number, document) for number, document in documents.items()
+        if number not in rejected and number not in skipped
+    )
+    return valid, {'skipped': sorted(skipped), 'errors': errors}
+
+
+def write_documents(documents: List[Dict], user: User, status: str = 'SYNCED') -> Tuple[int, int]:
+    """Insert one chunk of validated documents and apply it to the ledger in one transaction"""
+    with transaction.atomic():
+        Document.objects.bulk_create([
+            Document(
+                document_number=document['number'],
+                document_type=document['document_type'],
+                document_date=document['date'],
+                customer=document['customer'],
+                created_by=user,
+                status=status,
+            )
+            for document in documents
+        ])
+        ids = dict(
+            Document.objects.filter(
+                document_number__in=[document['number'] for document in documents]
+            ).values_list('document_number', 'id')
+        )
+
+        movements = []
+        deltas = {}
+        for document in documents:
+            document['id'] = ids[document['number']]
+            key = (document['customer'].pk, ledger.month_start(document['date']))
+            delta = deltas.setdefault(key, [document['customer'], 0, 0, 0])
+            delta[3] += 1
+            for line in document['lines']:
+                movements.append(CylinderMovement(
+                    document_id=document['id'],
+                    movement_type=line['movement_type'],
+                    quantity=line['quantity'],
+                    pastel_item_code=line['item_code'],
+                ))
+                delta[1 if line['movement_type'] == 'R' else 2] += line['quantity']
+        CylinderMovement.objects.bulk_create(movements)
+
+        # Allocated numbers must stay clear of the imported ones
+        highest = {}
+        for document in documents:
+            value = document_number_value(document['number'])
+            if value is not None and value > highest.get(document['document_type'], 0):
+                highest[document['document_type']] = value
+        for prefix, value in highest.items():
+            DocumentSequence.observe(prefix, value)
+
+        # One ledger update per customer and month rather than per document
+        for (_, month), (customer, received, returned, count) in deltas.items():
+            ledger.record_movements(customer, month, received, returned, documents=count)
+
+    return len(documents), len(movements)
+
+
+def import_movements(rows: Iterable[Dict], user: User, chunk_size: int = CHUNK_SIZE,
+                     status: str = 'SYNCED') -> Dict:
+    """
+    Validate and import Pastel invoice lines. Documents are written ``chunk_size``
+    at a time; invoice numbers we already hold are skipped, so re-running is safe.
+    """
+    documents, summary = validate(rows)
+    documents = list(documents.values())
+
+    created_documents = 0
+    created_movements = 0
+    for i in range(0, len(documents), chunk_size):
+        count, movements = write_documents(documents[i:i + chunk_size], user, status)
+        created_documents += count
+        created_movements += movements
+        logger.debug(f"Imported {created_documents}/{len(documents)} documents")
+
+    return {
+        'documents': created_documents,
+        'movements': created_movements,
+        'skipped': summary['skipped'],
+        'errors': summary['errors'],
+    }
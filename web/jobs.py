@@ -0,0 +1,241 @@
+"""
+Database-backed background jobs.
+
+Views call ``submit`` to queue work and return at once; the ``run_jobs``
+worker claims queued jobs oldest first, runs the registered handler and
+stores its result (a JSON value and/or a file under JOBS_DIR). Handlers
+report progress as they go, and the polling endpoint reads it back. No
+broker is involved: a job is a row, claimed with a compare-and-set update,
+so several workers can share the queue. A job whose worker stops
+heartbeating is queued again, up to MAX_ATTEMPTS.
+"""
+import logging
+import os
+import shutil
+import socket
+import time
+import traceback
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, Optional
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from . import exports, ledger, statements
+from .models import Customer, Job
+from .services import PastelService
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+STALE_AFTER = timedelta(minutes=10)
+PROGRESS_INTERVAL = 1.0
+
+
+class Handler:
+    def __init__(self, func: Callable, staff_only: bool):
+        self.func = func
+        self.staff_only = staff_only
+
+
+HANDLERS: Dict[str, Handler] = {}
+
+
+def handler(kind: str, staff_only: bool = False):
+    """Register ``func(params, run)`` as the handler for a job kind"""
+    def register(func):
+        HANDLERS[kind] = Handler(func, staff_only)
+        return func
+    return register
+
+
+class JobRun:
+    """What a handler gets besides its params: progress reporting and a place for output files"""
+
+    def __init__(self, job: Job):
+        self.job = job
+        self._reported = 0.0
+
+    def progress(self, done: int, total: Optional[int] = None, message: str = '', force: bool = False):
+        # At most one write a second, except the last step; the heartbeat rides along
+        now = time.monotonic()
+        finished = total is not None and done >= total
+        if not (force or finished) and now - self._reported < PROGRESS_INTERVAL:
+            return
+        self._reported = now
+        Job.objects.filter(pk=self.job.pk).update(
+            progress_done=done, progress_total=total, message=message[:200], heartbeat_at=timezone.now()
+        )
+
+    def output_path(self, filename: str) -> Path:
+        directory = job_directory(self.job)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.job.result_file = str(directory / filename)
+        return Path(self.job.result_file)
+
+
+def job_directory(job: Job) -> Path:
+    return Path(settings.JOBS_DIR) / str(job.pk)
+
+
+def submit(kind: str, params: Optional[Dict] = None, user=None) -> Job:
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind {kind!r}")
+    return Job.objects.create(kind=kind, params=params or {}, created_by=user)
+
+
+def claim(worker: str) -> Optional[Job]:
+    """Take the oldest queued job, or None; the status check in the update keeps claims exclusive"""
+    while True:
+        candidate = Job.objects.filter(status='QUEUED').order_by('id').values_list('id', flat=True).first()
+        if candidate is None:
+            return None
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=candidate, status='QUEUED').update(
+            status='RUNNING', worker=worker, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1
+        )
+        if claimed:
+            return Job.objects.get(pk=candidate)
+
+
+def run(job: Job) -> Job:
+    """Run a claimed job to completion and record the outcome"""
+    entry = HANDLERS.get(job.kind)
+    try:
+        if entry is None:
+            raise ValueError(f"Unknown job kind {job.kind!r}")
+        job_run = JobRun(job)
+        result = entry.func(job.params, job_run)
+        Job.objects.filter(pk=job.pk).update(
+            status='DONE', result=result, result_file=job.result_file, message='',
+            finished_at=timezone.now(), heartbeat_at=timezone.now()
+        )
+    except Exception as e:
+        logger.exception("Job %s (%s) failed", job.pk, job.kind)
+        Job.objects.filter(pk=job.pk).update(
+            status='FAILED', error=''.join(traceback.format_exception(e))[-5000:], message=str(e)[:200],
+            finished_at=timezone.now()
+        )
+    job.refresh_from_db()
+    return job
+
+
+def requeue_stale(now: Optional[datetime] = None) -> int:
+    """Queue again jobs whose worker stopped heartbeating; give up after MAX_ATTEMPTS"""
+    cutoff = (now or timezone.now()) - STALE_AFTER
+    stale = Job.objects.filter(status='RUNNING', heartbeat_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status='FAILED', message='Worker stopped responding', finished_at=timezone.now()
+    )
+    return stale.update(status='QUEUED', worker='') + failed
+
+
+def prune(older_than: timedelta) -> int:
+    """Delete finished jobs and their files"""
+    finished = Job.objects.filter(status__in=['DONE', 'FAILED'], finished_at__lt=timezone.now() - older_than)
+    for job in finished.only('id'):
+        shutil.rmtree(job_directory(job), ignore_errors=True)
+    return finished.delete()[0]
+
+
+def work(worker: Optional[str] = None, once: bool = False, poll: float = 1.0,
+         max_jobs: Optional[int] = None) -> int:
+    """Claim and run jobs until the queue is empty (``once``) or ``max_jobs`` have run"""
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    done = 0
+    while max_jobs is None or done < max_jobs:
+        requeue_stale()
+        job = claim(worker)
+        if job is None:
+            if once:
+                break
+            time.sleep(poll)
+            continue
+        logger.info("Running job %s (%s)", job.pk, job.kind)
+        run(job)
+        done += 1
+    return done
+
+
+@handler('holdings_report')
+def holdings_report(params: Dict, run: JobRun):
+    """get_monthly_holdings_report's payload for params['date']"""
+    report_date = ledger.parse_date(params['date'])
+    data = []
+    for row in ledger.holdings_at(report_date).iterator(chunk_size=2000):
+        data.append({**row, 'last_movement_date': row['last_movement_date'].strftime('%Y-%m-%d')})
+        run.progress(len(data), message='Reading holdings')
+    return {'success': True, 'report_date': report_date.strftime('%Y-%m-%d'), 'data': data}
+
+
+@handler('pastel_reconciliation', staff_only=True)
+def pastel_reconciliation(params: Dict, run: JobRun):
+    """Pastel cylinder lines between params['start'] and params['end'] that we hold no document for"""
+    service = PastelService()
+    try:
+        # A window Pastel fails to serve raises PastelUnavailable and fails the job
+        movements = list(service.iter_cylinder_movements(
+            ledger.parse_date(params['start']), ledger.parse_date(params['end']),
+            progress=lambda done, total, window_end: run.progress(
+                done, total, f'Checked invoices up to {window_end:%Y-%m-%d}'
+            ),
+        ))
+    finally:
+        service.api.close()
+    return {'count': len(movements), 'movements': movements}
+
+
+@handler('export')
+def export(params: Dict, run: JobRun):
+    """One of the CSV exports, written to a file for download"""
+    name = params.get('export')
+    if name == 'holdings':
+        rows = exports.holdings_report(ledger.parse_date(params['date']))
+        filename = f"holdings-{params['date']}.csv"
+    elif name == 'documents':
+        customer = Customer.objects.get(account_number=params['account_number'])
+        rows = exports.document_history(customer)
+        filename = f'documents-{customer.account_number}.csv'
+    elif name == 'movements':
+        rows = exports.movements(
+            ledger.parse_date(params['start_date']) if params.get('start_date') else None,
+            ledger.parse_date(params['end_date']) if params.get('end_date') else None,
+            params.get('account_number'),
+        )
+        filename = 'movements.csv'
+    else:
+        raise ValueError(f"Unknown export {name!r}")
+
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for row in rows:
+            yield row
+            count += 1
+            run.progress(count, message='Writing rows')
+
+    chunks = exports.to_csv(counted(rows))
+    if params.get('gzip'):
+        chunks = exports.gzipped(chunks)
+        filename += '.gz'
+    path = run.output_path(filename)
+    size = 0
+    with open(path, 'wb') as handle:
+        for chunk in chunks:
+            handle.write(chunk)
+            size += len(chunk)
+    return {'rows': max(count - 1, 0), 'bytes': size, 'filename': filename}
+
+
+@handler('statements', staff_only=True)
+def month_statements(params: Dict, run: JobRun):
+    """Every active customer's statement for params['month'] (YYYY-MM), written to STATEMENTS_DIR"""
+    run.progress(0, message='Loading statements', force=True)
+    # Reported per statement written, which also keeps the heartbeat going through long runs
+    return statements.generate(
+        datetime.strptime(params['month'], '%Y-%m').date(),
+        settings.STATEMENTS_DIR,
+        params.get('formats') or statements.FORMATS,
+        progress=lambda done, total: run.progress(done, total, 'Writing statements'),
+    )
@@ -0,0 +1,307 @@
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+from . import api_cache
+from .models import Customer, CustomerBalance, CylinderMovement, Document, MonthlyHoldings
+
+
+def parse_date(value: str) -> date:
+    """A YYYY-MM-DD string as a date; the ValueError for anything else names the value"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid date {value!r}, expected YYYY-MM-DD')
+
+
+def month_start(value: Union[str, date]) -> date:
+    """First day of the month containing a date or YYYY-MM-DD string"""
+    if isinstance(value, str):
+        value = parse_date(value)
+    return value.replace(day=1)
+
+
+def document_totals(document) -> Tuple[int, int]:
+    """Return (received, returned) quantities recorded against a document"""
+    totals = CylinderMovement.objects.filter(document=document).aggregate(
+        received=Coalesce(Sum('quantity', filter=Q(movement_type='R')), 0),
+        returned=Coalesce(Sum('quantity', filter=Q(movement_type='E')), 0),
+    )
+    return totals['received'], totals['returned']
+
+
+def movement_total(movement_type: str):
+    """Sum of one movement type for the outer document query, as a correlated subquery"""
+    return Coalesce(Subquery(
+        CylinderMovement.objects.filter(
+            document=OuterRef('pk'), movement_type=movement_type
+        ).order_by().values('document').annotate(total=Sum('quantity')).values('total')
+    ), 0)
+
+
+def holdings_at(report_date: date):
+    """
+    Holdings of every active customer with a non-zero balance at ``report_date``,
+    by account number, in one grouped query. Filtering on documents before
+    annotating restricts the sums to that date.
+    """
+    return Customer.objects.filter(
+        is_active=True,
+        documents__document_date__lte=report_date
+    ).values(
+        'account_number',
+        customer_name=F('name')
+    ).annotate(
+        received=Coalesce(Sum(
+            'documents__movements__quantity',
+            filter=Q(documents__movements__movement_type='R')
+        ), 0),
+        returned=Coalesce(Sum(
+            'documents__movements__quantity',
+            filter=Q(documents__movements__movement_type='E')
+        ), 0),
+        last_movement_date=Max('documents__document_date')
+    ).annotate(
+        holdings=F('received') - F('returned')
+    ).exclude(
+        holdings=0  # Only include customers with non-zero holdings
+    ).order_by(
+        'account_number'
+    ).values(
+        'account_number', 'customer_name', 'holdings', 'last_movement_date'
+    )
+
+
+def _replayed_totals(customer_ids: Optional[Iterable[int]] = None) -> Dict[int, Dict]:
+    """Full replay of movements and documents, grouped per customer"""
+    movements = CylinderMovement.objects.values('document__customer_id').annotate(
+        received=Coalesce(Sum('quantity', filter=Q(movement_type='R')), 0),
+        returned=Coalesce(Sum('quantity', filter=Q(movement_type='E')), 0),
+    )
+    documents = Document.objects.values('customer_id').annotate(
+        document_count=Count('id'),
+        last_movement_date=Max('document_date'),
+    )
+    if customer_ids is not None:
+        customer_ids = list(customer_ids)
+        movements = movements.filter(document__customer_id__in=customer_ids)
+        documents = documents.filter(customer_id__in=customer_ids)
+
+    totals = {}
+    for row in documents:
+        totals[row['customer_id']] = {
+            'balance': 0,
+            'document_count': row['document_count'],
+            'last_movement_date': row['last_movement_date'],
+        }
+    for row in movements:
+        entry = totals.setdefault(row['document__customer_id'], {
+            'balance': 0, 'document_count': 0, 'last_movement_date': None
+        })
+        entry['balance'] = row['received'] - row['returned']
+    return totals
+
+
+def rebuild_balance(customer: Customer, new_version: int = 0) -> CustomerBalance:
+    """Recompute a customer's balance record from its full history; a new record starts at ``new_version``"""
+    replayed = _replayed_totals([customer.pk]).get(customer.pk, {})
+    defaults = {
+        'balance': replayed.get('balance', 0),
+        'document_count': replayed.get('document_count', 0),
+        'last_movement_date': replayed.get('last_movement_date'),
+    }
+    balance, created = CustomerBalance.objects.update_or_create(
+        customer=customer,
+        defaults=defaults,
+        create_defaults={**defaults, 'version': new_version},
+    )
+    if not created:
+        # A repaired balance invalidates any list a client built from the old one
+        CustomerBalance.objects.filter(pk=balance.pk).update(version=F('version') + 1)
+        balance.version += 1
+        api_cache.customer_changed(customer.account_number)
+    return balance
+
+
+def list_version(customer: Customer) -> int:
+    """Current version of a customer's document list (0 before the first document)"""
+    return CustomerBalance.objects.filter(customer=customer).values_list('version', flat=True).first() or 0
+
+
+async def alist_version(customer: Customer) -> int:
+    return await CustomerBalance.objects.filter(customer=customer).values_list('version', flat=True).afirst() or 0
+
+
+def _update_balance(customer: Customer, received: int, returned: int, documents: int):
+    last_date = Document.objects.filter(
+        customer=OuterRef('customer')
+    ).order_by().values('customer').annotate(latest=Max('document_date')).values('latest')
+
+    updated = CustomerBalance.objects.filter(customer=customer).update(
+        balance=F('balance') + (received - returned),
+        document_count=F('document_count') + documents,
+        last_movement_date=Subquery(last_date),
+        version=F('version') + 1,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        # No record yet: build it from history, which already includes this change.
+        # Version 0 is the empty list's, so the new record counts this change as 1
+        rebuild_balance(customer, new_version=1)
+
+
+def _update_monthly(customer: Optional[Customer], month: date, received: int, returned: int):
+    rows = MonthlyHoldings.objects.filter(customer=customer)
+    if not rows.filter(month=month).exists():
+        # Open the month carrying forward the closing balance of the latest earlier month
+        opening = rows.filter(month__lt=month).order_by('-month').values_list(
+            'closing_balance', flat=True
+        ).first() or 0
+        MonthlyHoldings.objects.create(customer=customer, month=month, closing_balance=opening)
+
+    rows.filter(month=month).update(
+        received=F('received') + received,
+        returned=F('returned') + returned,
+    )
+    rows.filter(month__gte=month).update(
+        closing_balance=F('closing_balance') + (received - returned)
+    )
+
+
+def record_movements(
+    customer: Customer,
+    document_date: Union[str, date],
+    received: int = 0,
+    returned: int = 0,
+    documents: int = 0
+):
+    """
+    Apply a change in movements to the customer's stored balance and monthly rollup.
+    Call this after the movements have been written, inside the same transaction.
+    """
+    with transaction.atomic():
+        _update_balance(customer, received, returned, documents)
+        if received or returned:
+            month = month_start(document_date)
+            _update_monthly(customer, month, received, returned)
+            _update_monthly(None, month, received, returned)
+        api_cache.customer_changed(customer.account_number)
+
+
+def rebuild_all():
+    """Rebuild every balance record and the whole monthly rollup from movement history"""
+    replayed = _replayed_totals()
+    grouped = CylinderMovement.objects.annotate(
+        month=TruncMonth('document__document_date')
+    ).values('document__customer_id', 'month').annotate(
+        received=Coalesce(Sum('quantity', filter=Q(movement_type='R')), 0),
+        returned=Coalesce(Sum('quantity', filter=Q(movement_type='E')), 0),
+    ).order_by('document__customer_id', 'month')
+
+    rows = []
+    fleet = {}
+    for row in grouped:
+        rows.append((row['document__customer_id'], row['month'], row['received'], row['returned']))
+        totals = fleet.setdefault(row['month'], [0, 0])
+        totals[0] += row['received']
+        totals[1] += row['returned']
+    rows.extend((None, month, received, returned) for month, (received, returned) in sorted(fleet.items()))
+
+    with transaction.atomic():
+        # Versions carry on from the old records so clients still see a change
+        versions = dict(CustomerBalance.objects.values_list('customer_id', 'version'))
+        CustomerBalance.objects.all().delete()
+        CustomerBalance.objects.bulk_create([
+            CustomerBalance(
+                customer_id=customer_id,
+                version=versions.get(customer_id, 0) + 1,
+                **replayed.get(customer_id, {})
+            )
+            for customer_id in Customer.objects.values_list('pk', flat=True)
+        ], batch_size=1000)
+        MonthlyHoldings.objects.all().delete()
+        MonthlyHoldings.objects.bulk_create(
+            [MonthlyHoldings(**row) for row in monthly_rollup_rows(rows)],
+            batch_size=1000
+        )
+        api_cache.everything_changed()
+
+
+def monthly_rollup_rows(grouped: Iterable[Tuple[Optional[int], date, int, int]]) -> List[Dict]:
+    """
+    Turn (customer_id, month, received, returned) sums into rollup rows with
+    running closing balances. Input must be ordered by customer, then month.
+    """
+    rows = []
+    running = {}
+    for customer_id, month, received, returned in grouped:
+        running[customer_id] = running.get(customer_id, 0) + received - returned
+        rows.append({
+            'customer_id': customer_id,
+            'month': month,
+            'received': received,
+            'returned': returned,
+            'closing_balance': running[customer_id],
+        })
+    return rows
+
+
+def rebuild_monthly_holdings(customer: Optional[Customer] = None):
+    """Recompute the monthly rollup for one customer, or for the fleet total when no customer is given"""
+    movements = CylinderMovement.objects.all()
+    if customer is not None:
+        movements = movements.filter(document__customer=customer)
+    grouped = movements.annotate(
+        month=TruncMonth('document__document_date')
+    ).values('month').annotate(
+        received=Coalesce(Sum('quantity', filter=Q(movement_type='R')), 0),
+        returned=Coalesce(Sum('quantity', filter=Q(movement_type='E')), 0),
+    ).order_by('month')
+
+    customer_id = customer.pk if customer is not None else None
+    rows = monthly_rollup_rows(
+        (customer_id, row['month'], row['received'], row['returned']) for row in grouped
+    )
+    with transaction.atomic():
+        MonthlyHoldings.objects.filter(customer=customer).delete()
+        MonthlyHoldings.objects.bulk_create([MonthlyHoldings(**row) for row in rows])
+        if customer is not None:
+            api_cache.customer_changed(customer.account_number)
+        else:
+            api_cache.everything_changed()
+
+
+def verify_balances(customers=None) -> List[Dict]:
+    """
+    Compare stored balance records against a full replay of movements.
+    Returns one entry per customer whose stored figures disagree.
+    """
+    if customers is None:
+        customers = Customer.objects.all()
+    customers = customers.select_related('balance')
+    replayed = _replayed_totals(customers.values_list('pk', flat=True))
+
+    mismatches = []
+    for customer in customers:
+        expected = replayed.get(customer.pk, {
+            'balance': 0, 'document_count': 0, 'last_movement_date': None
+        })
+        try:
+            stored = customer.balance
+            actual = {
+                'balance': stored.balance,
+                'document_count': stored.document_count,
+                'last_movement_date': stored.last_movement_date,
+            }
+        except CustomerBalance.DoesNotExist:
+            actual = None
+
+        if actual != expected:
+            mismatches.append({
+                'customer': customer,
+                'stored': actual,
+                'expected': expected,
+            })
+    return mismatches
@@ -0,0 +1,78 @@
+import json
+import platform
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from web import benchmarks
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the cylinder API endpoints against synthetic data at several scales. '
+        'Runs against a throwaway test database, never the configured one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales',
+            default='1000,10000,100000',
+            help='Comma-separated movement counts to benchmark (default: 1000,10000,100000)'
+        )
+        parser.add_argument('--customers', type=int, default=100, help='Customers per dataset')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed requests per endpoint')
+        parser.add_argument('--endpoint', action='append', help='Only run this endpoint (repeatable)')
+        parser.add_argument(
+            '--output',
+            help='Where to write the JSON results (default: bench_results/<commit>.json)'
+        )
+
+    def handle(self, *args, **options):
+        scales = sorted(int(scale) for scale in options['scales'].split(','))
+        commit = _git_commit()
+
+        # DEBUG would log every query and distort both timings and memory
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            results = benchmarks.run(
+                scales,
+                customers=options['customers'],
+                repeat=options['repeat'],
+                endpoints=options['endpoint'],
+                log=self.stdout.write,
+            )
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        results.update({
+            'commit': commit,
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'repeat': options['repeat'],
+        })
+
+        output = Path(options['output'] or Path(settings.BASE_DIR) / 'bench_results' / f'{commit}.json')
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+
+        self.stdout.write('\nGrowth with history (log-log slope of p50; ~0 flat, ~1 linear):')
+        for name, exponent in results['growth'].items():
+            self.stdout.write(f'  {name:32} {exponent if exponent is not None else "n/a"}')
+        self.stdout.write(self.style.SUCCESS(f'Results written to {output}'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from web.ledger import rebuild_balance, rebuild_monthly_holdings, verify_balances
+from web.models import Customer
+
+
+class Command(BaseCommand):
+    help = 'Compare stored customer balances against a full replay of cylinder movements'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', help='Only check this account number')
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            help='Rebuild balance records and monthly rollups that do not match the replay'
+        )
+
+    def handle(self, *args, **options):
+        customers = Customer.objects.all()
+        if options['account']:
+            customers = customers.filter(account_number=options['account'])
+
+        mismatches = verify_balances(customers)
+        for mismatch in mismatches:
+            customer = mismatch['customer']
+            self.stdout.write(
+                f"{customer.account_number} {customer.name}: "
+                f"stored {mismatch['stored']}, replay {mismatch['expected']}"
+            )
+            if options['repair']:
+                rebuild_balance(customer)
+                rebuild_monthly_holdings(customer)
+
+        if mismatches and options['repair']:
+            # The fleet total rollup is built from the same movements
+            rebuild_monthly_holdings()
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('All customer balances match'))
+        elif options['repair']:
+            self.stdout.write(self.style.SUCCESS(f'Repaired {len(mismatches)} balance record(s)'))
+        else:
+            self.stdout.write(self.style.ERROR(f'{len(mismatches)} balance record(s) out of step'))
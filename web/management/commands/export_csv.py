@@ -0,0 +1,59 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from web import exports
+from web.ledger import parse_date
+from web.models import Customer
+
+
+class Command(BaseCommand):
+    help = (
+        'Export the holdings report, a customer\'s document history or every movement as CSV. '
+        'Rows are written as they are read, so memory use does not grow with the export.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', choices=['holdings', 'documents', 'movements'])
+        parser.add_argument('--date', type=parse_date, help='Report date for the holdings export')
+        parser.add_argument('--account', help='Customer account (required for documents, optional for movements)')
+        parser.add_argument('--from', dest='start', type=parse_date, help='Earliest document date')
+        parser.add_argument('--to', dest='end', type=parse_date, help='Latest document date')
+        parser.add_argument('--output', '-o', default='-', help='File to write (default: standard output)')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output')
+
+    def handle(self, *args, **options):
+        if options['export'] == 'holdings':
+            if not options['date']:
+                raise CommandError('--date is required for the holdings export')
+            rows = exports.holdings_report(options['date'])
+        elif options['export'] == 'documents':
+            try:
+                customer = Customer.objects.get(account_number=options['account'])
+            except Customer.DoesNotExist:
+                raise CommandError(f"Customer {options['account']} not found")
+            filters = {}
+            if options['start']:
+                filters['document_date__gte'] = options['start']
+            if options['end']:
+                filters['document_date__lte'] = options['end']
+            rows = exports.document_history(customer, Q(**filters))
+        else:
+            rows = exports.movements(options['start'], options['end'], options['account'])
+
+        chunks = exports.to_csv(rows)
+        if options['gzip']:
+            chunks = exports.gzipped(chunks)
+
+        if options['output'] == '-':
+            out = sys.stdout.buffer
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
+            return
+
+        size = 0
+        with open(options['output'], 'wb') as out:
+            for chunk in chunks:
+                out.write(chunk)
+                size += len(chunk)
+        self.stderr.write(self.style.SUCCESS(f"Wrote {size} bytes to {options['output']}"))
@@ -0,0 +1,58 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from web.importer import CHUNK_SIZE, import_movements, read_rows
+from web.ledger import parse_date
+from web.pastel_integration import PastelUnavailable
+from web.services import PastelService
+
+
+class Command(BaseCommand):
+    help = (
+        'Import Pastel invoice lines as documents and cylinder movements, either from '
+        'JSON/CSV files or straight from Pastel for a date range. Existing documents are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='JSON or CSV files of invoice lines')
+        parser.add_argument('--from', dest='start', type=parse_date, help='Fetch from Pastel starting at this date')
+        parser.add_argument('--to', dest='end', type=parse_date, help='Fetch from Pastel up to this date')
+        parser.add_argument('--user', required=True, help='Username recorded as the creator of imported documents')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Documents per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} not found")
+
+        rows = []
+        for path in options['files']:
+            try:
+                rows.extend(read_rows(path))
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Could not read {path}: {e}')
+
+        if options['start'] or options['end']:
+            if not (options['start'] and options['end']):
+                raise CommandError('--from and --to must be given together')
+            service = PastelService()
+            try:
+                rows.extend(service.iter_cylinder_movements(options['start'], options['end']))
+            except PastelUnavailable as e:
+                raise CommandError(str(e))
+            finally:
+                service.api.close()
+
+        if not rows:
+            raise CommandError('Nothing to import: give files or a --from/--to range')
+
+        result = import_movements(rows, user, chunk_size=options['chunk_size'])
+
+        for error in result['errors']:
+            self.stdout.write(self.style.WARNING(
+                f"Row {error['row']} ({error['invoice_number']}): {error['error']}"
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result['documents']} document(s) with {result['movements']} movement(s); "
+            f"skipped {len(result['skipped'])} existing, {len(result['errors'])} row error(s)"
+        ))
@@ -0,0 +1,54 @@
+import json
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from web import benchmarks
+from .benchmark_api import _git_commit
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare read-endpoint throughput under the WSGI and ASGI handlers by replaying '
+        'bursts of dashboard requests concurrently. Runs against a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movements', type=int, default=10000, help='Movements in the synthetic dataset')
+        parser.add_argument('--customers', type=int, default=100, help='Customers in the synthetic dataset')
+        parser.add_argument('--bursts', type=int, default=100, help='Dashboard bursts to replay (5 requests each)')
+        parser.add_argument(
+            '--concurrency', type=int, default=20,
+            help='WSGI worker threads, and requests in flight at once under ASGI'
+        )
+        parser.add_argument(
+            '--output',
+            help='Where to write the JSON results (default: bench_results/<commit>-load.json)'
+        )
+
+    def handle(self, *args, **options):
+        commit = _git_commit()
+
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            results = benchmarks.load_test(
+                options['movements'],
+                customers=options['customers'],
+                bursts=options['bursts'],
+                concurrency=options['concurrency'],
+                log=self.stdout.write,
+            )
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        results['commit'] = commit
+        output = Path(options['output'] or Path(settings.BASE_DIR) / 'bench_results' / f'{commit}-load.json')
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+
+        wsgi, asgi = results['results']['wsgi'], results['results']['asgi']
+        if wsgi['requests_per_second']:
+            self.stdout.write(f"ASGI/WSGI throughput: {asgi['requests_per_second'] / wsgi['requests_per_second']:.2f}x")
+        self.stdout.write(self.style.SUCCESS(f'Results written to {output}'))
@@ -0,0 +1,34 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from web import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued background jobs (reports, exports, statements, Pastel reconciliation). '
+        'Start as many workers as needed; each job is claimed by exactly one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument('--max-jobs', type=int, help='Exit after running this many jobs')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds between checks of an empty queue')
+        parser.add_argument('--worker', help='Name recorded on claimed jobs (default: host:pid)')
+        parser.add_argument(
+            '--prune-days', type=int, default=7,
+            help='Delete finished jobs and their files after this many days (0 keeps them)'
+        )
+
+    def handle(self, *args, **options):
+        if options['prune_days']:
+            pruned = jobs.prune(timedelta(days=options['prune_days']))
+            if pruned:
+                self.stdout.write(f'Pruned {pruned} finished job(s)')
+
+        count = jobs.work(
+            worker=options['worker'],
+            once=options['once'],
+            poll=options['poll'],
+            max_jobs=options['max_jobs'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Ran {count} job(s)'))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from web.ledger import parse_date
+from web.sync import IncrementalSync
+
+
+class Command(BaseCommand):
+    help = (
+        'Incremental Pastel sync: pull invoices newer than the stored cursor and push '
+        'documents marked PENDING_SYNC. Safe to re-run; it resumes from the last checkpoint.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=parse_date, help='Restart the pull from this date (YYYY-MM-DD)')
+        parser.add_argument('--until', type=parse_date, help='Pull up to this date (default: today)')
+        parser.add_argument('--pull-only', action='store_true')
+        parser.add_argument('--push-only', action='store_true')
+
+    def handle(self, *args, **options):
+        sync = IncrementalSync()
+
+        if not options['push_only']:
+            def report(movements):
+                for movement in movements:
+                    self.stdout.write(
+                        f"{movement['invoice_number']} {movement['date']} {movement['customer']} "
+                        f"{movement['item_code']} x{movement['quantity']}"
+                    )
+
+            pulled = sync.pull(report, since=options['since'], until=options['until'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Pulled {pulled['invoices']} new invoice(s) in {pulled['windows']} window(s), "
+                f"{pulled['movements']} potential cylinder movement(s)"
+            ))
+            if pulled['failed_window']:
+                start, end = pulled['failed_window']
+                self.stdout.write(self.style.WARNING(
+                    f"Pastel failed for {start:%Y-%m-%d} to {end:%Y-%m-%d}; the next run resumes there"
+                ))
+
+        if not options['pull_only']:
+            pushed = sync.push()
+            self.stdout.write(self.style.SUCCESS(
+                f"Pushed {pushed['pushed']} document(s) in {pushed['batches']} batch(es), "
+                f"{pushed['rejected']} rejected"
+            ))
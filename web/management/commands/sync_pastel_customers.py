@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from web.models import Customer
+from web.services import PastelService
+
+
+class Command(BaseCommand):
+    help = 'Refresh customer details from Pastel, fetching accounts concurrently'
+
+    def add_arguments(self, parser):
+        parser.add_argument('accounts', nargs='*', help='Account numbers to sync (default: every local customer)')
+        parser.add_argument('--workers', type=int, help='Concurrent Pastel requests')
+
+    def handle(self, *args, **options):
+        accounts = options['accounts'] or list(Customer.objects.values_list('account_number', flat=True))
+        service = PastelService(max_workers=options['workers'])
+        try:
+            result = service.sync_customers(accounts)
+        finally:
+            service.api.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result['created']}, updated {result['updated']}, "
+            f"unchanged {result['unchanged']} customer(s)"
+        ))
+        if result['missing']:
+            self.stdout.write(self.style.WARNING(
+                f"Not found in Pastel: {', '.join(result['missing'])}"
+            ))
+        if result['errors']:
+            self.stdout.write(self.style.ERROR(
+                f"Pastel failed for: {', '.join(result['errors'])}; run again to retry them"
+            ))
@@ -0,0 +1,160 @@
+"""
+In-process metrics registry rendered in the Prometheus text exposition format.
+
+Each worker process keeps its own figures; scrape every worker (or put them
+behind a per-process port) to get fleet-wide numbers.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._buckets: Dict[str, tuple] = {}
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str, buckets: Optional[tuple] = None):
+        self._help[name] = help_text
+        if buckets is not None:
+            self._buckets[name] = buckets
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(self._buckets.get(name, LATENCY_BUCKETS))
+            series[key].observe(value)
+
+    def counter_value(self, name: str, **labels) -> float:
+        return self._counters.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """Render every series in the Prometheus text format"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f'# HELP {name} {self._help.get(name, name)}')
+                lines.append(f'# TYPE {name} counter')
+                for labels, value in sorted(series.items()):
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f'# HELP {name} {self._help.get(name, name)}')
+                lines.append(f'# TYPE {name} histogram')
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        bucket_labels = labels + (('le', _format_value(bound)),)
+                        lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+                    bucket_labels = labels + (('le', '+Inf'),)
+                    lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {histogram.count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(histogram.total)}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+registry = Registry()
+registry.describe('qmc_http_requests_total', 'HTTP requests by view, method and status')
+registry.describe('qmc_http_errors_total', 'HTTP requests that raised or returned a 5xx status')
+registry.describe('qmc_http_request_duration_seconds', 'Request latency by view')
+registry.describe('qmc_http_response_size_bytes', 'Response body size by view', SIZE_BUCKETS)
+registry.describe('qmc_db_queries_per_request', 'Database queries issued per request', QUERY_BUCKETS)
+registry.describe('qmc_db_query_duration_seconds', 'Time spent in the database per request')
+
+
+class QueryStats:
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+# Set by the metrics middleware for the duration of a request. Context
+# variables follow the request into sync_to_async threads, so queries issued
+# by async views are attributed correctly too.
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar('current_query_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper that times queries for the active request"""
+    stats = current_query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.duration += time.perf_counter() - start
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    """connection_created handler adding the query timer to every new connection"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def observe_request(view: str, method: str, status: int, duration: float,
+                    stats: QueryStats, size: Optional[int]):
+    registry.increment('qmc_http_requests_total', view=view, method=method, status=str(status))
+    if status >= 500:
+        registry.increment('qmc_http_errors_total', view=view)
+    registry.observe('qmc_http_request_duration_seconds', duration, view=view)
+    registry.observe('qmc_db_queries_per_request', stats.count, view=view)
+    registry.observe('qmc_db_query_duration_seconds', stats.duration, view=view)
+    if size is not None:
+        registry.observe('qmc_http_response_size_bytes', size, view=view)
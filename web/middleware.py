@@ -0,0 +1,49 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from .metrics import QueryStats, current_query_stats, observe_request
+
+
+class MetricsMiddleware:
+    """Record latency, response size and database usage per URL name"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        start = time.perf_counter()
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            current_query_stats.reset(token)
+            self._observe(request, response, time.perf_counter() - start, stats)
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            current_query_stats.reset(token)
+            self._observe(request, response, time.perf_counter() - start, stats)
+
+    def _observe(self, request, response, duration, stats):
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'unmatched'
+        status = response.status_code if response is not None else 500
+        size = None
+        if response is not None and not response.streaming:
+            size = len(response.content)
+        observe_request(view, request.method, status, duration, stats, size)
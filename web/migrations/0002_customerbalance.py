@@ -0,0 +1,58 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+
+def backfill_balances(apps, schema_editor):
+    Customer = apps.get_model('web', 'Customer')
+    CustomerBalance = apps.get_model('web', 'CustomerBalance')
+    CylinderMovement = apps.get_model('web', 'CylinderMovement')
+    Document = apps.get_model('web', 'Document')
+
+    balances = {
+        row['document__customer_id']: (row['received'] or 0) - (row['returned'] or 0)
+        for row in CylinderMovement.objects.values('document__customer_id').annotate(
+            received=Sum('quantity', filter=Q(movement_type='R')),
+            returned=Sum('quantity', filter=Q(movement_type='E')),
+        )
+    }
+    documents = {
+        row['customer_id']: row
+        for row in Document.objects.values('customer_id').annotate(
+            document_count=Count('id'),
+            last_movement_date=Max('document_date'),
+        )
+    }
+    CustomerBalance.objects.bulk_create([
+        CustomerBalance(
+            customer_id=customer_id,
+            balance=balances.get(customer_id, 0),
+            document_count=documents.get(customer_id, {}).get('document_count', 0),
+            last_movement_date=documents.get(customer_id, {}).get('last_movement_date'),
+        )
+        for customer_id in Customer.objects.values_list('id', flat=True)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.IntegerField(default=0)),
+                ('last_movement_date', models.DateField(blank=True, null=True)),
+                ('document_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='balance', to='web.customer')),
+            ],
+        ),
+        migrations.RunPython(backfill_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncMonth
+
+
+def backfill_monthly_holdings(apps, schema_editor):
+    CylinderMovement = apps.get_model('web', 'CylinderMovement')
+    MonthlyHoldings = apps.get_model('web', 'MonthlyHoldings')
+
+    grouped = CylinderMovement.objects.annotate(
+        month=TruncMonth('document__document_date')
+    ).values('document__customer_id', 'month').annotate(
+        received=Sum('quantity', filter=Q(movement_type='R')),
+        returned=Sum('quantity', filter=Q(movement_type='E')),
+    ).order_by('document__customer_id', 'month')
+
+    rows = []
+    running = {}
+    fleet = {}
+    for row in grouped:
+        customer_id = row['document__customer_id']
+        received, returned = row['received'] or 0, row['returned'] or 0
+        running[customer_id] = running.get(customer_id, 0) + received - returned
+        rows.append(MonthlyHoldings(
+            customer_id=customer_id,
+            month=row['month'],
+            received=received,
+            returned=returned,
+            closing_balance=running[customer_id],
+        ))
+        totals = fleet.setdefault(row['month'], [0, 0])
+        totals[0] += received
+        totals[1] += returned
+
+    fleet_balance = 0
+    for month in sorted(fleet):
+        received, returned = fleet[month]
+        fleet_balance += received - returned
+        rows.append(MonthlyHoldings(
+            customer_id=None,
+            month=month,
+            received=received,
+            returned=returned,
+            closing_balance=fleet_balance,
+        ))
+    MonthlyHoldings.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0002_customerbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyHoldings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('received', models.IntegerField(default=0)),
+                ('returned', models.IntegerField(default=0)),
+                ('closing_balance', models.IntegerField(default=0)),
+                ('customer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='monthly_holdings', to='web.customer')),
+            ],
+            options={
+                'ordering': ['month'],
+                'constraints': [models.UniqueConstraint(fields=('customer', 'month'), name='unique_customer_month'), models.UniqueConstraint(condition=models.Q(('customer__isnull', True)), fields=('month',), name='unique_fleet_month')],
+            },
+        ),
+        migrations.RunPython(backfill_monthly_holdings, migrations.RunPython.noop),
+    ]
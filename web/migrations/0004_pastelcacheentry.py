@@ -0,0 +1,26 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0003_monthlyholdings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PastelCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('payload', models.JSONField(null=True)),
+                ('etag', models.CharField(blank=True, max_length=200)),
+                ('last_modified', models.CharField(blank=True, max_length=100)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('fetched_at', models.DateTimeField(help_text='When Pastel last confirmed this copy')),
+                ('changed_at', models.DateTimeField(help_text='When the content last changed')),
+            ],
+        ),
+    ]
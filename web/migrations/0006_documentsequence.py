@@ -0,0 +1,34 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+
+def seed_sequences(apps, schema_editor):
+    Document = apps.get_model('web', 'Document')
+    DocumentSequence = apps.get_model('web', 'DocumentSequence')
+    for prefix in ('IN', 'NR'):
+        last_number = Document.objects.filter(
+            document_number__startswith=prefix
+        ).order_by('-document_number').values_list('document_number', flat=True).first()
+        digits = ''.join(filter(str.isdigit, last_number or ''))
+        DocumentSequence.objects.create(prefix=prefix, next_value=int(digits or 0) + 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0005_synccursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(max_length=2, unique=True)),
+                ('next_value', models.PositiveIntegerField(default=1)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
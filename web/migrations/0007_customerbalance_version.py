@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0006_documentsequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customerbalance',
+            name='version',
+            field=models.PositiveIntegerField(default=0, help_text="Bumped on every change to the customer's documents; clients use it to spot a stale list"),
+        ),
+    ]
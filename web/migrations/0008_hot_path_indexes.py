@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0007_customerbalance_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cylindermovement',
+            index=models.Index(fields=['document', 'movement_type', 'quantity'], name='movement_document_type'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['customer', 'document_date'], name='document_customer_date'),
+        ),
+    ]
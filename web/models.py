@@ -1,8 +1,11 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 import re
+from asgiref.sync import sync_to_async
+from . import api_cache
 
 class Customer(models.Model):
     name = models.CharField(max_length=200)
@@ -25,34 +28,20 @@ class Customer(models.Model):
             raise ValidationError({'account_number': 'Account number must be exactly 6 digits'})
 
     def get_total_holdings(self):
-        # Get all movements ordered by document date and document type
-        movements = CylinderMovement.objects.filter(
-            document__customer=self
-        ).select_related('document').order_by(
-            'document__document_date',  # Order by date first
-            'document__document_type',  # Then by document type (IN before NR)
-            'document__created_at'      # Finally by creation time
-        )
-        
-        # Debug print
-        print(f"\nCalculating holdings for {self.name}")
-        print("Initial total: 0")
-        
-        running_total = 0
-        for movement in movements:
-            old_total = running_total
-            doc = movement.document
-            if movement.movement_type == 'R':
-                running_total += movement.quantity
-                print(f"+ Received {movement.quantity} from {doc.document_number} ({doc.document_date})")
-                print(f"  New total: {old_total} + {movement.quantity} = {running_total}")
-            else:  # 'E' for Empty Return
-                running_total -= movement.quantity
-                print(f"- Returned {movement.quantity} from {doc.document_number} ({doc.document_date})")
-                print(f"  New total: {old_total} - {movement.quantity} = {running_total}")
-        
-        print(f"Final holdings: {running_total}")
-        return running_total
+        """Current holdings, read from the maintained balance record"""
+        try:
+            return self.balance.balance
+        except CustomerBalance.DoesNotExist:
+            from .ledger import rebuild_balance
+            return rebuild_balance(self).balance
+
+    async def aget_total_holdings(self):
+        """get_total_holdings for async views; load the customer with select_related('balance')"""
+        try:
+            return self.balance.balance
+        except CustomerBalance.DoesNotExist:
+            from .ledger import rebuild_balance
+            return (await sync_to_async(rebuild_balance)(self)).balance
 
     def get_monthly_movements(self, year, month):
         start_date = timezone.datetime(year, month, 1)
@@ -82,10 +71,19 @@ class Customer(models.Model):
         
         # Call the parent save method
         super().save(*args, **kwargs)
+        api_cache.customer_changed(self.account_number)
         
         # Force a refresh from DB after save
         self.refresh_from_db()
 
+def format_document_number(prefix, value):
+    return f"{prefix}{str(value).zfill(6)}"
+
+def document_number_value(document_number):
+    """Numeric part of a document number, or None if it has none"""
+    digits = ''.join(filter(str.isdigit, document_number or ''))
+    return int(digits) if digits else None
+
 class Document(models.Model):
     DOCUMENT_TYPES = [
         ('IN', 'Tax Invoice'),
@@ -106,19 +104,8 @@ class Document(models.Model):
 
     @staticmethod
     def generate_next_number(doc_type):
-        """Generate next document number based on type"""
-        prefix = doc_type
-        last_doc = Document.objects.filter(
-            document_number__startswith=prefix
-        ).order_by('-document_number').first()
-        
-        if not last_doc:
-            return f"{prefix}000001"
-            
-        # Extract number part and increment
-        num_part = ''.join(filter(str.isdigit, last_doc.document_number))
-        next_num = str(int(num_part) + 1).zfill(6)
-        return f"{prefix}{next_num}"
+        """Allocate the next document number for a type from its sequence"""
+        return format_document_number(doc_type, DocumentSequence.reserve(doc_type)[0])
 
     def clean(self):
         # Auto-generate document number if not provided
@@ -149,6 +136,14 @@ class Document(models.Model):
     def __str__(self):
         return f"{self.get_document_type_display()} - {self.document_number} - {self.customer.name}"
 
+    class Meta:
+        indexes = [
+            # A customer's history by date; SQLite appends the id, which serves the keyset order too
+            models.Index(fields=['customer', 'document_date'], name='document_customer_date'),
+            # Date ranges across customers and the admin's date drill-down
+            models.Index(fields=['document_date'], name='document_date'),
+        ]
+
 class CylinderMovement(models.Model):
     MOVEMENT_TYPES = [
         ('R', 'Received'),
@@ -174,6 +169,12 @@ class CylinderMovement(models.Model):
     def __str__(self):
         return f"{self.document.document_number} - {self.get_movement_type_display()}: {self.quantity}"
 
+    class Meta:
+        indexes = [
+            # Covers the received/returned sums per document without touching the table
+            models.Index(fields=['document', 'movement_type', 'quantity'], name='movement_document_type'),
+        ]
+
 class DocumentAudit(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='audits')
     action = models.CharField(max_length=20, choices=[
@@ -187,3 +188,179 @@ class DocumentAudit(models.Model):
     
     def __str__(self):
         return f"{self.document.document_number} - {self.action} by {self.user}"
+
+
+class CustomerBalance(models.Model):
+    """Denormalized holdings per customer, kept in step with document writes"""
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, related_name='balance')
+    balance = models.IntegerField(default=0)
+    last_movement_date = models.DateField(null=True, blank=True)
+    document_count = models.PositiveIntegerField(default=0)
+    version = models.PositiveIntegerField(
+        default=0,
+        help_text="Bumped on every change to the customer's documents; clients use it to spot a stale list"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.customer.account_number}: {self.balance}"
+
+class MonthlyHoldings(models.Model):
+    """Monthly rollup of movements per customer; rows without a customer hold the fleet total"""
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='monthly_holdings'
+    )
+    month = models.DateField(help_text="First day of the month")
+    received = models.IntegerField(default=0)
+    returned = models.IntegerField(default=0)
+    closing_balance = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['month']
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'month'], name='unique_customer_month'),
+            models.UniqueConstraint(
+                fields=['month'],
+                condition=models.Q(customer__isnull=True),
+                name='unique_fleet_month'
+            ),
+        ]
+
+    def __str__(self):
+        scope = self.customer.account_number if self.customer_id else 'All customers'
+        return f"{scope} {self.month:%Y-%m}: {self.closing_balance}"
+
+class PastelCacheEntry(models.Model):
+    """Local copy of a rarely-changing Pastel dataset (item catalogue, customer records)"""
+    key = models.CharField(max_length=100, unique=True)
+    payload = models.JSONField(null=True)
+    etag = models.CharField(max_length=200, blank=True)
+    last_modified = models.CharField(max_length=100, blank=True)
+    content_hash = models.CharField(max_length=64)
+    fetched_at = models.DateTimeField(help_text="When Pastel last confirmed this copy")
+    changed_at = models.DateTimeField(help_text="When the content last changed")
+
+    def __str__(self):
+        return f"{self.key} (fetched {self.fetched_at:%Y-%m-%d %H:%M})"
+
+
+class SyncCursor(models.Model):
+    """Checkpoint of an incremental Pastel sync stream"""
+    stream = models.CharField(max_length=50, unique=True)
+    last_date = models.DateField(null=True, blank=True)
+    last_number = models.CharField(max_length=20, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.stream}: {self.last_date} {self.last_number}".strip()
+
+class ChangeEvent(models.Model):
+    """A committed document change, replayed to open dashboards over server-sent events"""
+    account_number = models.CharField(max_length=15)
+    kind = models.CharField(max_length=32)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account_number', 'id'], name='change_event_customer'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.kind} {self.account_number}"
+
+class Job(models.Model):
+    """A background task run by the ``run_jobs`` worker; see web.jobs"""
+    STATUSES = [
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUSES, default='QUEUED')
+    progress_done = models.PositiveIntegerField(default=0)
+    progress_total = models.PositiveIntegerField(null=True, blank=True)
+    message = models.CharField(max_length=200, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    result_file = models.CharField(max_length=500, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='job_status'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.kind} ({self.status})"
+
+class DocumentSequence(models.Model):
+    """
+    Next free document number per type. Numbers are handed out with an atomic
+    increment, so concurrent saves never scan documents or collide; a number
+    reserved by a save that later fails is simply skipped.
+    """
+    prefix = models.CharField(max_length=2, unique=True)
+    next_value = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @staticmethod
+    def highest_used(prefix):
+        """Largest number already used by documents with this prefix (0 if none)"""
+        # A range on the unique index rather than LIKE 'IN%', which SQLite can't seek on
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        last_number = Document.objects.filter(
+            document_number__gte=prefix, document_number__lt=upper
+        ).order_by('-document_number').values_list('document_number', flat=True).first()
+        return document_number_value(last_number) or 0
+
+    @classmethod
+    def reserve(cls, prefix, count=1):
+        """Reserve ``count`` consecutive numbers for a prefix and return them as a range"""
+        with transaction.atomic():
+            updated = cls.objects.filter(prefix=prefix).update(
+                next_value=F('next_value') + count,
+                updated_at=timezone.now()
+            )
+            if not updated:
+                # First use of this prefix: start after anything already on file
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(prefix=prefix, next_value=cls.highest_used(prefix) + 1 + count)
+                except IntegrityError:
+                    # Another worker created it first
+                    cls.objects.filter(prefix=prefix).update(next_value=F('next_value') + count)
+            end = cls.objects.filter(prefix=prefix).values_list('next_value', flat=True).get()
+        return range(end - count, end)
+
+    @classmethod
+    def observe(cls, prefix, value):
+        """Move the sequence past a number that was entered by hand or imported"""
+        if value is None:
+            return
+        updated = cls.objects.filter(prefix=prefix, next_value__lte=value).update(
+            next_value=value + 1,
+            updated_at=timezone.now()
+        )
+        if not updated and not cls.objects.filter(prefix=prefix).exists():
+            try:
+                with transaction.atomic():
+                    cls.objects.create(prefix=prefix, next_value=max(value, cls.highest_used(prefix)) + 1)
+            except IntegrityError:
+                cls.objects.filter(prefix=prefix, next_value__lte=value).update(next_value=value + 1)
+
+    def __str__(self):
+        return f"{self.prefix}: next {self.next_value}"
@@ -0,0 +1,138 @@
+"""
+Local mirror of the Pastel item catalogue and customer records.
+
+Reads are served from PastelCacheEntry rows. Within the TTL a read never
+touches Pastel; past it the stale copy is returned straight away and
+revalidated (in a background thread by default) with ETag / Last-Modified
+validators, falling back to a content hash when Pastel sends neither.
+"""
+import hashlib
+import json
+import logging
+import threading
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from .metrics import registry
+from .models import PastelCacheEntry
+from .pastel_integration import PastelAPI
+
+logger = logging.getLogger(__name__)
+
+registry.describe('qmc_pastel_cache_requests_total', 'Pastel mirror reads by dataset and result (hit, stale, miss)')
+registry.describe('qmc_pastel_cache_revalidations_total', 'Pastel mirror revalidations by dataset and outcome')
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def content_hash(payload: Any) -> str:
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()
+    ).hexdigest()
+
+
+class PastelCache:
+    def __init__(self, api: PastelAPI, background: Optional[bool] = None):
+        self.api = api
+        if background is None:
+            background = getattr(settings, 'PASTEL_CACHE_BACKGROUND_REFRESH', True)
+        self.background = background
+
+    def get_cylinder_items(self) -> List[Dict]:
+        """Cylinder items from the local catalogue mirror"""
+        return self._get(
+            'items', 'items:CYLINDERS', 'items', {'category': 'CYLINDERS'},
+            getattr(settings, 'PASTEL_ITEMS_TTL', 86400)
+        ) or []
+
+    def get_customer(self, account_code: str) -> Optional[Dict]:
+        """A Pastel customer record from the local mirror"""
+        return self._get(
+            'customers', f'customer:{account_code}', f'customers/{account_code}', None,
+            getattr(settings, 'PASTEL_CUSTOMERS_TTL', 3600)
+        )
+
+    def _get(self, dataset: str, key: str, path: str, params: Optional[Dict], ttl: int):
+        entry = PastelCacheEntry.objects.filter(key=key).first()
+        if entry is None:
+            registry.increment('qmc_pastel_cache_requests_total', dataset=dataset, result='miss')
+            entry = self.revalidate(dataset, key, path, params)
+            return entry.payload if entry else None
+
+        if timezone.now() - entry.fetched_at < timedelta(seconds=ttl):
+            registry.increment('qmc_pastel_cache_requests_total', dataset=dataset, result='hit')
+        else:
+            # Serve the stale copy now and bring it up to date behind the caller
+            registry.increment('qmc_pastel_cache_requests_total', dataset=dataset, result='stale')
+            if self.background:
+                self._revalidate_in_background(dataset, key, path, params)
+            else:
+                self.revalidate(dataset, key, path, params)
+        return entry.payload
+
+    def _revalidate_in_background(self, dataset, key, path, params):
+        with _refreshing_lock:
+            if key in _refreshing:
+                return
+            _refreshing.add(key)
+
+        def run():
+            try:
+                self.revalidate(dataset, key, path, params)
+            finally:
+                with _refreshing_lock:
+                    _refreshing.discard(key)
+                close_old_connections()
+
+        threading.Thread(target=run, name=f'pastel-cache-{key}', daemon=True).start()
+
+    def revalidate(self, dataset: str, key: str, path: str, params: Optional[Dict]) -> Optional[PastelCacheEntry]:
+        """Check the mirrored copy against Pastel and store any change"""
+        entry = PastelCacheEntry.objects.filter(key=key).first()
+        status, data, headers = self.api.get_conditional(
+            path, params,
+            etag=entry.etag if entry else '',
+            last_modified=entry.last_modified if entry else ''
+        )
+        now = timezone.now()
+
+        if status == 304 and entry:
+            outcome = 'not_modified'
+            entry.fetched_at = now
+            entry.save(update_fields=['fetched_at'])
+        elif status == 200:
+            digest = content_hash(data)
+            if entry and entry.content_hash == digest:
+                outcome = 'unchanged'
+            else:
+                outcome = 'changed'
+                if entry is None:
+                    entry = PastelCacheEntry(key=key)
+                entry.payload = data
+                entry.content_hash = digest
+                entry.changed_at = now
+            entry.etag = headers.get('ETag', '')
+            entry.last_modified = headers.get('Last-Modified', '')
+            entry.fetched_at = now
+            entry.save()
+        else:
+            # Unreachable or not found: keep whatever copy we have
+            outcome = 'error'
+            logger.warning(f"Could not revalidate Pastel cache entry {key} (status {status})")
+
+        registry.increment('qmc_pastel_cache_revalidations_total', dataset=dataset, outcome=outcome)
+        return entry
+
+    @staticmethod
+    def stats() -> Dict[str, Dict[str, float]]:
+        """Hit/stale/miss counts per dataset for this process"""
+        return {
+            dataset: {
+                result: registry.counter_value('qmc_pastel_cache_requests_total', dataset=dataset, result=result)
+                for result in ('hit', 'stale', 'miss')
+            }
+            for dataset in ('items', 'customers')
+        }
@@ -1,41 +1,98 @@
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+import logging
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+class PastelUnavailable(Exception):
+    """Pastel could not be reached or failed to answer"""
+
+    def __init__(self, message: str = '', window: Optional[Tuple] = None):
+        super().__init__(message)
+        # The (start, end) dates of an invoice window that could not be fetched
+        self.window = window
+
 class PastelAPI:
-    def __init__(self, base_url: str, api_key: str):
+    def __init__(self, base_url: str, api_key: str, timeout: float = 10, pool_size: int = 10):
         self.base_url = base_url
+        self.timeout = timeout
         self.headers = {
             'Authorization': f'Bearer {api_key}',
             'Content-Type': 'application/json'
         }
+        # One pooled keep-alive session shared by every call (and every worker thread)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def get_conditional(
+        self,
+        path: str,
+        params: Optional[Dict] = None,
+        etag: str = '',
+        last_modified: str = ''
+    ) -> Tuple[Optional[int], Any, Dict]:
+        """
+        GET with If-None-Match / If-Modified-Since validators.
+        Returns (status, data, headers); status is None if Pastel could not be reached.
+        """
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        try:
+            response = self.session.get(
+                f"{self.base_url}/{path}",
+                params=params,
+                headers=headers,
+                timeout=self.timeout
+            )
+            data = response.json() if response.status_code == 200 else None
+            return response.status_code, data, response.headers
+        except Exception as e:
+            logger.error(f"Error fetching {path}: {str(e)}")
+            return None, None, {}
 
     def get_customer(self, account_code: str) -> Optional[Dict]:
-        """Fetch customer details from Pastel"""
+        """
+        Fetch customer details from Pastel; None if Pastel has no such customer.
+        Raises PastelUnavailable if the call failed.
+        """
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/customers/{account_code}",
-                headers=self.headers
+                timeout=self.timeout
             )
-            if response.status_code == 200:
-                return response.json()
-            return None
         except Exception as e:
-            print(f"Error fetching customer: {str(e)}")
+            logger.error(f"Error fetching customer: {str(e)}")
+            raise PastelUnavailable(str(e))
+        if response.status_code == 200:
+            return response.json()
+        if response.status_code == 404:
             return None
+        logger.error(f"Pastel returned {response.status_code} for customer {account_code}")
+        raise PastelUnavailable(f"Pastel returned {response.status_code}")
 
     def get_invoice(self, invoice_number: str) -> Optional[Dict]:
         """Fetch invoice details from Pastel"""
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/invoices/{invoice_number}",
-                headers=self.headers
+                timeout=self.timeout
             )
             if response.status_code == 200:
                 return response.json()
             return None
         except Exception as e:
-            print(f"Error fetching invoice: {str(e)}")
+            logger.error(f"Error fetching invoice: {str(e)}")
             return None
 
     def get_invoices_by_date_range(
@@ -43,8 +100,11 @@ class PastelAPI:
         start_date: datetime, 
         end_date: datetime,
         account_code: Optional[str] = None
-    ) -> List[Dict]:
-        """Fetch invoices within a date range, optionally filtered by customer"""
+    ) -> Optional[List[Dict]]:
+        """
+        Fetch invoices within a date range, optionally filtered by customer.
+        Returns None if the call failed, so callers can tell it from an empty range.
+        """
         params = {
             'start_date': start_date.strftime('%Y-%m-%d'),
             'end_date': end_date.strftime('%Y-%m-%d'),
@@ -53,29 +113,49 @@ class PastelAPI:
             params['account_code'] = account_code
 
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/invoices",
                 params=params,
-                headers=self.headers
+                timeout=self.timeout
             )
             if response.status_code == 200:
                 return response.json()
-            return []
+            logger.error(f"Pastel returned {response.status_code} for invoices {params}")
+            return None
         except Exception as e:
-            print(f"Error fetching invoices: {str(e)}")
-            return []
+            logger.error(f"Error fetching invoices: {str(e)}")
+            return None
 
     def get_cylinder_items(self) -> List[Dict]:
         """Fetch all cylinder-related items from Pastel"""
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/items",
                 params={'category': 'CYLINDERS'},  # Assuming there's a category filter
-                headers=self.headers
+                timeout=self.timeout
             )
             if response.status_code == 200:
                 return response.json()
             return []
         except Exception as e:
-            print(f"Error fetching cylinder items: {str(e)}")
-            return [] 
\ No newline at end of file
+            logger.error(f"Error fetching cylinder items: {str(e)}")
+            return [] 
+
+    def push_documents(self, documents: List[Dict]) -> Optional[List[str]]:
+        """
+        Send locally created documents to Pastel.
+        Returns the document numbers Pastel accepted, or None if the call failed.
+        """
+        try:
+            response = self.session.post(
+                f"{self.base_url}/documents",
+                json=documents,
+                timeout=self.timeout
+            )
+            if response.status_code in (200, 201):
+                return response.json().get('accepted', [])
+            logger.error(f"Pastel rejected document push: {response.status_code}")
+            return None
+        except Exception as e:
+            logger.error(f"Error pushing documents: {str(e)}")
+            return None
@@ -1,64 +1,188 @@
-from datetime import datetime
-from typing import List, Dict
-from .pastel_integration import PastelAPI
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Tuple
+from .pastel_integration import PastelAPI, PastelUnavailable
+from .pastel_cache import PastelCache
+from . import api_cache
 from django.conf import settings
+from django.db import transaction
 from .models import Document, CylinderMovement, Customer
 
+CUSTOMER_FIELDS = ['name', 'contact_person', 'phone_number', 'email', 'address']
+
+def date_windows(start_date, end_date, window_days: int) -> Iterator[Tuple]:
+    """Split an inclusive date range into consecutive inclusive windows"""
+    step = timedelta(days=window_days)
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(window_start + step - timedelta(days=1), end_date)
+        yield window_start, window_end
+        window_start = window_end + timedelta(days=1)
+
+def existing_document_numbers(numbers: Iterable[str], chunk_size: int = 500) -> Set[str]:
+    """Which of these document numbers we already have, one query per chunk"""
+    numbers = list(set(numbers))
+    known = set()
+    for i in range(0, len(numbers), chunk_size):
+        known.update(Document.objects.filter(
+            document_number__in=numbers[i:i + chunk_size]
+        ).values_list('document_number', flat=True))
+    return known
+
+def customer_defaults(pastel_customer: Dict) -> Dict:
+    """Map a Pastel customer record onto Customer fields"""
+    return {
+        'name': pastel_customer['name'],
+        'contact_person': pastel_customer.get('contact_person', ''),
+        'phone_number': pastel_customer.get('telephone', ''),
+        'email': pastel_customer.get('email', ''),
+        'address': pastel_customer.get('physical_address', '')
+    }
+
 class PastelService:
-    def __init__(self):
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers or getattr(settings, 'PASTEL_SYNC_WORKERS', 8)
         self.api = PastelAPI(
             settings.PASTEL_API_URL,
-            settings.PASTEL_API_KEY
+            settings.PASTEL_API_KEY,
+            timeout=getattr(settings, 'PASTEL_API_TIMEOUT', 10),
+            pool_size=self.max_workers
         )
+        # Items and customer records change rarely: read them from the local mirror
+        self.mirror = PastelCache(self.api)
 
     def sync_customer(self, account_number: str) -> bool:
         """Sync customer data from Pastel"""
-        pastel_customer = self.api.get_customer(account_number)
+        pastel_customer = self.mirror.get_customer(account_number)
         if not pastel_customer:
             return False
 
         Customer.objects.update_or_create(
             account_number=account_number,
-            defaults={
-                'name': pastel_customer['name'],
-                'contact_person': pastel_customer.get('contact_person', ''),
-                'phone_number': pastel_customer.get('telephone', ''),
-                'email': pastel_customer.get('email', ''),
-                'address': pastel_customer.get('physical_address', '')
-            }
+            defaults=customer_defaults(pastel_customer)
         )
         return True
 
-    def check_cylinder_movements(self, start_date: datetime, end_date: datetime) -> List[Dict]:
+    def sync_customers(self, account_numbers: Iterable[str], batch_size: int = 500) -> Dict:
         """
-        Check Pastel invoices for cylinder movements that might need to be recorded
-        Returns list of potential movements that aren't in our system
+        Sync many customers from Pastel: fetch concurrently over the pooled session,
+        then apply all changes with bulk writes in a single transaction
+        """
+        account_numbers = list(dict.fromkeys(a.strip() for a in account_numbers if a and a.strip()))
+        failed = object()
+
+        def fetch(account):
+            try:
+                return self.api.get_customer(account)
+            except PastelUnavailable:
+                return failed
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            fetched = dict(zip(account_numbers, pool.map(fetch, account_numbers)))
+
+        # Accounts Pastel could not answer for are left alone and reported apart from missing ones
+        errors = [account for account, data in fetched.items() if data is failed]
+        found = {account: data for account, data in fetched.items() if data and data is not failed}
+        missing = [account for account, data in fetched.items() if not data]
+
+        with transaction.atomic():
+            existing = Customer.objects.in_bulk(list(found), field_name='account_number')
+            to_update = []
+            to_create = []
+            for account, data in found.items():
+                defaults = customer_defaults(data)
+                customer = existing.get(account)
+                if customer is None:
+                    to_create.append(Customer(account_number=account, is_active=True, **defaults))
+                elif any(getattr(customer, field) != value for field, value in defaults.items()):
+                    for field, value in defaults.items():
+                        setattr(customer, field, value)
+                    to_update.append(customer)
+
+            Customer.objects.bulk_create(to_create, batch_size=batch_size)
+            Customer.objects.bulk_update(to_update, CUSTOMER_FIELDS, batch_size=batch_size)
+            for customer in to_update:
+                api_cache.customer_changed(customer.account_number)
+
+        return {
+            'created': len(to_create),
+            'updated': len(to_update),
+            'unchanged': len(found) - len(to_create) - len(to_update),
+            'missing': missing,
+            'errors': errors,
+        }
+
+    def invoice_windows(self, start_date, end_date, window_days: int = None) -> Iterator[Tuple]:
         """
-        # Get all cylinder-related items from Pastel
-        cylinder_items = {
-            item['code']: item['description'] 
-            for item in self.api.get_cylinder_items()
+        Pastel invoices for an inclusive date range, fetched one window at a time
+        and yielded as (window_start, window_end, invoices). Raises
+        PastelUnavailable for a window Pastel fails to serve, rather than passing
+        it off as a window without invoices.
+        """
+        window_days = window_days or getattr(settings, 'PASTEL_SYNC_WINDOW_DAYS', 7)
+        for window_start, window_end in date_windows(start_date, end_date, window_days):
+            invoices = self.api.get_invoices_by_date_range(window_start, window_end)
+            if invoices is None:
+                raise PastelUnavailable(
+                    f"Could not fetch invoices for {window_start:%Y-%m-%d} to {window_end:%Y-%m-%d}",
+                    window=(window_start, window_end)
+                )
+            yield window_start, window_end, invoices
+
+    def iter_cylinder_movements(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        window_days: int = None,
+        progress: Callable[[int, int, datetime], None] = None
+    ) -> Iterator[Dict]:
+        """
+        Yield Pastel invoice lines for cylinder items that aren't in our system yet.
+        The range is fetched one date window at a time, and each window's invoice
+        numbers are checked against our documents with a single lookup.
+        ``progress(done, total, window_end)`` is called after each window.
+        """
+        window_days = window_days or getattr(settings, 'PASTEL_SYNC_WINDOW_DAYS', 7)
+        total = sum(1 for _ in date_windows(start_date, end_date, window_days))
+
+        cylinder_items = self.cylinder_items()
+        windows = self.invoice_windows(start_date, end_date, window_days)
+        for done, (window_start, window_end, invoices) in enumerate(windows, start=1):
+            yield from self.potential_movements(invoices, cylinder_items)
+            if progress is not None:
+                progress(done, total, window_end)
+
+    def cylinder_items(self) -> Dict[str, str]:
+        """Cylinder item codes and descriptions from the local catalogue mirror"""
+        return {
+            item['code']: item['description']
+            for item in self.mirror.get_cylinder_items()
         }
 
-        # Get invoices from the date range
-        invoices = self.api.get_invoices_by_date_range(start_date, end_date)
-        
-        potential_movements = []
+    def potential_movements(self, invoices: List[Dict], cylinder_items: Dict[str, str]) -> Iterator[Dict]:
+        """Cylinder lines on invoices we don't have yet, with one lookup for the whole batch"""
+        known = existing_document_numbers(invoice['number'] for invoice in invoices)
+
         for invoice in invoices:
             # Skip if we already have this document
-            if Document.objects.filter(document_number=invoice['number']).exists():
+            if invoice['number'] in known:
                 continue
 
             # Check each line item for cylinder movements
             for line in invoice['lines']:
                 if line['item_code'] in cylinder_items:
-                    potential_movements.append({
+                    yield {
                         'invoice_number': invoice['number'],
                         'date': invoice['date'],
                         'customer': invoice['account_code'],
                         'item_code': line['item_code'],
                         'description': cylinder_items[line['item_code']],
                         'quantity': line['quantity']
-                    })
+                    }
 
-        return potential_movements 
\ No newline at end of file
+    def check_cylinder_movements(self, start_date: datetime, end_date: datetime) -> List[Dict]:
+        """
+        Check Pastel invoices for cylinder movements that might need to be recorded
+        Returns list of potential movements that aren't in our system
+        """
+        return list(self.iter_cylinder_movements(start_date, end_date))
@@ -0,0 +1,264 @@
+"""
+Month-end customer statements.
+
+``build_statements`` loads a month for every active customer in two queries:
+opening balances from the monthly rollup, and the month's documents with
+their received/returned totals. ``generate`` renders the statements as CSV,
+HTML or PDF across a process pool and writes them to
+``<output>/<YYYY-MM>/<account>.<format>`` with a ``summary.csv``. Rendering
+needs no database, so workers only receive plain statement dicts.
+"""
+import csv
+import html
+import io
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+import django
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from . import ledger
+from .models import Customer, Document, MonthlyHoldings
+
+FORMATS = ('csv', 'html', 'pdf')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'html': 'text/html; charset=utf-8',
+    'pdf': 'application/pdf',
+}
+# Below this many statements a pool costs more than it saves
+POOL_THRESHOLD = 50
+
+
+def next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def build_statements(month: date, accounts: Optional[Iterable[str]] = None) -> Iterator[Dict]:
+    """Statements for ``month`` for every active customer (or the given accounts), by account number"""
+    start, end = ledger.month_start(month), next_month(ledger.month_start(month))
+
+    active = Customer.objects.filter(is_active=True)
+    if accounts is not None:
+        active = active.filter(account_number__in=list(accounts))
+    customers = active.annotate(opening_balance=Coalesce(Subquery(
+        MonthlyHoldings.objects.filter(
+            customer=OuterRef('pk'), month__lt=start
+        ).order_by('-month').values('closing_balance')[:1]
+    ), 0)).order_by('account_number').values('id', 'account_number', 'name', 'opening_balance')
+
+    type_names = dict(Document.DOCUMENT_TYPES)
+    documents = defaultdict(list)
+    rows = Document.objects.filter(
+        customer__in=active, document_date__gte=start, document_date__lt=end
+    ).annotate(
+        received=ledger.movement_total('R'),
+        returned=ledger.movement_total('E'),
+    ).order_by('customer_id', 'document_date', 'id').values_list(
+        'customer_id', 'document_number', 'document_type', 'document_date', 'received', 'returned'
+    )
+    for customer_id, number, document_type, document_date, received, returned in rows.iterator(chunk_size=2000):
+        documents[customer_id].append({
+            'document_number': number,
+            'document_type': type_names.get(document_type, document_type),
+            'document_date': document_date.strftime('%Y-%m-%d'),
+            'received': received,
+            'returned': returned,
+        })
+
+    for customer in customers:
+        balance = customer['opening_balance']
+        lines = documents.get(customer['id'], [])
+        for line in lines:
+            balance += line['received'] - line['returned']
+            line['balance'] = balance
+        yield {
+            'account_number': customer['account_number'],
+            'name': customer['name'],
+            'month': f'{start:%Y-%m}',
+            'opening_balance': customer['opening_balance'],
+            'documents': lines,
+            'received': sum(line['received'] for line in lines),
+            'returned': sum(line['returned'] for line in lines),
+            'closing_balance': balance,
+        }
+
+
+def render_csv(statement: Dict) -> bytes:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['Statement', statement['name'], statement['account_number'], statement['month']])
+    writer.writerow(['Opening balance', '', '', '', '', statement['opening_balance']])
+    writer.writerow(['document_number', 'document_type', 'document_date', 'received', 'returned', 'balance'])
+    for line in statement['documents']:
+        writer.writerow([
+            line['document_number'], line['document_type'], line['document_date'],
+            line['received'], line['returned'], line['balance'],
+        ])
+    writer.writerow(['Closing balance', '', '', statement['received'], statement['returned'],
+                     statement['closing_balance']])
+    return out.getvalue().encode()
+
+
+def render_html(statement: Dict) -> bytes:
+    e = lambda value: html.escape(str(value))
+    rows = ''.join(
+        f"<tr><td>{e(line['document_date'])}</td><td>{e(line['document_number'])}</td>"
+        f"<td>{e(line['document_type'])}</td><td>{line['received']}</td><td>{line['returned']}</td>"
+        f"<td>{line['balance']}</td></tr>"
+        for line in statement['documents']
+    )
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        f"<title>Statement {e(statement['account_number'])} {e(statement['month'])}</title>"
+        '<style>body{font-family:sans-serif}table{border-collapse:collapse}'
+        'td,th{border:1px solid #ccc;padding:2px 8px;text-align:right}</style></head><body>'
+        f"<h1>Cylinder statement {e(statement['month'])}</h1>"
+        f"<p>{e(statement['name'])} ({e(statement['account_number'])})</p>"
+        '<table><thead><tr><th>Date</th><th>Document</th><th>Type</th><th>Received</th>'
+        '<th>Returned</th><th>Balance</th></tr></thead><tbody>'
+        f"<tr><td colspan=\"5\">Opening balance</td><td>{statement['opening_balance']}</td></tr>"
+        f'{rows}'
+        f"<tr><th colspan=\"3\">Closing balance</th><th>{statement['received']}</th>"
+        f"<th>{statement['returned']}</th><th>{statement['closing_balance']}</th></tr>"
+        '</tbody></table></body></html>'
+    ).encode()
+
+
+def text_lines(statement: Dict) -> List[str]:
+    """The statement as fixed-width lines"""
+    lines = [
+        f"Cylinder statement {statement['month']}",
+        f"{statement['name']} ({statement['account_number']})",
+        '',
+        f"{'Date':<12}{'Document':<14}{'Type':<22}{'Received':>10}{'Returned':>10}{'Balance':>10}",
+        f"{'Opening balance':<58}{statement['opening_balance']:>20}",
+    ]
+    for line in statement['documents']:
+        lines.append(
+            f"{line['document_date']:<12}{line['document_number']:<14}{line['document_type'][:21]:<22}"
+            f"{line['received']:>10}{line['returned']:>10}{line['balance']:>10}"
+        )
+    lines.append(
+        f"{'Closing balance':<48}{statement['received']:>10}{statement['returned']:>10}"
+        f"{statement['closing_balance']:>10}"
+    )
+    return lines
+
+
+PDF_LINES_PER_PAGE = 64
+
+
+def _pdf_text(line: str) -> bytes:
+    escaped = line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return b'(' + escaped.encode('cp1252', errors='replace') + b') Tj T*\n'
+
+
+def render_pdf(statement: Dict) -> bytes:
+    """A plain A4 PDF of the statement in Courier, built without a PDF library"""
+    lines = text_lines(statement)
+    pages = [lines[i:i + PDF_LINES_PER_PAGE] for i in range(0, len(lines), PDF_LINES_PER_PAGE)]
+
+    # Objects 1-3 are the catalog, page tree and font; each page adds a page and a content stream
+    kids = ' '.join(f'{4 + 2 * n} 0 R' for n in range(len(pages)))
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        f'<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>'.encode(),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>',
+    ]
+    for n, page in enumerate(pages):
+        stream = b'BT /F1 9 Tf 12 TL 40 800 Td\n' + b''.join(_pdf_text(line) for line in page) + b'ET'
+        objects.append(
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * n} 0 R >>'.encode()
+        )
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+    xref = out.tell()
+    out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    out.write(b''.join(b'%010d 00000 n \n' % offset for offset in offsets))
+    out.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+RENDERERS = {'csv': render_csv, 'html': render_html, 'pdf': render_pdf}
+
+
+def write_statement(statement: Dict, directory: str, formats: Iterable[str]) -> Dict:
+    """Render one statement in each format into ``directory``; runs in pool workers"""
+    for fmt in formats:
+        path = os.path.join(directory, f"{statement['account_number']}.{fmt}")
+        with open(path, 'wb') as handle:
+            handle.write(RENDERERS[fmt](statement))
+    return {
+        **{key: statement[key] for key in (
+            'account_number', 'name', 'opening_balance', 'received', 'returned', 'closing_balance'
+        )},
+        'documents': len(statement['documents']),
+    }
+
+
+def generate(month: date, output_dir, formats: Iterable[str] = FORMATS, workers: Optional[int] = None,
+             accounts: Optional[Iterable[str]] = None,
+             progress: Optional[Callable[[int, int], None]] = None) -> Dict:
+    """
+    Build and write every statement for ``month``; returns a summary of the run.
+    ``progress(done, total)`` is called as each statement is written.
+    """
+    started = time.perf_counter()
+    formats = list(formats)
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        raise ValueError(f"Unknown statement format(s): {', '.join(sorted(unknown))}")
+
+    directory = Path(output_dir) / f'{ledger.month_start(month):%Y-%m}'
+    directory.mkdir(parents=True, exist_ok=True)
+    statements = list(build_statements(month, accounts))
+    loaded = time.perf_counter()
+
+    render = partial(write_statement, directory=str(directory), formats=formats)
+    workers = workers or os.cpu_count() or 1
+    results = []
+
+    def collect(written):
+        for result in written:
+            results.append(result)
+            if progress is not None:
+                progress(len(results), len(statements))
+
+    if progress is not None:
+        progress(0, len(statements))
+    if workers == 1 or len(statements) < POOL_THRESHOLD:
+        collect(render(statement) for statement in statements)
+    else:
+        # Workers set Django up themselves in case the platform spawns rather than forks
+        with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+            collect(pool.map(render, statements, chunksize=max(1, len(statements) // (workers * 4))))
+
+    with open(directory / 'summary.csv', 'w', newline='', encoding='utf-8') as handle:
+        writer = csv.DictWriter(handle, fieldnames=[
+            'account_number', 'name', 'opening_balance', 'received', 'returned', 'closing_balance', 'documents'
+        ])
+        writer.writeheader()
+        writer.writerows(results)
+
+    return {
+        'month': f'{ledger.month_start(month):%Y-%m}',
+        'directory': str(directory),
+        'statements': len(results),
+        'files': len(results) * len(formats),
+        'workers': workers if len(statements) >= POOL_THRESHOLD else 1,
+        'load_seconds': round(loaded - started, 3),
+        'seconds': round(time.perf_counter() - started, 3),
+    }
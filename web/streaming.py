@@ -0,0 +1,148 @@
+"""
+Streaming JSON responses for large API payloads.
+
+The fixed fields of a response are encoded up front and the bulky list is
+encoded from a row iterator in chunks, so the first bytes leave before the
+query has been read to the end and only one chunk is held in memory. Rows
+may also be an async iterator (e.g. ``QuerySet.aiterator()``);
+``rows_for_handler`` picks whichever the serving handler can stream without
+reading it to the end first. orjson is used when installed; otherwise the standard library encoder.
+"""
+import logging
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, Optional
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speed-up
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+
+_fallback_encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+
+def dumps(value) -> bytes:
+    """Encode a value as compact JSON bytes (dates as YYYY-MM-DD, like JsonResponse)"""
+    if orjson is not None:
+        return orjson.dumps(value, default=_fallback_encoder.default)
+    return _fallback_encoder.encode(value).encode()
+
+
+async def aiterate(chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+    """Pull a sync iterator (and the queries behind it) one chunk at a time off the event loop"""
+    done = object()
+    while True:
+        chunk = await sync_to_async(next)(chunks, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+def for_handler(request, chunks: Iterable[bytes]):
+    """
+    Streaming content the serving handler can send without buffering: ASGI
+    reads a sync iterator to the end before sending it, WSGI does the same
+    with an async one.
+    """
+    return aiterate(iter(chunks)) if isinstance(request, ASGIRequest) else chunks
+
+
+def rows_for_handler(request, queryset, chunk_size: int = CHUNK_SIZE):
+    """
+    A queryset's rows as the kind of iterator the serving handler streams
+    without buffering: ``aiterator()`` under ASGI, ``iterator()`` under WSGI.
+    """
+    if isinstance(request, ASGIRequest):
+        return queryset.aiterator(chunk_size=chunk_size)
+    return queryset.iterator(chunk_size=chunk_size)
+
+
+def map_rows(rows, convert: Callable):
+    """``convert`` applied to sync or async rows, keeping their kind; stops at the first None"""
+    if hasattr(rows, '__aiter__'):
+        async def amapped():
+            async for row in rows:
+                item = convert(row)
+                if item is None:
+                    return
+                yield item
+        return amapped()
+
+    def mapped():
+        for row in rows:
+            item = convert(row)
+            if item is None:
+                return
+            yield item
+    return mapped()
+
+
+class StreamingJsonResponse(StreamingHttpResponse):
+    """
+    Stream ``{**head, key: [rows...], **tail()}``. ``tail`` is called once the
+    rows are exhausted, for fields that depend on them (counts, cursors).
+    If the row iterator fails part-way the list is closed and an ``error``
+    field added, since the status line has already gone out.
+    """
+
+    def __init__(self, head: Dict, key: str, rows: Iterable,
+                 tail: Optional[Callable[[], Dict]] = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        self.failed = False
+        encode = self._aencode if hasattr(rows, '__aiter__') else self._encode
+        super().__init__(encode(head, key, rows, tail, chunk_size), **kwargs)
+
+    @staticmethod
+    def _opening(head, key) -> bytes:
+        return dumps(head)[:-1] + (b',' if head else b'') + dumps(key) + b':['
+
+    @staticmethod
+    def _closing(extra) -> bytes:
+        return b']' + (b',' + dumps(extra)[1:] if extra else b'}')
+
+    def _encode(self, head, key, rows, tail, chunk_size) -> Iterator[bytes]:
+        yield self._opening(head, key)
+
+        buffer = []
+        first = True
+        try:
+            for row in rows:
+                buffer.append(dumps(row))
+                if len(buffer) == chunk_size:
+                    yield (b'' if first else b',') + b','.join(buffer)
+                    buffer, first = [], False
+            extra = tail() if tail else {}
+        except Exception as e:
+            logger.exception("Error while streaming %s", key)
+            self.failed = True
+            extra = {'error': str(e)}
+        if buffer:
+            yield (b'' if first else b',') + b','.join(buffer)
+        yield self._closing(extra)
+
+    async def _aencode(self, head, key, rows, tail, chunk_size) -> AsyncIterator[bytes]:
+        yield self._opening(head, key)
+
+        buffer = []
+        first = True
+        try:
+            async for row in rows:
+                buffer.append(dumps(row))
+                if len(buffer) == chunk_size:
+                    yield (b'' if first else b',') + b','.join(buffer)
+                    buffer, first = [], False
+            extra = tail() if tail else {}
+        except Exception as e:
+            logger.exception("Error while streaming %s", key)
+            self.failed = True
+            extra = {'error': str(e)}
+        if buffer:
+            yield (b'' if first else b',') + b','.join(buffer)
+        yield self._closing(extra)
+
@@ -0,0 +1,150 @@
+"""
+Incremental, resumable sync between our documents and Pastel.
+
+Two streams, each with a SyncCursor checkpoint:
+
+* pull - Pastel invoices newer than the last (date, number) seen, handed to a
+  handler one date window at a time. The cursor only moves after the handler
+  returns, so an interrupted run picks up at the last finished window. A
+  window Pastel fails to serve stops the pull there, to be fetched next run.
+* push - local documents marked PENDING_SYNC, sent in batches and flipped to
+  SYNCED once Pastel accepts them.
+"""
+import logging
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Document, SyncCursor
+from .pastel_integration import PastelUnavailable
+from .services import PastelService
+
+logger = logging.getLogger(__name__)
+
+PULL_STREAM = 'pastel_invoices'
+PUSH_STREAM = 'local_documents'
+
+
+def _as_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+
+def document_payload(document: Document) -> Dict:
+    """The shape Pastel expects for a pushed document"""
+    return {
+        'number': document.document_number,
+        'type': document.document_type,
+        'date': document.document_date.strftime('%Y-%m-%d'),
+        'account_code': document.customer.account_number,
+        'lines': [
+            {
+                'movement_type': movement.movement_type,
+                'item_code': movement.pastel_item_code,
+                'quantity': movement.quantity,
+            }
+            for movement in document.movements.all()
+        ],
+    }
+
+
+class IncrementalSync:
+    def __init__(self, service: Optional[PastelService] = None,
+                 window_days: Optional[int] = None, batch_size: Optional[int] = None):
+        self.service = service or PastelService()
+        self.window_days = window_days or getattr(settings, 'PASTEL_SYNC_WINDOW_DAYS', 7)
+        self.batch_size = batch_size or getattr(settings, 'PASTEL_PUSH_BATCH_SIZE', 100)
+
+    def pull(self, handler: Optional[Callable[[List[Dict]], None]] = None,
+             since: Optional[date] = None, until: Optional[date] = None) -> Dict:
+        """
+        Fetch Pastel invoices after the stream cursor up to ``until`` (default today)
+        and pass each window's potential movements to ``handler``.
+        """
+        until = _as_date(until or timezone.localdate())
+        cursor, _ = SyncCursor.objects.get_or_create(stream=PULL_STREAM)
+        if since is not None:
+            position = (_as_date(since), '')
+        elif cursor.last_date:
+            position = (cursor.last_date, cursor.last_number)
+        else:
+            position = (until, '')
+
+        cylinder_items = self.service.cylinder_items()
+        totals = {'windows': 0, 'invoices': 0, 'movements': 0, 'failed_window': None}
+        try:
+            for window_end, invoices in self._new_invoices(position, until):
+                movements = list(self.service.potential_movements(invoices, cylinder_items))
+                if handler is not None:
+                    handler(movements)
+
+                # Checkpoint: everything up to the end of this window has been handled
+                if invoices:
+                    last = invoices[-1]
+                    position = max(position, (_as_date(last['date']), last['number']))
+                position = max(position, (window_end, ''))
+                SyncCursor.objects.filter(pk=cursor.pk).update(
+                    last_date=position[0], last_number=position[1], updated_at=timezone.now()
+                )
+
+                totals['windows'] += 1
+                totals['invoices'] += len(invoices)
+                totals['movements'] += len(movements)
+        except PastelUnavailable as e:
+            # The cursor stays at the last window that was handled
+            logger.warning(f"Stopped pulling at {e.window[0]:%Y-%m-%d}; Pastel call failed")
+            totals['failed_window'] = e.window
+        return totals
+
+    def _new_invoices(self, position, until):
+        """(window_end, invoices after ``position``) per window, invoices in (date, number) order"""
+        for _, window_end, fetched in self.service.invoice_windows(position[0], until, self.window_days):
+            yield window_end, sorted(
+                (
+                    invoice for invoice in fetched
+                    if (_as_date(invoice['date']), invoice['number']) > position
+                ),
+                key=lambda invoice: (_as_date(invoice['date']), invoice['number'])
+            )
+
+    def push(self) -> Dict:
+        """Send PENDING_SYNC documents to Pastel in batches and mark accepted ones SYNCED"""
+        totals = {'batches': 0, 'pushed': 0, 'rejected': 0}
+        last_id = 0
+        while True:
+            batch = list(
+                Document.objects.filter(
+                    status='PENDING_SYNC', id__gt=last_id
+                ).select_related('customer').prefetch_related('movements').order_by('id')[:self.batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            accepted = self.service.api.push_documents([document_payload(doc) for doc in batch])
+            if accepted is None:
+                # Pastel unavailable: leave the rest pending for the next run
+                logger.warning(f"Stopped pushing documents after {totals['pushed']}; Pastel call failed")
+                break
+
+            accepted = set(accepted)
+            synced = [doc for doc in batch if doc.document_number in accepted]
+            with transaction.atomic():
+                Document.objects.filter(id__in=[doc.id for doc in synced]).update(status='SYNCED')
+                if synced:
+                    SyncCursor.objects.update_or_create(
+                        stream=PUSH_STREAM,
+                        defaults={
+                            'last_date': synced[-1].document_date,
+                            'last_number': synced[-1].document_number,
+                        }
+                    )
+
+            totals['batches'] += 1
+            totals['pushed'] += len(synced)
+            totals['rejected'] += len(batch) - len(synced)
+        return totals
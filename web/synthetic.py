@@ -0,0 +1,99 @@
+"""
+Synthetic customers, documents and movements for benchmarks and load tests.
+"""
+import random
+from datetime import date, timedelta
+from typing import Dict
+from django.contrib.auth.models import User
+from django.db import transaction
+from . import ledger
+from .models import Customer, CylinderMovement, Document, DocumentSequence
+
+BATCH_SIZE = 5000
+
+
+def generate_dataset(
+    movements: int,
+    customers: int = 100,
+    start: date = date(2015, 1, 1),
+    days: int = 3650,
+    seed: int = 42
+) -> Dict:
+    """
+    Create roughly ``movements`` cylinder movements spread over ``customers``
+    accounts and ``days`` of history, then rebuild the holdings ledger.
+    About a third of invoices carry both a delivery and an empty return, so
+    there are ~1.4 movements per document.
+    """
+    rng = random.Random(seed)
+    user, _ = User.objects.get_or_create(username='synthetic', defaults={'is_staff': True})
+
+    with transaction.atomic():
+        Customer.objects.bulk_create([
+            Customer(name=f'Synthetic Customer {i:05d}', account_number=f'{900000 + i:06d}')
+            for i in range(customers)
+        ], batch_size=BATCH_SIZE)
+        customer_ids = list(
+            Customer.objects.filter(name__startswith='Synthetic Customer').values_list('id', flat=True)
+        )
+
+        next_number = {'IN': 1, 'NR': 1}
+        created_movements = 0
+        created_documents = 0
+        while created_movements < movements:
+            documents = []
+            plans = []
+            while len(documents) < BATCH_SIZE and created_movements < movements:
+                doc_type = 'IN' if rng.random() < 0.7 else 'NR'
+                number = f"{doc_type}{next_number[doc_type]:06d}"
+                next_number[doc_type] += 1
+                documents.append(Document(
+                    document_number=number,
+                    document_type=doc_type,
+                    document_date=start + timedelta(days=rng.randrange(days)),
+                    customer_id=rng.choice(customer_ids),
+                    created_by=user,
+                ))
+                if doc_type == 'NR':
+                    plan = [('E', rng.randint(1, 10))]
+                elif rng.random() < 0.4:
+                    plan = [('R', rng.randint(1, 20)), ('E', rng.randint(1, 10))]
+                else:
+                    plan = [('R', rng.randint(1, 20))]
+                plans.append(plan)
+                created_movements += len(plan)
+
+            Document.objects.bulk_create(documents)
+            created_documents += len(documents)
+            ids = dict(
+                Document.objects.filter(
+                    document_number__in=[d.document_number for d in documents]
+                ).values_list('document_number', 'id')
+            )
+            CylinderMovement.objects.bulk_create([
+                CylinderMovement(
+                    document_id=ids[doc.document_number],
+                    movement_type=movement_type,
+                    quantity=quantity
+                )
+                for doc, plan in zip(documents, plans)
+                for movement_type, quantity in plan
+            ], batch_size=BATCH_SIZE)
+
+        for prefix, value in next_number.items():
+            DocumentSequence.observe(prefix, value - 1)
+        ledger.rebuild_all()
+
+    return {
+        'customers': customers,
+        'documents': created_documents,
+        'movements': created_movements,
+    }
+
+
+def clear_dataset():
+    """Remove everything generate_dataset created"""
+    with transaction.atomic():
+        Customer.objects.filter(name__startswith='Synthetic Customer').delete()
+        User.objects.filter(username='synthetic').delete()
+        ledger.rebuild_all()
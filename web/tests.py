@@ -1,3 +1,1640 @@
-from django.test import TestCase
-
-# Create your tests here.
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import warnings
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.db.models import Q, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from . import benchmarks, exports, jobs, statements, views
+from .importer import import_movements
+from .ledger import list_version, parse_date, rebuild_all, rebuild_monthly_holdings, verify_balances
+from .metrics import registry
+from .models import (
+    ChangeEvent, Customer, CustomerBalance, CylinderMovement, Document, DocumentSequence, Job,
+    MonthlyHoldings, PastelCacheEntry, SyncCursor
+)
+from .pastel_cache import PastelCache
+from .services import PastelService
+from .streaming import StreamingJsonResponse
+from .sync import IncrementalSync
+from .views import tracer
+
+
+def read_body(response):
+    """The whole body of a response, draining sync and async streams"""
+    if not response.streaming:
+        return response.content
+    if response.is_async:
+        async def drain():
+            return b''.join([chunk async for chunk in response.streaming_content])
+        return async_to_sync(drain)()
+    return b''.join(response.streaming_content)
+
+
+def read_json(response):
+    """Decode a JsonResponse or a streamed JSON body"""
+    return json.loads(read_body(response))
+
+
+class LedgerTestMixin:
+    def setUp(self):
+        # Cached API payloads would otherwise leak between tests
+        cache.clear()
+        self.user = User.objects.create_user('clerk', password='secret', is_staff=True)
+        self.client.force_login(self.user)
+        self.customer = Customer.objects.create(name='Acme Gas', account_number='000001')
+
+    def add_document(self, number, doc_type, day, received=0, returned=0, customer=None):
+        response = self.client.post(reverse('save_document'), {
+            'customer_account': (customer or self.customer).account_number,
+            'document_type': doc_type,
+            'document_number': number,
+            'document_date': day,
+            'cylinders_received': received,
+            'cylinders_returned': returned,
+        })
+        self.assertTrue(response.json()['success'], response.json())
+        return Document.objects.get(document_number=number)
+
+
+class CustomerBalanceTests(LedgerTestMixin, TestCase):
+    def test_balance_follows_document_writes(self):
+        self.add_document('IN000001', 'IN', '2024-01-10', received=10, returned=2)
+        doc = self.add_document('NR000001', 'NR', '2024-02-05', returned=3)
+
+        balance = CustomerBalance.objects.get(customer=self.customer)
+        self.assertEqual(balance.balance, 5)
+        self.assertEqual(balance.document_count, 2)
+        self.assertEqual(balance.last_movement_date, date(2024, 2, 5))
+
+        self.client.post(reverse('update_document', args=[doc.id]), {
+            'document_date': '2024-01-20',
+            'cylinders_returned': 1,
+        })
+        balance.refresh_from_db()
+        self.assertEqual(balance.balance, 7)
+        self.assertEqual(balance.last_movement_date, date(2024, 1, 20))
+
+        self.client.post(reverse('delete_document', args=[doc.id]))
+        balance.refresh_from_db()
+        self.assertEqual(balance.balance, 8)
+        self.assertEqual(balance.document_count, 1)
+        self.assertEqual(self.customer.get_total_holdings(), 8)
+        self.assertEqual(verify_balances(), [])
+
+    def test_holdings_lookup_does_not_replay_history(self):
+        for i in range(1, 6):
+            self.add_document(f'IN{i:06d}', 'IN', f'2024-01-{i:02d}', received=2)
+        customer = Customer.objects.get(pk=self.customer.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(customer.get_total_holdings(), 10)
+
+    def test_verify_reports_drift(self):
+        doc = self.add_document('IN000001', 'IN', '2024-01-10', received=4)
+        # Writes that bypass the views leave the stored balance behind
+        CylinderMovement.objects.create(document=doc, movement_type='R', quantity=1)
+
+        mismatches = verify_balances()
+        self.assertEqual(len(mismatches), 1)
+        self.assertEqual(mismatches[0]['stored']['balance'], 4)
+        self.assertEqual(mismatches[0]['expected']['balance'], 5)
+
+
+class MonthlyHoldingsTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = Customer.objects.create(name='Blue Flame', account_number='000002')
+        self.add_document('IN000001', 'IN', '2023-11-03', received=20)
+        self.add_document('IN000002', 'IN', '2024-02-14', received=5, returned=4)
+        self.add_document('NR000001', 'NR', '2024-02-20', returned=6)
+        self.add_document('IN000003', 'IN', '2024-07-01', received=8, customer=self.other)
+
+    def holdings(self, **params):
+        response = self.client.get(reverse('get_monthly_holdings'), params)
+        return [row['holdings'] for row in response.json()['data']]
+
+    def test_customer_series(self):
+        self.assertEqual(
+            self.holdings(account_number='000001', year=2024),
+            [20] + [15] * 11
+        )
+
+    def test_fleet_series(self):
+        self.assertEqual(
+            self.holdings(year=2024),
+            [20] + [15] * 5 + [23] * 6
+        )
+        self.assertEqual(self.holdings(year=2023), [0] * 10 + [20, 20])
+
+    def test_rollup_follows_date_changes(self):
+        doc = Document.objects.get(document_number='NR000001')
+        self.client.post(reverse('update_document', args=[doc.id]), {
+            'document_date': '2024-05-02',
+            'cylinders_returned': 6,
+        })
+        self.assertEqual(
+            self.holdings(account_number='000001', year=2024),
+            [20, 21, 21, 21, 15, 15, 15, 15, 15, 15, 15, 15]
+        )
+
+        stored = list(MonthlyHoldings.objects.values_list('customer', 'month', 'closing_balance'))
+        rebuild_monthly_holdings(self.customer)
+        rebuild_monthly_holdings()
+        rebuilt = MonthlyHoldings.objects.values_list('customer', 'month', 'closing_balance')
+        self.assertEqual(sorted(stored, key=str), sorted(rebuilt, key=str))
+
+    def test_fleet_year_is_single_query(self):
+        with self.assertNumQueries(1):
+            self.client.get(reverse('get_monthly_holdings'), {'year': 2024})
+
+
+class HoldingsReportTests(LedgerTestMixin, TestCase):
+    def report(self, day):
+        response = self.client.get(reverse('monthly_holdings_report'), {'date': day})
+        return read_json(response)
+
+    def test_report_as_of_date(self):
+        other = Customer.objects.create(name='Blue Flame', account_number='000002')
+        settled = Customer.objects.create(name='Closed Co', account_number='000003')
+        self.add_document('IN000001', 'IN', '2024-01-10', received=10)
+        self.add_document('NR000001', 'NR', '2024-03-01', returned=4)
+        self.add_document('IN000002', 'IN', '2024-02-01', received=3, customer=other)
+        self.add_document('IN000003', 'IN', '2024-01-05', received=2, customer=settled)
+        self.add_document('NR000002', 'NR', '2024-01-06', returned=2, customer=settled)
+
+        self.assertEqual(self.report('2024-02-15')['data'], [
+            {'account_number': '000001', 'customer_name': 'Acme Gas',
+             'holdings': 10, 'last_movement_date': '2024-01-10'},
+            {'account_number': '000002', 'customer_name': 'Blue Flame',
+             'holdings': 3, 'last_movement_date': '2024-02-01'},
+        ])
+        cache.clear()
+        self.assertEqual(self.report('2024-03-31')['data'][0]['holdings'], 6)
+
+    def test_query_count_is_constant_in_customers(self):
+        def report_queries():
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.report('2024-12-31')
+            return len(queries)
+
+        self.add_document('IN000001', 'IN', '2024-01-10', received=10)
+        baseline = report_queries()
+        for i in range(2, 22):
+            customer = Customer.objects.create(name=f'Customer {i}', account_number=f'{i:06d}')
+            self.add_document(f'IN{i:06d}', 'IN', '2024-01-10', received=i, customer=customer)
+        self.assertEqual(report_queries(), baseline)
+        cache.clear()
+        self.assertEqual(len(self.report('2024-12-31')['data']), 21)
+
+
+class CustomerManagementTests(LedgerTestMixin, TestCase):
+    def test_list_queries_do_not_grow_with_customers(self):
+        def page_queries():
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('customer_management'))
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        self.add_document('IN000001', 'IN', '2024-01-10', received=10)
+        baseline = page_queries()
+        for i in range(2, 12):
+            customer = Customer.objects.create(name=f'Customer {i}', account_number=f'{i:06d}')
+            self.add_document(f'IN{i:06d}', 'IN', '2024-01-10', received=i, customer=customer)
+        self.assertEqual(page_queries(), baseline)
+
+    def test_add_customer_returns_annotated_list(self):
+        self.add_document('IN000001', 'IN', '2024-01-10', received=7, returned=2)
+        response = self.client.post(reverse('customer_management'), {
+            'name': 'Blue Flame',
+            'account_number': '000002',
+        })
+        customers = {c['account_number']: c for c in response.json()['customers']}
+        self.assertEqual(customers['000001']['total_holdings'], 5)
+        self.assertEqual(customers['000001']['document_count'], 1)
+        self.assertEqual(customers['000001']['last_transaction'], '2024-01-10')
+        self.assertEqual(customers['000002']['total_holdings'], 0)
+
+
+class MetricsTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+
+    def test_requests_are_recorded_per_view(self):
+        self.add_document('IN000001', 'IN', '2024-01-10', received=10)
+        self.client.get(reverse('get_customer_info'), {'account_number': '000001'})
+
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn(
+            'qmc_http_requests_total{method="GET",status="200",view="get_customer_info"} 1',
+            body
+        )
+        self.assertIn('qmc_db_queries_per_request_count{view="save_document"} 1', body)
+        self.assertIn('qmc_http_request_duration_seconds_bucket{view="get_customer_info",le="+Inf"} 1', body)
+        self.assertIn('qmc_http_response_size_bytes_sum{view="get_customer_info"}', body)
+
+    def test_query_count_is_attributed(self):
+        self.client.get(reverse('get_monthly_holdings'), {'year': 2024})
+        self.assertIn(
+            'qmc_db_queries_per_request_sum{view="get_monthly_holdings"} 1',
+            registry.render()
+        )
+
+    def test_metrics_are_staff_only(self):
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(TRACE_SAMPLE_RATE=1.0)
+    def test_tracing_is_level_gated(self):
+        self.add_document('IN000001', 'IN', '2024-01-10', received=10)
+        self.assertFalse(tracer.sampled())
+
+        with self.assertLogs('web.trace', 'DEBUG') as logs:
+            read_json(self.client.get(reverse('get_customer_documents'), {'account_number': '000001'}))
+        self.assertEqual(logs.records[0].trace['document'], 'IN000001')
+
+
+class BenchmarkTests(TestCase):
+    def test_small_run_covers_every_endpoint(self):
+        results = benchmarks.run([60, 120], customers=3, repeat=1, log=lambda message: None)
+        self.assertEqual(len(results['scales']), 2)
+        self.assertGreaterEqual(results['scales'][1]['movements'], 120)
+        for scale in results['scales']:
+            for name, timing in scale['endpoints'].items():
+                self.assertEqual(timing['status'], 200, name)
+                self.assertGreater(timing['queries'], 0, name)
+        self.assertIn('get_customer_documents', results['growth'])
+        self.assertFalse(Customer.objects.exists())
+
+    def test_growth_exponent(self):
+        self.assertAlmostEqual(benchmarks.growth_exponent([(10, 1), (100, 10), (1000, 100)]), 1.0)
+        self.assertAlmostEqual(benchmarks.growth_exponent([(10, 5), (1000, 5)]), 0.0)
+
+
+class LoadTestTests(TransactionTestCase):
+    def test_wsgi_and_asgi_serve_every_burst(self):
+        results = benchmarks.load_test(60, customers=3, bursts=4, concurrency=3, log=lambda message: None)
+        for name in ('wsgi', 'asgi'):
+            self.assertEqual(results['results'][name]['requests'], 20, name)
+            self.assertEqual(results['results'][name]['errors'], 0, name)
+        self.assertFalse(Customer.objects.exists())
+
+
+class FakePastel:
+    """Local stand-in for the Pastel API, serving canned JSON over real HTTP"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.customers = {}
+        self.items = []
+        self.invoices = []
+        self.etags = {}
+        self.pushed = []
+        self.reject = set()
+        # Paths, or invoice window start dates, to answer with a 503
+        self.unavailable = set()
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                with fake.lock:
+                    fake.requests.append(url.path)
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                try:
+                    time.sleep(fake.latency)
+                    status, body = fake.route(url.path, parse_qs(url.query))
+                finally:
+                    with fake.lock:
+                        fake.in_flight -= 1
+                etag = fake.etags.get(url.path)
+                if etag and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                if etag:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                documents = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with fake.lock:
+                    fake.requests.append(urlparse(self.path).path)
+                    fake.pushed.append([doc['number'] for doc in documents])
+                payload = json.dumps({
+                    'accepted': [doc['number'] for doc in documents if doc['number'] not in fake.reject]
+                }).encode()
+                self.send_response(201)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/api/v1'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def route(self, path, query):
+        parts = path.split('/')[3:]  # Strip the leading /api/v1
+        if path in self.unavailable or query.get('start_date', [''])[0] in self.unavailable:
+            return 503, {}
+        if parts[0] == 'customers' and parts[1] in self.customers:
+            return 200, self.customers[parts[1]]
+        if parts == ['items']:
+            return 200, self.items
+        if parts == ['invoices']:
+            start, end = query['start_date'][0], query['end_date'][0]
+            return 200, [invoice for invoice in self.invoices if start <= invoice['date'] <= end]
+        return 404, {}
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class PastelSyncTests(TestCase):
+    def setUp(self):
+        self.pastel = FakePastel(latency=0.05)
+        self.addCleanup(self.pastel.stop)
+        for i in range(1, 21):
+            self.pastel.customers[f'{i:06d}'] = {
+                'name': f'Pastel Customer {i}',
+                'telephone': f'011 555 {i:04d}',
+                'email': f'customer{i}@example.com',
+            }
+        Customer.objects.create(name='Old Name', account_number='000001')
+        Customer.objects.create(name='Pastel Customer 2', account_number='000002',
+                                phone_number='011 555 0002', email='customer2@example.com')
+
+    def test_bulk_sync_fetches_concurrently_and_writes_in_batches(self):
+        with self.settings(PASTEL_API_URL=self.pastel.url):
+            service = PastelService(max_workers=8)
+            accounts = [f'{i:06d}' for i in range(1, 23)]
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                result = service.sync_customers(accounts)
+            elapsed = time.perf_counter() - started
+            service.api.close()
+
+        self.assertEqual(result['created'], 18)
+        self.assertEqual(result['updated'], 1)
+        self.assertEqual(result['unchanged'], 1)
+        self.assertEqual(result['missing'], ['000021', '000022'])
+        self.assertEqual(result['errors'], [])
+        self.assertEqual(Customer.objects.get(account_number='000001').name, 'Pastel Customer 1')
+        self.assertEqual(Customer.objects.count(), 20)
+
+        # 22 requests at 50ms each would take over a second one at a time
+        self.assertGreater(self.pastel.max_in_flight, 1)
+        self.assertLess(elapsed, 22 * 0.05)
+        self.assertLessEqual(len(queries), 6)
+
+
+    def test_failures_are_not_reported_missing(self):
+        self.pastel.unavailable = {'/api/v1/customers/000001'}
+        with self.settings(PASTEL_API_URL=self.pastel.url):
+            service = PastelService()
+            with self.assertLogs('web.pastel_integration', 'ERROR'):
+                result = service.sync_customers(['000001', '000003', '000099'])
+            service.api.close()
+        self.assertEqual((result['created'], result['missing'], result['errors']), (1, ['000099'], ['000001']))
+        self.assertEqual(Customer.objects.get(account_number='000001').name, 'Old Name')
+
+
+class CylinderMovementCheckTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.pastel = FakePastel()
+        self.addCleanup(self.pastel.stop)
+        self.pastel.items = [{'code': 'CYL001', 'description': '9kg cylinder'}]
+        for day in range(1, 91):
+            when = date(2024, 1, 1) + timedelta(days=day - 1)
+            self.pastel.invoices.append({
+                'number': f'IN{day:06d}',
+                'date': when.isoformat(),
+                'account_code': '000001',
+                'lines': [
+                    {'item_code': 'CYL001', 'quantity': 2},
+                    {'item_code': 'GAS', 'quantity': 1},
+                ],
+            })
+        for day in range(1, 11):
+            self.add_document(f'IN{day:06d}', 'IN', f'2024-01-{day:02d}', received=2)
+
+    def test_windows_resolve_known_documents_in_one_query_each(self):
+        with self.settings(PASTEL_API_URL=self.pastel.url):
+            service = PastelService()
+            service.mirror.get_cylinder_items()  # Prime the item catalogue mirror
+            with CaptureQueriesContext(connection) as queries:
+                movements = service.iter_cylinder_movements(
+                    date(2024, 1, 1), date(2024, 3, 30), window_days=30
+                )
+                first = next(movements)
+                self.assertEqual(self.pastel.requests.count('/api/v1/invoices'), 1)
+                rest = list(movements)
+
+        self.assertEqual(first['invoice_number'], 'IN000011')
+        self.assertEqual(len(rest), 79)
+        self.assertEqual(self.pastel.requests.count('/api/v1/invoices'), 3)
+        self.assertEqual(self.pastel.requests.count('/api/v1/items'), 1)
+        self.assertEqual(len(queries), 4)  # One mirror read, then one lookup per window
+
+    def test_check_returns_list(self):
+        with self.settings(PASTEL_API_URL=self.pastel.url):
+            found = PastelService().check_cylinder_movements(date(2024, 1, 1), date(2024, 1, 15))
+        self.assertEqual([m['invoice_number'] for m in found], [f'IN{d:06d}' for d in range(11, 16)])
+        self.assertEqual(found[0]['description'], '9kg cylinder')
+
+
+@override_settings(PASTEL_ITEMS_TTL=60, PASTEL_CUSTOMERS_TTL=60)
+class PastelCacheTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.pastel = FakePastel()
+        self.addCleanup(self.pastel.stop)
+        self.pastel.items = [{'code': 'CYL001', 'description': '9kg cylinder'}]
+        self.pastel.customers['000001'] = {'name': 'Acme Gas'}
+        self.api = PastelService().api
+        self.api.base_url = self.pastel.url
+        self.cache = PastelCache(self.api, background=False)
+
+    def expire(self, key):
+        PastelCacheEntry.objects.filter(key=key).update(
+            fetched_at=timezone.now() - timedelta(minutes=5)
+        )
+
+    def test_fresh_copies_do_not_touch_pastel(self):
+        self.assertEqual(self.cache.get_customer('000001'), {'name': 'Acme Gas'})
+        self.assertEqual(self.cache.get_customer('000001'), {'name': 'Acme Gas'})
+        self.assertEqual(self.pastel.requests, ['/api/v1/customers/000001'])
+        self.assertEqual(PastelCache.stats()['customers'], {'hit': 1, 'stale': 0, 'miss': 1})
+        self.assertIsNone(self.cache.get_customer('999999'))
+
+    def test_stale_copy_is_served_then_revalidated_with_etag(self):
+        self.pastel.etags['/api/v1/items'] = '"v1"'
+        self.cache.get_cylinder_items()
+        self.expire('items:CYLINDERS')
+
+        self.pastel.items = [{'code': 'CYL002', 'description': '48kg cylinder'}]
+        # Same ETag: Pastel answers 304 and the copy is just marked fresh
+        self.assertEqual(self.cache.get_cylinder_items()[0]['code'], 'CYL001')
+        self.assertEqual(self.cache.get_cylinder_items()[0]['code'], 'CYL001')
+        self.assertEqual(
+            registry.counter_value('qmc_pastel_cache_revalidations_total', dataset='items', outcome='not_modified'),
+            1
+        )
+
+        self.pastel.etags['/api/v1/items'] = '"v2"'
+        self.expire('items:CYLINDERS')
+        # The stale copy is returned immediately; the new catalogue is stored for next time
+        self.assertEqual(self.cache.get_cylinder_items()[0]['code'], 'CYL001')
+        self.assertEqual(self.cache.get_cylinder_items()[0]['code'], 'CYL002')
+
+    def test_content_hash_used_without_validators(self):
+        self.cache.get_customer('000001')
+        first = PastelCacheEntry.objects.get(key='customer:000001')
+        self.expire('customer:000001')
+        self.cache.get_customer('000001')
+
+        entry = PastelCacheEntry.objects.get(key='customer:000001')
+        self.assertEqual(entry.changed_at, first.changed_at)
+        self.assertGreater(entry.fetched_at, first.fetched_at)
+        self.assertEqual(
+            registry.counter_value('qmc_pastel_cache_revalidations_total', dataset='customers', outcome='unchanged'),
+            1
+        )
+
+
+class IncrementalSyncTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.pastel = FakePastel()
+        self.addCleanup(self.pastel.stop)
+        self.pastel.items = [{'code': 'CYL001', 'description': '9kg cylinder'}]
+        self.service = PastelService()
+        self.service.api.base_url = self.pastel.url
+
+    def add_invoice(self, number, day):
+        self.pastel.invoices.append({
+            'number': number,
+            'date': day,
+            'account_code': '000001',
+            'lines': [{'item_code': 'CYL001', 'quantity': 1}],
+        })
+
+    def test_pull_resumes_from_checkpoint(self):
+        for day in range(1, 21):
+            self.add_invoice(f'IN{day:06d}', f'2024-01-{day:02d}')
+        sync = IncrementalSync(self.service, window_days=7)
+
+        seen = []
+
+        def failing_handler(movements):
+            if len(seen) >= 7:
+                raise RuntimeError('interrupted')
+            seen.extend(m['invoice_number'] for m in movements)
+
+        with self.assertRaises(RuntimeError):
+            sync.pull(failing_handler, since=date(2024, 1, 1), until=date(2024, 1, 20))
+        cursor = SyncCursor.objects.get(stream='pastel_invoices')
+        self.assertEqual((cursor.last_date, cursor.last_number), (date(2024, 1, 7), 'IN000007'))
+
+        # The rerun starts at the checkpoint and only sees invoices after it
+        self.pastel.requests.clear()
+        rest = []
+        totals = sync.pull(lambda movements: rest.extend(m['invoice_number'] for m in movements),
+                           until=date(2024, 1, 20))
+        self.assertEqual(rest, [f'IN{day:06d}' for day in range(8, 21)])
+        self.assertEqual(totals['invoices'], 13)
+
+        # Nothing new: a nightly run costs one small window
+        self.add_invoice('IN000021', '2024-01-20')
+        self.pastel.requests.clear()
+        latest = []
+        sync.pull(lambda movements: latest.extend(m['invoice_number'] for m in movements),
+                  until=date(2024, 1, 20))
+        self.assertEqual(latest, ['IN000021'])
+        self.assertEqual(self.pastel.requests, ['/api/v1/invoices'])
+
+    def test_failed_window_is_fetched_again(self):
+        for day in (3, 10, 17):
+            self.add_invoice(f'IN{day:06d}', f'2024-01-{day:02d}')
+        sync = IncrementalSync(self.service, window_days=7)
+
+        self.pastel.unavailable = {'2024-01-08'}
+        seen = []
+        totals = sync.pull(lambda movements: seen.extend(m['invoice_number'] for m in movements),
+                           since=date(2024, 1, 1), until=date(2024, 1, 20))
+        self.assertEqual(seen, ['IN000003'])
+        self.assertEqual(totals['failed_window'], (date(2024, 1, 8), date(2024, 1, 14)))
+        cursor = SyncCursor.objects.get(stream='pastel_invoices')
+        self.assertEqual((cursor.last_date, cursor.last_number), (date(2024, 1, 7), ''))
+
+        self.pastel.unavailable = set()
+        totals = sync.pull(lambda movements: seen.extend(m['invoice_number'] for m in movements),
+                           until=date(2024, 1, 20))
+        self.assertEqual(seen, ['IN000003', 'IN000010', 'IN000017'])
+        self.assertIsNone(totals['failed_window'])
+
+    def test_push_marks_accepted_documents_synced(self):
+        with self.settings(PASTEL_SYNC_LOCAL_DOCUMENTS=True):
+            for i in range(1, 6):
+                self.add_document(f'IN{i:06d}', 'IN', '2024-01-10', received=i)
+        self.pastel.reject = {'IN000003'}
+
+        totals = IncrementalSync(self.service, batch_size=2).push()
+        self.assertEqual(totals, {'batches': 3, 'pushed': 4, 'rejected': 1})
+        self.assertEqual(self.pastel.pushed[0], ['IN000001', 'IN000002'])
+        self.assertEqual(
+            list(Document.objects.filter(status='PENDING_SYNC').values_list('document_number', flat=True)),
+            ['IN000003']
+        )
+        self.assertEqual(SyncCursor.objects.get(stream='local_documents').last_number, 'IN000005')
+
+
+class InvoiceImportTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = Customer.objects.create(name='Beta Braai', account_number='000002')
+
+    def line(self, number, day, account='000001', quantity=1, item_code='CYL001', **extra):
+        return {
+            'invoice_number': number, 'date': day, 'customer': account,
+            'item_code': item_code, 'quantity': quantity, **extra
+        }
+
+    def test_import_writes_documents_movements_and_ledger(self):
+        rows = [
+            self.line('IN000001', '2024-01-05', quantity=4),
+            self.line('IN000001', '2024-01-05', quantity=2, item_code='CYL002'),
+            self.line('IN000002', '2024-02-10', account='000002', quantity=3),
+            self.line('NR000001', '2024-02-12', quantity=1),
+        ]
+        result = import_movements(rows, self.user, chunk_size=2)
+
+        self.assertEqual((result['documents'], result['movements']), (3, 4))
+        self.assertEqual(result['errors'], [])
+        document = Document.objects.get(document_number='IN000001')
+        self.assertEqual(document.status, 'SYNCED')
+        self.assertEqual(
+            sorted(document.movements.values_list('pastel_item_code', 'quantity')),
+            [('CYL001', 4), ('CYL002', 2)]
+        )
+        self.assertEqual(
+            CylinderMovement.objects.get(document__document_number='NR000001').movement_type, 'E'
+        )
+        self.assertEqual(self.customer.get_total_holdings(), 5)
+        self.assertEqual(self.other.get_total_holdings(), 3)
+        self.assertEqual(verify_balances(), [])
+        self.assertEqual(
+            MonthlyHoldings.objects.get(customer=None, month=date(2024, 2, 1)).closing_balance, 8
+        )
+
+    def test_bad_rows_are_reported_without_aborting(self):
+        self.add_document('IN000009', 'IN', '2024-01-01', received=1)
+        rows = [
+            self.line('IN000001', '2024-01-05'),
+            self.line('IN000002', 'not a date'),
+            self.line('IN000003', '2024-01-05', account='999999'),
+            self.line('IN000004', '2024-01-05', quantity=0),
+            self.line('IN000004', '2024-01-05', quantity=2),
+            self.line('NR000001', '2024-01-05', movement_type='R'),
+            self.line('IN000009', '2024-01-05'),
+        ]
+        result = import_movements(rows, self.user)
+
+        self.assertEqual(result['documents'], 1)
+        self.assertEqual(result['skipped'], ['IN000009'])
+        self.assertEqual([error['row'] for error in result['errors']], [2, 4, 6, 3])
+        self.assertFalse(Document.objects.filter(document_number='IN000004').exists())
+        self.assertEqual(verify_balances(Customer.objects.filter(pk=self.customer.pk)), [])
+
+    def test_import_cost_does_not_grow_per_line(self):
+        rows = [self.line(f'IN{i:06d}', '2024-01-05', quantity=1) for i in range(1, 201)]
+        with CaptureQueriesContext(connection) as captured:
+            result = import_movements(rows, self.user)
+        self.assertEqual(result['documents'], 200)
+        self.assertLess(len(captured.captured_queries), 40)
+
+        # Re-running the same file is a no-op
+        self.assertEqual(import_movements(rows, self.user)['documents'], 0)
+        self.assertEqual(self.customer.get_total_holdings(), 200)
+
+
+class DocumentSequenceTests(LedgerTestMixin, TestCase):
+    def test_numbers_follow_sequence_and_manual_entries(self):
+        def save_unnumbered():
+            return self.client.post(reverse('save_document'), {
+                'customer_account': '000001',
+                'document_type': 'IN',
+                'document_date': '2024-01-12',
+                'cylinders_received': 1,
+            }).json()['document']['document_number']
+
+        self.assertEqual(save_unnumbered(), 'IN000001')
+        self.add_document('IN000050', 'IN', '2024-01-11', received=1)
+        self.assertEqual(save_unnumbered(), 'IN000051')
+        self.assertEqual(Document.generate_next_number('NR'), 'NR000001')
+
+    def test_first_use_starts_after_existing_documents(self):
+        self.add_document('NR000007', 'NR', '2024-01-10', returned=1)
+        DocumentSequence.objects.all().delete()
+        self.assertEqual(Document.generate_next_number('NR'), 'NR000008')
+
+    def test_allocation_does_not_scan_documents(self):
+        Document.generate_next_number('IN')
+        with CaptureQueriesContext(connection) as captured:
+            Document.generate_next_number('IN')
+        self.assertFalse(any('web_document"' in query['sql'] for query in captured.captured_queries))
+
+    def test_reservations_are_disjoint_ranges(self):
+        first = DocumentSequence.reserve('IN', 3)
+        second = DocumentSequence.reserve('IN', 3)
+        self.assertEqual((list(first), list(second)), ([1, 2, 3], [4, 5, 6]))
+        self.assertEqual(Document.generate_next_number('IN'), 'IN000007')
+
+
+class BatchDocumentEntryTests(LedgerTestMixin, TestCase):
+    def post_batch(self, documents):
+        return self.client.post(
+            reverse('save_documents'), json.dumps({'documents': documents}), content_type='application/json'
+        ).json()
+
+    def slip(self, number='', doc_type='IN', day='2024-03-01', received=0, returned=0, account='000001'):
+        return {
+            'customer_account': account, 'document_type': doc_type, 'document_number': number,
+            'document_date': day, 'cylinders_received': received, 'cylinders_returned': returned,
+        }
+
+    def test_batch_saves_valid_entries_and_reports_the_rest(self):
+        Customer.objects.create(name='Beta Braai', account_number='000002')
+        self.add_document('IN000010', 'IN', '2024-01-01', received=1)
+        result = self.post_batch([
+            self.slip('12', received=5, returned=1),
+            self.slip(doc_type='NR', returned=2, account='000002'),
+            self.slip('IN000010', received=1),
+            self.slip('NR3', doc_type='NR', received=1, returned=1),
+            self.slip(received=3, account='999999'),
+            self.slip('IN000012', received=1),
+            self.slip(received=4),
+        ])
+
+        self.assertEqual((result['saved'], result['failed']), (3, 4))
+        self.assertFalse(result['success'])
+        self.assertEqual(
+            [(r['index'], r['success']) for r in result['results']],
+            [(0, True), (1, True), (2, False), (3, False), (4, False), (5, False), (6, True)]
+        )
+        self.assertEqual(result['results'][0]['document']['document_number'], 'IN000012')
+        self.assertEqual(result['results'][1]['document']['document_number'], 'NR000001')
+        self.assertEqual(result['results'][3]['message'], 'Return Slips cannot have received cylinders')
+        self.assertEqual(result['results'][4]['message'], 'Customer not found')
+        self.assertEqual(result['results'][5]['message'], 'This document number already exists')
+        # Unnumbered slips are numbered after the highest number typed in the batch
+        self.assertEqual(result['results'][6]['document']['document_number'], 'IN000013')
+
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.get_total_holdings(), 9)
+        self.assertEqual(verify_balances(), [])
+
+    def test_batch_cost_is_flat(self):
+        with CaptureQueriesContext(connection) as captured:
+            result = self.post_batch([self.slip(received=1) for _ in range(50)])
+        self.assertTrue(result['success'])
+        self.assertEqual(Document.objects.count(), 50)
+        self.assertLess(len(captured.captured_queries), 40)
+
+    def test_rejects_malformed_payload(self):
+        response = self.client.post(reverse('save_documents'), 'nope', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class DeltaResponseTests(LedgerTestMixin, TestCase):
+    def test_update_and_delete_return_only_the_change(self):
+        for i in range(1, 21):
+            self.add_document(f'IN{i:06d}', 'IN', f'2024-01-{i:02d}', received=1)
+        listing = read_json(self.client.get(reverse('get_customer_documents'), {'account_number': '000001'}))
+        version = listing['list_version']
+        doc = Document.objects.get(document_number='IN000005')
+
+        with CaptureQueriesContext(connection) as captured:
+            updated = self.client.post(reverse('update_document', args=[doc.id]), {
+                'document_date': '2024-02-01',
+                'cylinders_received': 4,
+            }).json()
+        self.assertNotIn('updated_documents', updated)
+        self.assertEqual(updated['document'], {
+            'id': doc.id, 'document_number': 'IN000005', 'document_type': 'Tax Invoice',
+            'document_date': '2024-02-01', 'received': 4, 'returned': 0,
+        })
+        self.assertEqual(updated['total_holdings'], 23)
+        self.assertEqual(updated['base_version'], version)
+        self.assertGreater(updated['list_version'], version)
+        # No re-read of the customer's history
+        self.assertFalse(any('web_cylindermovement"."document_id" IN' in q['sql'] for q in captured.captured_queries))
+
+        deleted = self.client.post(reverse('delete_document', args=[doc.id])).json()
+        self.assertEqual(deleted['deleted_document'], {'number': 'IN000005', 'id': doc.id})
+        self.assertEqual(deleted['total_holdings'], 19)
+        self.assertEqual(deleted['base_version'], updated['list_version'])
+
+        cache.clear()
+        listing = read_json(self.client.get(reverse('get_customer_documents'), {'account_number': '000001'}))
+        self.assertEqual(listing['list_version'], deleted['list_version'])
+
+    def test_rebuild_moves_version_on(self):
+        self.add_document('IN000001', 'IN', '2024-01-10', received=1)
+        before = list_version(self.customer)
+        rebuild_all()
+        self.assertGreater(list_version(self.customer), before)
+
+
+class DocumentHistoryTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Two documents per day so pages split inside a date
+        for i in range(1, 31):
+            day = f'2024-{1 + (i - 1) // 20:02d}-{(i - 1) % 20 // 2 + 1:02d}'
+            self.add_document(f'IN{i:06d}', 'IN', day, received=i, returned=1)
+
+    def fetch(self, **params):
+        cache.clear()
+        return read_json(self.client.get(reverse('get_customer_documents'), {'account_number': '000001', **params}))
+
+    def test_pages_follow_date_then_id(self):
+        seen = []
+        cursor = None
+        pages = 0
+        while True:
+            page = self.fetch(limit=7, **({'cursor': cursor} if cursor else {}))
+            self.assertEqual(page['total_documents'], 30)
+            seen.extend(doc['document_number'] for doc in page['documents'])
+            pages += 1
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        expected = list(
+            Document.objects.order_by('-document_date', '-id').values_list('document_number', flat=True)
+        )
+        self.assertEqual(seen, expected)
+        self.assertEqual(pages, 5)
+
+    def test_totals_come_from_aggregation(self):
+        first = self.fetch(limit=1)['documents'][0]
+        self.assertEqual(first, {
+            'id': Document.objects.get(document_number='IN000030').id,
+            'document_number': 'IN000030', 'document_type': 'Tax Invoice',
+            'document_date': '2024-02-05', 'received': 30, 'returned': 1,
+        })
+
+    def test_month_and_range_filters_run_in_sql(self):
+        january = self.fetch(month='2024-01', limit=500)
+        self.assertTrue(january['filter_applied'])
+        self.assertEqual(january['total_documents'], 20)
+        self.assertTrue(all(doc['document_date'].startswith('2024-01') for doc in january['documents']))
+
+        ranged = self.fetch(start_date='2024-01-09', end_date='2024-02-01')
+        self.assertEqual(
+            {doc['document_date'] for doc in ranged['documents']},
+            {'2024-01-09', '2024-01-10', '2024-02-01'}
+        )
+        response = self.client.get(reverse('get_customer_documents'), {
+            'account_number': '000001', 'start_date': 'soon'
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_page_cost_does_not_depend_on_history(self):
+        self.fetch(limit=5)
+        cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            read_json(self.client.get(reverse('get_customer_documents'), {'account_number': '000001', 'limit': 5}))
+        small = len(captured.captured_queries)
+        for i in range(31, 81):
+            self.add_document(f'IN{i:06d}', 'IN', '2024-03-01', received=1)
+        cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            page = read_json(
+                self.client.get(reverse('get_customer_documents'), {'account_number': '000001', 'limit': 5})
+            )
+        self.assertEqual(len(page['documents']), 5)
+        self.assertEqual(len(captured.captured_queries), small)
+
+
+class StreamingJsonTests(LedgerTestMixin, TestCase):
+    def test_body_matches_the_buffered_shape(self):
+        response = StreamingJsonResponse(
+            {'success': True, 'day': date(2024, 1, 5)}, 'rows', iter([{'n': 1}, {'n': 2}, {'n': 3}]),
+            lambda: {'next_cursor': None}, chunk_size=2
+        )
+        chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(json.loads(b''.join(chunks)), {
+            'success': True, 'day': '2024-01-05', 'rows': [{'n': 1}, {'n': 2}, {'n': 3}], 'next_cursor': None
+        })
+        self.assertEqual(json.loads(b''.join(StreamingJsonResponse({}, 'rows', []).streaming_content)), {'rows': []})
+
+    def test_failure_mid_stream_still_closes_the_document(self):
+        def rows():
+            yield {'n': 1}
+            raise RuntimeError('cursor lost')
+
+        with self.assertLogs('web.streaming', 'ERROR'):
+            body = json.loads(b''.join(StreamingJsonResponse({'success': True}, 'rows', rows()).streaming_content))
+        self.assertEqual(body, {'success': True, 'rows': [{'n': 1}], 'error': 'cursor lost'})
+
+    def test_report_streams_rows(self):
+        self.add_document('IN000001', 'IN', '2024-01-10', received=10)
+        response = self.client.get(reverse('monthly_holdings_report'), {'date': '2024-12-31'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(read_json(response)['data'], [{
+            'account_number': '000001', 'customer_name': 'Acme Gas', 'holdings': 10,
+            'last_movement_date': '2024-01-10'
+        }])
+
+
+class ApiCacheTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = Customer.objects.create(name='Beta Braai', account_number='000002')
+        self.add_document('IN000001', 'IN', '2024-01-10', received=5)
+        self.add_document('IN000002', 'IN', '2024-01-11', received=2, customer=self.other)
+
+    def info(self, account='000001'):
+        return self.client.get(reverse('get_customer_info'), {'account_number': account}).json()
+
+    def documents(self, account='000001'):
+        return read_json(self.client.get(reverse('get_customer_documents'), {'account_number': account}))
+
+    def test_repeat_reads_skip_the_database(self):
+        self.info()
+        self.documents()
+        self.client.get(reverse('get_monthly_holdings'), {'year': 2024})
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.info()['customer']['total_holdings'], 5)
+            self.assertEqual(len(self.documents()['documents']), 1)
+            self.client.get(reverse('get_monthly_holdings'), {'year': 2024})
+        # Only the session and user lookups remain
+        self.assertFalse(any('web_' in query['sql'] for query in captured.captured_queries))
+
+    def test_writes_invalidate_exactly(self):
+        self.info()
+        self.info('000002')
+        fleet = self.client.get(reverse('get_monthly_holdings'), {'year': 2024}).json()
+        self.assertEqual(fleet['data'][0]['holdings'], 7)
+
+        self.add_document('IN000003', 'IN', '2024-01-12', received=3)
+        self.assertEqual(self.info()['customer']['total_holdings'], 8)
+        self.assertEqual(len(self.documents()['documents']), 2)
+        fleet = self.client.get(reverse('get_monthly_holdings'), {'year': 2024}).json()
+        self.assertEqual(fleet['data'][0]['holdings'], 10)
+
+        # The other customer's entry is untouched by the write
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.info('000002')['customer']['total_holdings'], 2)
+        self.assertFalse(any('web_' in query['sql'] for query in captured.captured_queries))
+
+        doc = Document.objects.get(document_number='IN000003')
+        self.client.post(reverse('delete_document', args=[doc.id]))
+        self.assertEqual(self.info()['customer']['total_holdings'], 5)
+
+    def test_large_streams_are_not_cached(self):
+        params = {'date': '2024-12-31'}
+        with self.settings(API_CACHE_MAX_STREAMED_BYTES=64):
+            first = read_json(self.client.get(reverse('monthly_holdings_report'), params))
+            self.assertTrue(self.client.get(reverse('monthly_holdings_report'), params).streaming)
+        self.assertEqual(len(first['data']), 2)
+
+        read_json(self.client.get(reverse('monthly_holdings_report'), params))
+        self.assertFalse(self.client.get(reverse('monthly_holdings_report'), params).streaming)
+
+    def test_customer_edits_invalidate(self):
+        self.info()
+        self.customer.name = 'Acme Gas (Pty) Ltd'
+        self.customer.save()
+        self.assertEqual(self.info()['customer']['name'], 'Acme Gas (Pty) Ltd')
+
+
+class ConditionalGetTests(LedgerTestMixin, TestCase):
+    def test_unchanged_data_returns_304(self):
+        self.add_document('IN000001', 'IN', '2024-01-10', received=5)
+        for name in ('get_customer_info', 'get_customer_documents'):
+            url = reverse(name)
+            first = self.client.get(url, {'account_number': '000001'})
+            read_json(first)
+            self.assertIn('no-cache', first['Cache-Control'])
+            etag = first['ETag']
+
+            with CaptureQueriesContext(connection) as captured:
+                second = self.client.get(url, {'account_number': '000001'}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(second.status_code, 304, name)
+            self.assertFalse(any('web_' in query['sql'] for query in captured.captured_queries))
+
+            # A different page or filter is a different entity
+            other = self.client.get(url, {'account_number': '000001', 'month': '2024-01'}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(other.status_code, 200, name)
+
+    def test_changes_produce_a_new_etag(self):
+        self.add_document('IN000001', 'IN', '2024-01-10', received=5)
+        url = reverse('get_customer_info')
+        etag = self.client.get(url, {'account_number': '000001'})['ETag']
+        fleet_etag = self.client.get(reverse('get_monthly_holdings'), {'year': 2024})['ETag']
+
+        self.add_document('IN000002', 'IN', '2024-01-11', received=1)
+        response = self.client.get(url, {'account_number': '000001'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['customer']['total_holdings'], 6)
+        self.assertNotEqual(response['ETag'], etag)
+        response = self.client.get(reverse('get_monthly_holdings'), {'year': 2024}, HTTP_IF_NONE_MATCH=fleet_etag)
+        self.assertEqual(response.status_code, 200)
+
+
+def query_plan(sql, params=()):
+    """SQLite's EXPLAIN QUERY PLAN details for a statement"""
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return ' | '.join(row[-1] for row in cursor.fetchall())
+
+
+class QueryPlanTests(LedgerTestMixin, TestCase):
+    """Hot queries must keep seeking the indexes from migration 0008"""
+
+    def setUp(self):
+        super().setUp()
+        self.document = self.add_document('IN000001', 'IN', '2024-01-10', received=3, returned=1)
+
+    def captured_plan(self, marker, call):
+        with CaptureQueriesContext(connection) as captured:
+            call()
+        statements = [query['sql'] for query in captured.captured_queries if marker in query['sql']]
+        self.assertTrue(statements, marker)
+        return query_plan(statements[0])
+
+    def test_document_page(self):
+        cache.clear()
+        plan = self.captured_plan('"web_document"."document_date" DESC', lambda: read_json(
+            self.client.get(reverse('get_customer_documents'), {'account_number': '000001', 'cursor': '2024-02-01_9'})
+        ))
+        self.assertIn('INDEX document_customer_date (customer_id=? AND document_date<?)', plan)
+        self.assertIn('COVERING INDEX movement_document_type (document_id=? AND movement_type=?)', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_document_totals(self):
+        sql, params = CylinderMovement.objects.filter(document=self.document).values('document').annotate(
+            total=Sum('quantity', filter=Q(movement_type='R'))
+        ).query.sql_with_params()
+        self.assertIn('COVERING INDEX movement_document_type (document_id=?)', query_plan(sql, params))
+
+    def test_latest_document_date(self):
+        plan = self.captured_plan('MAX(U0."document_date")', lambda: self.add_document(
+            'IN000002', 'IN', '2024-01-11', received=1
+        ))
+        self.assertIn('COVERING INDEX document_customer_date (customer_id=?)', plan)
+
+    def test_document_number_prefix(self):
+        DocumentSequence.objects.all().delete()
+        plan = self.captured_plan('"web_document"."document_number" >=', lambda: Document.generate_next_number('IN'))
+        self.assertIn('INDEX sqlite_autoindex_web_document_1 (document_number>? AND document_number<?)', plan)
+
+    def test_holdings_report(self):
+        cache.clear()
+        plan = self.captured_plan('"web_customer"."account_number"', lambda: read_json(
+            self.client.get(reverse('monthly_holdings_report'), {'date': '2024-12-31'})
+        ))
+        self.assertIn('INDEX document_customer_date (customer_id=? AND document_date<?)', plan)
+        self.assertIn('COVERING INDEX movement_document_type (document_id=?)', plan)
+
+    def test_production_profile_pragmas(self):
+        with tempfile.TemporaryDirectory() as directory:
+            profiled = SQLiteDatabaseWrapper({
+                **connection.settings_dict, **settings.SQLITE_PRODUCTION, 'NAME': f'{directory}/db.sqlite3'
+            })
+            try:
+                with profiled.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA synchronous')
+                    self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+                    cursor.execute('PRAGMA cache_size')
+                    self.assertEqual(cursor.fetchone()[0], -65536)
+            finally:
+                profiled.close()
+
+    def test_development_keeps_sqlite_defaults(self):
+        # Settings load with DEBUG on here, so the profile is off
+        self.assertNotIn('init_command', connection.settings_dict['OPTIONS'])
+
+
+class AsyncReadViewTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_document('IN000001', 'IN', '2024-01-10', received=5, returned=2)
+        self.add_document('NR000001', 'NR', '2024-03-02', returned=1)
+
+    def test_read_views_are_async(self):
+        for view in (views.get_customer_info, views.get_customer_documents, views.get_document_details,
+                     views.get_customer_details, views.get_monthly_holdings, views.check_document_number):
+            self.assertTrue(iscoroutinefunction(view), view.__name__)
+
+    async def test_async_client(self):
+        await self.async_client.aforce_login(self.user)
+        account = {'account_number': '000001'}
+
+        info = await self.async_client.get(reverse('get_customer_info'), account)
+        self.assertEqual(info.json()['customer']['total_holdings'], 2)
+        self.assertIn('no-cache', info['Cache-Control'])
+        unchanged = await self.async_client.get(reverse('get_customer_info'), account, headers={
+            'If-None-Match': info['ETag']
+        })
+        self.assertEqual(unchanged.status_code, 304)
+
+        documents = await self.async_client.get(reverse('get_customer_documents'), {**account, 'limit': 1})
+        body = json.loads(b''.join([chunk async for chunk in documents.streaming_content]))
+        self.assertEqual([row['document_number'] for row in body['documents']], ['NR000001'])
+        self.assertEqual(body['next_cursor'].split('_')[0], '2024-03-02')
+
+        details = await self.async_client.get(reverse('get_document_details', args=['IN000001']))
+        self.assertEqual(details.json()['document']['customer_name'], 'Acme Gas')
+        self.assertEqual(details.json()['document']['cylinders_received'], 5)
+
+        customer = await self.async_client.get(reverse('get_customer_details', args=['000001']))
+        self.assertEqual(customer.json()['customer']['last_transaction'], '2024-03-02')
+        self.assertEqual(len(customer.json()['recent_transactions']), 2)
+
+        holdings = await self.async_client.get(reverse('get_monthly_holdings'), {**account, 'year': 2024})
+        self.assertEqual([month['holdings'] for month in holdings.json()['data'][:3]], [3, 3, 2])
+
+        exists = await self.async_client.get(reverse('check_document_number'), {'document_number': 'IN000001'})
+        self.assertTrue(exists.json()['exists'])
+
+    streamed = (
+        ('get_customer_documents', {'account_number': '000001'}),
+        ('monthly_holdings_report', {'date': '2024-12-31'}),
+    )
+
+    def test_streams_are_not_buffered_under_wsgi(self):
+        for name, params in self.streamed:
+            response = self.client.get(reverse(name), params)
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                # Iterating the response is what the WSGI handler does
+                body = b''.join(response)
+            self.assertFalse(response.is_async, name)
+            self.assertEqual([str(warning.message) for warning in caught], [], name)
+            self.assertTrue(json.loads(body)['success'])
+
+    async def test_streams_are_not_buffered_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        for name, params in self.streamed:
+            response = await self.async_client.get(reverse(name), params)
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                body = b''.join([chunk async for chunk in response])
+            self.assertTrue(response.is_async, name)
+            self.assertEqual([str(warning.message) for warning in caught], [], name)
+            self.assertTrue(json.loads(body)['success'])
+
+    async def test_login_still_required(self):
+        response = await self.async_client.get(reverse('get_customer_info'), {'account_number': '000001'})
+        self.assertEqual(response.status_code, 302)
+
+
+def read_events(body):
+    """Parse a text/event-stream body into dicts of its fields, data decoded"""
+    blocks = []
+    for block in body.decode().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+        if 'data' in fields:
+            fields['data'] = json.loads(fields['data'])
+        if fields:
+            blocks.append(fields)
+    return blocks
+
+
+class DocumentEventTests(LedgerTestMixin, TestCase):
+    def events(self, account_number=None, **headers):
+        params = {'account_number': account_number} if account_number else {}
+        response = self.client.get(reverse('document_events'), params, headers=headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return read_events(response.content)
+
+    def test_writes_publish_events(self):
+        other = Customer.objects.create(name='Beta Braai', account_number='000002')
+        doc = self.add_document('IN000001', 'IN', '2024-01-10', received=5)
+        self.client.post(reverse('update_document', args=[doc.id]), {
+            'document_date': '2024-01-12', 'cylinders_received': 4,
+        })
+        self.add_document('IN000002', 'IN', '2024-01-11', received=1, customer=other)
+        self.client.post(reverse('delete_document', args=[doc.id]))
+
+        blocks = self.events('000001', **{'Last-Event-ID': '0'})
+        self.assertEqual(blocks[0]['retry'], '5000')
+        self.assertEqual(
+            [block['event'] for block in blocks[1:]], ['document.added', 'document.updated', 'document.deleted']
+        )
+        added, updated, deleted = (block['data'] for block in blocks[1:])
+        self.assertEqual(added['document']['received'], 5)
+        self.assertEqual(added['total_holdings'], 5)
+        self.assertEqual(updated['document']['document_date'], '2024-01-12')
+        self.assertEqual(updated['base_version'], added['list_version'])
+        self.assertEqual(deleted['deleted_document']['id'], doc.id)
+        self.assertEqual((deleted['total_holdings'], deleted['list_version']), (0, list_version(self.customer)))
+
+        fleet = self.events(**{'Last-Event-ID': '0'})
+        self.assertEqual(len(fleet) - 1, 4)
+        self.assertEqual(fleet[3]['data']['account_number'], '000002')
+
+    def test_first_document_moves_the_list_version(self):
+        empty = read_json(self.client.get(reverse('get_customer_documents'), {'account_number': '000001'}))
+        self.assertEqual((empty['documents'], empty['list_version']), ([], 0))
+        self.add_document('IN000001', 'IN', '2024-01-10', received=5)
+
+        added = self.events('000001', **{'Last-Event-ID': '0'})[1]['data']
+        self.assertEqual(added['base_version'], 0)
+        # Otherwise other tabs would take the event for their own change and drop it
+        self.assertGreater(added['list_version'], empty['list_version'])
+        self.assertEqual(added['list_version'], list_version(self.customer))
+
+    def test_new_connections_start_now_and_resume_from_last_event_id(self):
+        self.add_document('IN000001', 'IN', '2024-01-10', received=5)
+        latest = ChangeEvent.objects.latest('id').id
+        self.assertEqual(self.events('000001'), [{'retry': '5000', 'id': str(latest)}])
+
+        self.add_document('IN000002', 'IN', '2024-01-11', received=2)
+        blocks = self.events('000001', **{'Last-Event-ID': str(latest)})
+        self.assertEqual([block['data']['document']['document_number'] for block in blocks[1:]], ['IN000002'])
+        self.assertEqual(blocks[-1]['id'], str(latest + 1))
+
+    def test_batch_publishes_one_event_per_customer(self):
+        Customer.objects.create(name='Beta Braai', account_number='000002')
+        self.client.post(reverse('save_documents'), json.dumps({'documents': [
+            {'customer_account': account, 'document_type': 'IN', 'document_date': '2024-03-01',
+             'cylinders_received': 2}
+            for account in ('000001', '000001', '000002')
+        ]}), content_type='application/json')
+        blocks = self.events(**{'Last-Event-ID': '0'})[1:]
+        self.assertEqual(
+            sorted((block['data']['account_number'], block['data']['count']) for block in blocks),
+            [('000001', 2), ('000002', 1)]
+        )
+        self.assertEqual({block['event'] for block in blocks}, {'documents.added'})
+
+    def test_failed_write_publishes_nothing(self):
+        self.add_document('IN000001', 'IN', '2024-01-10', received=5)
+        response = self.client.post(reverse('save_document'), {
+            'customer_account': '000001', 'document_type': 'IN', 'document_number': 'IN000001',
+            'document_date': '2024-01-11', 'cylinders_received': 1,
+        })
+        self.assertFalse(response.json()['success'])
+        self.assertEqual(ChangeEvent.objects.count(), 1)
+
+    @override_settings(EVENTS_STREAM_SECONDS=0.3, EVENTS_POLL_SECONDS=0.05, EVENTS_KEEPALIVE_SECONDS=0.1)
+    async def test_asgi_stream(self):
+        await self.async_client.aforce_login(self.user)
+        await ChangeEvent.objects.acreate(account_number='000001', kind='document.deleted', payload={'x': 1})
+        await ChangeEvent.objects.acreate(account_number='000002', kind='document.deleted', payload={'x': 2})
+
+        response = await self.async_client.get(reverse('document_events'), {'account_number': '000001'}, headers={
+            'Last-Event-ID': '0'
+        })
+        self.assertTrue(response.streaming)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        blocks = read_events(body)
+        self.assertEqual(blocks[0]['retry'], '3000')
+        self.assertEqual([block['data'] for block in blocks[1:]], [{'account_number': '000001', 'x': 1}])
+        self.assertIn(b': keep-alive', body)
+
+
+def read_csv(body):
+    return list(csv.reader(io.StringIO(body.decode())))
+
+
+class CsvExportTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = Customer.objects.create(name='Beta, "Braai"', account_number='000002')
+        self.add_document('IN000001', 'IN', '2024-01-10', received=5, returned=1)
+        self.add_document('NR000001', 'NR', '2024-02-03', returned=2)
+        self.add_document('IN000002', 'IN', '2024-02-20', received=3, customer=self.other)
+
+    def test_holdings_report(self):
+        response = self.client.get(reverse('export_holdings_report'), {'date': '2024-01-31'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="holdings-2024-01-31.csv"')
+        self.assertEqual(read_csv(read_body(response)), [
+            ['account_number', 'customer_name', 'holdings', 'last_movement_date'],
+            ['000001', 'Acme Gas', '4', '2024-01-10'],
+        ])
+        self.assertEqual(self.client.get(reverse('export_holdings_report')).status_code, 400)
+
+    def test_customer_documents_with_filters(self):
+        url = reverse('export_customer_documents')
+        rows = read_csv(read_body(self.client.get(url, {'account_number': '000001'})))
+        self.assertEqual(rows[0], ['document_number', 'document_type', 'document_date', 'status', 'received', 'returned'])
+        self.assertEqual([row[0] for row in rows[1:]], ['NR000001', 'IN000001'])
+        self.assertEqual(rows[2][4:], ['5', '1'])
+
+        rows = read_csv(read_body(self.client.get(url, {'account_number': '000001', 'month': '2024-01'})))
+        self.assertEqual([row[0] for row in rows[1:]], ['IN000001'])
+        self.assertEqual(self.client.get(url, {'account_number': '999999'}).status_code, 404)
+        self.assertEqual(self.client.get(url, {'account_number': '000001', 'end_date': 'x'}).status_code, 400)
+
+    def test_movements_gzipped(self):
+        response = self.client.get(reverse('export_movements'), {'gzip': '1', 'start_date': '2024-02-01'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="movements.csv.gz"')
+        rows = read_csv(gzip.decompress(read_body(response)))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[2][:7], ['IN000002', 'IN', '2024-02-20', '000002', 'Beta, "Braai"', 'R', '3'])
+
+    def test_rows_are_written_in_chunks(self):
+        chunks = list(exports.to_csv(exports.movements(), rows_per_chunk=2))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(len(read_csv(b''.join(chunks))), 5)
+
+    async def test_asgi_streams_without_buffering(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('export_movements'))
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(read_csv(body)), 5)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/documents.csv.gz'
+            call_command('export_csv', 'documents', account='000001', start=date(2024, 2, 1), output=path,
+                         gzip=True, stderr=io.StringIO())
+            with gzip.open(path, 'rt') as handle:
+                rows = list(csv.reader(handle))
+        self.assertEqual([row[0] for row in rows[1:]], ['NR000001'])
+
+
+    def test_command_rejects_bad_dates(self):
+        with self.assertRaisesMessage(CommandError, "invalid parse_date value: '2024-02-30'"):
+            call_command('export_csv', 'holdings', '--date', '2024-02-30', stdout=io.StringIO())
+        with self.assertRaisesMessage(ValueError, "Invalid date '2024-02-30', expected YYYY-MM-DD"):
+            parse_date('2024-02-30')
+
+
+class StatementTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = Customer.objects.create(name='Beta (Braai)', account_number='000002')
+        Customer.objects.create(name='Closed Co', account_number='000003')
+        Customer.objects.filter(account_number='000003').update(is_active=False)
+        self.add_document('IN000001', 'IN', '2024-01-10', received=5, returned=1)
+        self.add_document('IN000002', 'IN', '2024-02-03', received=2)
+        self.add_document('NR000001', 'NR', '2024-02-20', returned=3)
+        self.add_document('IN000003', 'IN', '2024-03-01', received=9)
+        self.add_document('IN000004', 'IN', '2024-01-05', received=1, customer=self.other)
+
+    def test_month_loaded_in_two_queries(self):
+        with self.assertNumQueries(2):
+            result = list(statements.build_statements(date(2024, 2, 1)))
+        self.assertEqual([s['account_number'] for s in result], ['000001', '000002'])
+        acme, beta = result
+        self.assertEqual((acme['opening_balance'], acme['received'], acme['returned'], acme['closing_balance']),
+                         (4, 2, 3, 3))
+        self.assertEqual([(line['document_number'], line['balance']) for line in acme['documents']],
+                         [('IN000002', 6), ('NR000001', 3)])
+        self.assertEqual((beta['opening_balance'], beta['documents'], beta['closing_balance']), (1, [], 1))
+
+    def test_generate_across_a_pool(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(), \
+                self.settings(STATEMENTS_DIR=directory):
+            statements.POOL_THRESHOLD, threshold = 1, statements.POOL_THRESHOLD
+            try:
+                reported = []
+                result = statements.generate(date(2024, 2, 1), directory, workers=2,
+                                             progress=lambda done, total: reported.append((done, total)))
+            finally:
+                statements.POOL_THRESHOLD = threshold
+            self.assertEqual((result['statements'], result['files'], result['workers']), (2, 6, 2))
+            self.assertEqual(reported, [(0, 2), (1, 2), (2, 2)])
+            month = f'{directory}/2024-02'
+            with open(f'{month}/summary.csv') as handle:
+                summary = list(csv.DictReader(handle))
+            self.assertEqual([(row['account_number'], row['closing_balance']) for row in summary],
+                             [('000001', '3'), ('000002', '1')])
+            with open(f'{month}/000001.csv', 'rb') as handle:
+                rows = read_csv(handle.read())
+            self.assertEqual(rows[-1], ['Closing balance', '', '', '2', '3', '3'])
+            with open(f'{month}/000002.html', 'rb') as handle:
+                self.assertIn(b'Beta (Braai)', handle.read())
+            with open(f'{month}/000002.pdf', 'rb') as handle:
+                pdf = handle.read()
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        self.assertIn(b'(Beta \\(Braai\\) \\(000002\\)) Tj', pdf)
+        xref = int(pdf.rsplit(b'startxref\n', 1)[1].split(b'\n')[0])
+        self.assertTrue(pdf[xref:].startswith(b'xref'))
+
+    def test_pdf_pages(self):
+        statement = next(statements.build_statements(date(2024, 2, 1), ['000001']))
+        statement['documents'] = statement['documents'] * 50
+        self.assertIn(b'/Count 2', statements.render_pdf(statement))
+
+    def test_staff_endpoints(self):
+        response = self.client.get(reverse('customer_statement'), {
+            'month': '2024-02', 'account_number': '000001', 'format': 'csv'
+        })
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="000001-2024-02.csv"')
+        self.assertEqual(read_csv(response.content)[1], ['Opening balance', '', '', '', '', '4'])
+        self.assertEqual(self.client.get(reverse('customer_statement'), {
+            'month': '2024-02', 'account_number': '000003'
+        }).status_code, 404)
+        self.assertEqual(self.client.get(reverse('customer_statement'), {'month': 'feb'}).status_code, 400)
+
+        with tempfile.TemporaryDirectory() as directory, self.settings(STATEMENTS_DIR=directory):
+            response = self.client.post(reverse('generate_statements'), {'month': '2024-02', 'format': 'csv'})
+            self.assertEqual(response.status_code, 202)
+            jobs.work(once=True)
+            result = self.client.get(response['Location']).json()['job']['result']
+            self.assertEqual((result['statements'], result['files']), (2, 2))
+        self.assertEqual(self.client.post(reverse('generate_statements'), {
+            'month': '2024-02', 'format': 'doc'
+        }).status_code, 400)
+
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.post(reverse('generate_statements'), {'month': '2024-02'}).status_code, 302)
+
+
+class JobQueueTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_document('IN000001', 'IN', '2024-01-10', received=5, returned=1)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = self.settings(JOBS_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def submit(self, kind, params):
+        response = self.client.post(reverse('submit_job'), json.dumps({'kind': kind, 'params': params}),
+                                    content_type='application/json')
+        return response
+
+    def test_holdings_report_in_the_background(self):
+        response = self.client.get(reverse('monthly_holdings_report'), {'date': '2024-12-31', 'background': '1'})
+        self.assertEqual(response.status_code, 202)
+        state = response.json()['job']
+        self.assertEqual(state['status'], 'QUEUED')
+
+        self.assertEqual(jobs.work(once=True), 1)
+        state = self.client.get(state['status_url']).json()['job']
+        self.assertEqual(state['status'], 'DONE')
+        self.assertEqual(state['result']['data'], [{
+            'account_number': '000001', 'customer_name': 'Acme Gas', 'holdings': 4, 'last_movement_date': '2024-01-10'
+        }])
+        # Same payload as the synchronous report
+        self.assertEqual(state['result'], read_json(
+            self.client.get(reverse('monthly_holdings_report'), {'date': '2024-12-31'})
+        ))
+
+    def test_export_job_file_download(self):
+        response = self.submit('export', {'export': 'movements', 'gzip': True})
+        self.assertEqual(response.status_code, 202)
+        jobs.work(once=True)
+        state = self.client.get(response['Location']).json()['job']
+        self.assertEqual((state['result']['rows'], state['result']['filename']), (2, 'movements.csv.gz'))
+
+        download = self.client.get(state['download_url'])
+        self.assertEqual(download['Content-Disposition'], 'attachment; filename="movements.csv.gz"')
+        self.assertEqual(len(read_csv(gzip.decompress(read_body(download)))), 3)
+
+    def test_failures_are_recorded(self):
+        response = self.submit('export', {'export': 'nothing'})
+        jobs.work(once=True)
+        state = self.client.get(response['Location']).json()['job']
+        self.assertEqual((state['status'], state['message']), ('FAILED', "Unknown export 'nothing'"))
+        self.assertIn('Traceback', Job.objects.get(pk=state['id']).error)
+        self.assertNotIn('result', state)
+
+    def test_submission_rules(self):
+        self.assertEqual(self.submit('mine_bitcoin', {}).status_code, 400)
+        self.assertEqual(self.client.post(reverse('submit_job'), 'nope', content_type='application/json').status_code, 400)
+
+        clerk = User.objects.create_user('counter', password='secret')
+        job = jobs.submit('holdings_report', {'date': '2024-12-31'}, self.user)
+        self.client.force_login(clerk)
+        self.assertEqual(self.submit('statements', {'month': '2024-01'}).status_code, 403)
+        self.assertEqual(self.client.get(reverse('job_status', args=[job.id])).status_code, 404)
+        self.assertEqual(self.submit('holdings_report', {'date': '2024-12-31'}).status_code, 202)
+
+    def test_claims_are_exclusive_and_in_order(self):
+        first = jobs.submit('holdings_report', {'date': '2024-12-31'})
+        second = jobs.submit('holdings_report', {'date': '2024-11-30'})
+        self.assertEqual(jobs.claim('a').pk, first.pk)
+        self.assertEqual(jobs.claim('b').pk, second.pk)
+        self.assertIsNone(jobs.claim('c'))
+        self.assertEqual(Job.objects.get(pk=first.pk).worker, 'a')
+
+    def test_stale_jobs_are_requeued_then_failed(self):
+        job = jobs.submit('holdings_report', {'date': '2024-12-31'})
+        later = timezone.now() + jobs.STALE_AFTER + timedelta(seconds=1)
+        for attempt in range(1, jobs.MAX_ATTEMPTS + 1):
+            self.assertEqual(jobs.claim('lost').attempts, attempt)
+            self.assertEqual(jobs.requeue_stale(later), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.message), ('FAILED', 'Worker stopped responding'))
+
+    def test_progress_is_reported(self):
+        job = jobs.submit('holdings_report', {'date': '2024-12-31'})
+        run = jobs.JobRun(job)
+        run.progress(3, 10, 'Three down', force=True)
+        run.progress(4, 10, 'Throttled')
+        job.refresh_from_db()
+        self.assertEqual((job.progress_done, job.progress_total, job.message), (3, 10, 'Three down'))
+
+    def test_pastel_reconciliation(self):
+        pastel = FakePastel()
+        self.addCleanup(pastel.stop)
+        pastel.items = [{'code': 'CYL001', 'description': '9kg cylinder'}]
+        pastel.invoices = [
+            {'number': number, 'date': day, 'account_code': '000001',
+             'lines': [{'item_code': 'CYL001', 'quantity': 2}]}
+            for number, day in (('IN000001', '2024-01-10'), ('IN000002', '2024-01-20'))
+        ]
+        with self.settings(PASTEL_API_URL=pastel.url):
+            job = jobs.submit('pastel_reconciliation', {'start': '2024-01-01', 'end': '2024-01-31'})
+            jobs.work(once=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'DONE', job.error)
+        self.assertEqual([m['invoice_number'] for m in job.result['movements']], ['IN000002'])
+        self.assertEqual(job.progress_done, job.progress_total)
+
+    def test_statements_report_progress_while_writing(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(STATEMENTS_DIR=directory):
+            job = jobs.submit('statements', {'month': '2024-01', 'formats': ['csv']})
+            jobs.work(once=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'DONE', job.error)
+        # Written statements are reported as they go, each report refreshing the heartbeat
+        self.assertEqual((job.progress_done, job.progress_total), (1, 1))
+
+    def test_pastel_failure_fails_the_reconciliation(self):
+        pastel = FakePastel()
+        self.addCleanup(pastel.stop)
+        pastel.unavailable = {'2024-01-08'}
+        with self.settings(PASTEL_API_URL=pastel.url):
+            job = jobs.submit('pastel_reconciliation', {'start': '2024-01-01', 'end': '2024-01-31'})
+            with self.assertLogs('web', 'ERROR'):
+                jobs.work(once=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'FAILED')
+        self.assertEqual(job.message, 'Could not fetch invoices for 2024-01-08 to 2024-01-14')
+        self.assertIsNone(job.result)
+
+    def test_prune_removes_old_jobs_and_files(self):
+        self.submit('export', {'export': 'movements'})
+        jobs.work(once=True)
+        job = Job.objects.get()
+        self.assertTrue(os.path.exists(job.result_file))
+        Job.objects.update(finished_at=timezone.now() - timedelta(days=8))
+        self.assertEqual(jobs.prune(timedelta(days=7)), 1)
+        self.assertFalse(os.path.exists(job.result_file))
+
+
+class AdminChangelistTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser('admin', password='secret')
+        self.client.force_login(self.admin)
+
+    def add_documents(self, count, start):
+        customer = Customer.objects.create(name=f'Customer {start}', account_number=f'{start:06d}')
+        for n in range(start, start + count):
+            document = Document.objects.create(
+                document_number=f'IN{n:06d}', document_type='IN', document_date=date(2024, 1, 1 + n % 28),
+                customer=customer, created_by=self.admin,
+            )
+            CylinderMovement.objects.create(document=document, movement_type='R', quantity=n)
+        return customer
+
+    def changelist_queries(self, model, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f'admin:web_{model}_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists_run_in_constant_queries(self):
+        self.add_documents(3, 100)
+        small = {model: self.changelist_queries(model) for model in ('customer', 'document', 'cylindermovement')}
+        for n in range(5):
+            self.add_documents(20, 200 + 100 * n)
+        large = {model: self.changelist_queries(model) for model in ('customer', 'document', 'cylindermovement')}
+        self.assertEqual(small, large)
+
+    def test_list_columns_and_account_filter(self):
+        self.add_documents(2, 100)
+        other = self.add_documents(2, 200)
+        response = self.client.get(reverse('admin:web_document_changelist'), {'account': other.account_number})
+        documents = list(response.context['cl'].result_list)
+        self.assertEqual([d.document_number for d in documents], ['IN000201', 'IN000200'])
+        self.assertEqual([(d.received, d.returned) for d in documents], [(201, 0), (200, 0)])
+        self.assertContains(response, f'value="{other.account_number}"')
+
+        response = self.client.get(reverse('admin:web_cylindermovement_changelist'),
+                                   {'account': other.account_number})
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+        # No link per customer in the sidebar
+        self.assertNotContains(response, '?document__customer__id__exact=')
+
+    def test_customer_holdings_column(self):
+        self.add_document('IN000001', 'IN', '2024-01-10', received=7, returned=2)
+        response = self.client.get(reverse('admin:web_customer_changelist'), {'o': '3'})
+        holdings = {c.account_number: c.holdings for c in response.context['cl'].result_list}
+        self.assertEqual(holdings['000001'], 5)
+
+    def test_estimated_count(self):
+        from .admin import EstimatedCountPaginator
+        self.add_documents(12, 100)
+        documents = Document.objects.order_by('pk')
+        paginator = EstimatedCountPaginator(documents, 5)
+        paginator.count_limit = 20
+        self.assertEqual(paginator.count, 12)
+
+        Document.objects.filter(document_number='IN000105').delete()
+        paginator = EstimatedCountPaginator(documents, 5)
+        paginator.count_limit = 10
+        highest = Document.objects.order_by('-pk').values_list('pk', flat=True).first()
+        self.assertEqual(paginator.count, highest)
+        paginator = EstimatedCountPaginator(documents.filter(document_type='IN'), 5)
+        paginator.count_limit = 10
+        self.assertEqual(paginator.count, 10)
@@ -0,0 +1,25 @@
+"""
+Sampled, level-gated structured tracing for hot paths.
+
+Tracing is off unless the ``web.trace`` logger is enabled at DEBUG. Callers
+check ``tracer.sampled()`` once per request and only build trace fields when
+it returns True, so a disabled tracer costs one cached level check.
+"""
+import logging
+import random
+from django.conf import settings
+
+
+class Tracer:
+    def __init__(self, name: str):
+        self.logger = logging.getLogger(f'web.trace.{name}')
+
+    def sampled(self) -> bool:
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return False
+        rate = getattr(settings, 'TRACE_SAMPLE_RATE', 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+    def emit(self, event: str, **fields):
+        message = ' '.join(f'{key}={value}' for key, value in fields.items())
+        self.logger.debug(f'{event} {message}', extra={'trace_event': event, 'trace': fields})
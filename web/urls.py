@@ -10,6 +10,7 @@ urlpatterns = [
     path('logout/', auth_views.LogoutView.as_view(next_page='landing'), name='logout'),
     path('api/customer-info/', views.get_customer_info, name='get_customer_info'),
     path('api/save-document/', views.save_document, name='save_document'),
+    path('api/save-documents/', views.save_documents, name='save_documents'),
     path('api/customer-documents/', views.get_customer_documents, name='get_customer_documents'),
     path('api/check-document-number/', views.check_document_number, name='check_document_number'),
     path('api/document-details/<str:document_number>/', views.get_document_details, name='get_document_details'),
@@ -19,4 +20,14 @@ urlpatterns = [
     path('api/customer-details/<str:account_number>/', views.get_customer_details, name='get_customer_details'),
     path('api/monthly-holdings/', views.get_monthly_holdings, name='get_monthly_holdings'),
     path('api/monthly-holdings-report/', views.get_monthly_holdings_report, name='monthly_holdings_report'),
+    path('api/export/holdings-report.csv', views.export_holdings_report, name='export_holdings_report'),
+    path('api/export/customer-documents.csv', views.export_customer_documents, name='export_customer_documents'),
+    path('api/export/movements.csv', views.export_movements, name='export_movements'),
+    path('api/statement/', views.customer_statement, name='customer_statement'),
+    path('api/statements/', views.generate_statements, name='generate_statements'),
+    path('api/jobs/', views.submit_job, name='submit_job'),
+    path('api/jobs/<int:job_id>/', views.job_status, name='job_status'),
+    path('api/jobs/<int:job_id>/download/', views.job_download, name='job_download'),
+    path('api/document-events/', views.document_events, name='document_events'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -1,14 +1,83 @@
 from django.shortcuts import render, redirect
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
-from .models import Customer, Document, CylinderMovement
-from django.core.exceptions import ObjectDoesNotExist
-from .forms import DocumentForm, CustomerForm
-from django.db.models import Sum
+from .models import (
+    Customer, CustomerBalance, Document, CylinderMovement, DocumentSequence, Job, MonthlyHoldings, document_number_value,
+    format_document_number
+)
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from .forms import DocumentForm, CustomerForm, normalize_document_number, validate_movements
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.contrib.admin.views.decorators import staff_member_required
 from django.db.models import Prefetch
 from django.contrib import messages
+from django.conf import settings
+from django.db import transaction
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from . import api_cache, events, exports, jobs, ledger, statements
+from .importer import write_documents
+from .services import existing_document_numbers
+from .streaming import StreamingJsonResponse, for_handler, map_rows, rows_for_handler
+from .metrics import registry
+from .tracing import Tracer
+import json
+import logging
+import os
+from functools import wraps
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+tracer = Tracer('views')
+
+MAX_BATCH_DOCUMENTS = 500
+DOCUMENTS_PAGE_SIZE = 100
+MAX_DOCUMENTS_PAGE_SIZE = 500
+
+def _query_etag(name):
+    """ETag from the requested customer's (or the fleet's) cache version and the query string"""
+    def etag_func(request, *args, **kwargs):
+        account_number = request.GET.get('account_number')
+        params = sorted((key, value) for key, value in request.GET.items() if key != '_')
+        return api_cache.etag(name, (account_number or api_cache.FLEET,), params)
+    return etag_func
+
+def revalidated(name):
+    """
+    Answer If-None-Match with 304 before the view runs, and tell browsers to
+    keep the response but check it with the server on every use.
+    """
+    etag_func = _query_etag(name)
+
+    def decorator(view):
+        if not iscoroutinefunction(view):
+            conditional_view = condition(etag_func=etag_func)(view)
+
+            @wraps(view)
+            def wrapped(request, *args, **kwargs):
+                response = conditional_view(request, *args, **kwargs)
+                patch_cache_control(response, private=True, no_cache=True)
+                return response
+            return wrapped
+
+        # condition() calls etag_func synchronously, so read the cache versions
+        # in a thread first rather than on the event loop
+        conditional_view = condition(etag_func=lambda request, *args, **kwargs: request.api_etag)(view)
+
+        @wraps(view)
+        async def async_wrapped(request, *args, **kwargs):
+            request.api_etag = await sync_to_async(etag_func)(request, *args, **kwargs)
+            response = await conditional_view(request, *args, **kwargs)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return async_wrapped
+    return decorator
 
 @login_required
 def dashboard(request):
@@ -26,7 +95,6 @@ def dashboard(request):
             ).prefetch_related('movements').order_by('-document_date')
             
             total_holdings = customer.get_total_holdings()
-            print(f"Initial load: Found {documents.count()} documents for customer {customer.name}")
             
         except Customer.DoesNotExist:
             documents = []
@@ -41,11 +109,22 @@ def dashboard(request):
         'customer': customer,
     })
 
+def _customer_list():
+    """Active customers with holdings, last transaction and document count, in one query"""
+    return Customer.objects.filter(
+        is_active=True
+    ).order_by('name').values(
+        'account_number',
+        'name',
+        'contact_person',
+        'phone_number',
+        total_holdings=Coalesce('balance__balance', 0),
+        last_transaction=F('balance__last_movement_date'),
+        document_count=Coalesce('balance__document_count', 0),
+    )
+
 @login_required
 def customer_management(request):
-    # Force a fresh query with no caching
-    customers = Customer.objects.filter(is_active=True).order_by('name').select_related()
-    
     if request.method == 'POST':
         form = CustomerForm(request.POST)
         if form.is_valid():
@@ -55,24 +134,11 @@ def customer_management(request):
                 customer.is_active = True
                 customer.save()
                 
-                # Force a fresh query after saving
-                updated_customers = Customer.objects.filter(
-                    is_active=True
-                ).order_by('name').select_related()
-                
                 # Return both success message and updated customer data
                 return JsonResponse({
                     'success': True,
                     'message': f'Customer {customer.name} added successfully',
-                    'customers': [
-                        {
-                            'account_number': c.account_number,
-                            'name': c.name,
-                            'contact_person': c.contact_person or '',
-                            'phone_number': c.phone_number or '',
-                            'total_holdings': c.get_total_holdings()
-                        } for c in updated_customers
-                    ]
+                    'customers': list(_customer_list())
                 })
             except Exception as e:
                 return JsonResponse({
@@ -81,18 +147,36 @@ def customer_management(request):
                 })
     else:
         form = CustomerForm()
-        # Force refresh customers list on GET request
-        customers = Customer.objects.filter(
-            is_active=True
-        ).order_by('name').select_related()
     
     context = {
-        'customers': customers,
+        'customers': _customer_list(),
         'form': form
     }
     
     return render(request, 'web/customer_management.html', context)
 
+def _create_movements(document, data):
+    """Create the movements posted for a document, returning (received, returned)"""
+    received = 0
+    if document.document_type != 'NR':
+        # Only Tax Invoices can receive cylinders
+        received = max(int(data.get('cylinders_received') or 0), 0)
+    returned = max(int(data.get('cylinders_returned') or 0), 0)
+    
+    if received:
+        CylinderMovement.objects.create(
+            document=document,
+            movement_type='R',
+            quantity=received
+        )
+    if returned:
+        CylinderMovement.objects.create(
+            document=document,
+            movement_type='E',
+            quantity=returned
+        )
+    return received, returned
+
 @login_required
 def save_document(request):
     if request.method == 'POST':
@@ -106,44 +190,31 @@ def save_document(request):
             if not document_number:
                 document_number = Document.generate_next_number(document_type)
             
-            # Create document
-            document = Document.objects.create(
-                document_number=document_number,
-                document_type=document_type,
-                document_date=request.POST.get('document_date'),
-                customer=customer,
-                created_by=request.user,
-                status='ACTIVE'
-            )
-            
-            # Create movements
-            if document_type == 'NR':
-                # Only create returned movement for NR
-                returned = request.POST.get('cylinders_returned')
-                if returned and int(returned) > 0:
-                    CylinderMovement.objects.create(
-                        document=document,
-                        movement_type='E',
-                        quantity=int(returned)
-                    )
-            else:
-                # Handle both movements for IN
-                received = request.POST.get('cylinders_received')
-                returned = request.POST.get('cylinders_returned')
-                
-                if received and int(received) > 0:
-                    CylinderMovement.objects.create(
-                        document=document,
-                        movement_type='R',
-                        quantity=int(received)
-                    )
+            with transaction.atomic():
+                base_version = ledger.list_version(customer)
+                if request.POST.get('document_number'):
+                    # Keep the sequence ahead of numbers typed in from paper slips
+                    DocumentSequence.observe(document_type, document_number_value(document_number))
+
+                # Create document
+                document = Document.objects.create(
+                    document_number=document_number,
+                    document_type=document_type,
+                    document_date=request.POST.get('document_date'),
+                    customer=customer,
+                    created_by=request.user,
+                    status='PENDING_SYNC' if settings.PASTEL_SYNC_LOCAL_DOCUMENTS else 'ACTIVE'
+                )
                 
-                if returned and int(returned) > 0:
-                    CylinderMovement.objects.create(
-                        document=document,
-                        movement_type='E',
-                        quantity=int(returned)
-                    )
+                # Create movements and bring the stored balance up to date
+                received, returned = _create_movements(document, request.POST)
+                ledger.record_movements(customer, document.document_date, received, returned, documents=1)
+                document.refresh_from_db(fields=['document_date'])
+                events.publish(customer.account_number, 'document.added', {
+                    'document': _document_row(document, received, returned),
+                    'base_version': base_version,
+                    **_ledger_state(customer)
+                })
             
             return JsonResponse({
                 'success': True,
@@ -170,194 +241,370 @@ def save_document(request):
         'message': 'Invalid request method'
     })
 
-def calculate_cylinder_holdings(customer, month=None):
-    print(f"Calculating holdings for {customer.name}")  # Debug log
-    
-    # Get all movements ordered by date
-    movements = CylinderMovement.objects.filter(
-        document__customer=customer
-    ).select_related('document').order_by('document__document_date')
+def _batch_quantity(value):
+    try:
+        return max(int(value or 0), 0)
+    except (TypeError, ValueError):
+        raise ValidationError(f"Invalid quantity {value!r}")
 
-    if month:
-        year, month = month.split('-')
-        end_date = timezone.datetime(int(year), int(month) + 1, 1)
-        movements = movements.filter(document__document_date__lt=end_date)
+def _clean_batch_item(item, customers):
+    """Validate one batch entry with the DocumentForm rules; duplicates are checked in bulk later"""
+    if not isinstance(item, dict):
+        raise ValidationError("Each document must be an object")
+    document_type = item.get('document_type')
+    if document_type not in dict(Document.DOCUMENT_TYPES):
+        raise ValidationError("Invalid document type")
 
-    running_total = 0
-    
-    # Print all movements for debugging
-    for movement in movements:
-        print(f"\nDocument: {movement.document.document_number}")
-        print(f"Date: {movement.document.document_date}")
-        print(f"Type: {movement.movement_type}")
-        print(f"Quantity: {movement.quantity}")
-        
-        if movement.movement_type == 'R':
-            running_total += movement.quantity
-        else:  # 'E' for Empty Return
-            running_total -= movement.quantity
-            
-        print(f"Running total after this movement: {running_total}")
+    customer = customers.get(str(item.get('customer_account') or '').strip())
+    if customer is None:
+        raise ValidationError("Customer not found")
 
-    print(f"\nFinal holdings: {running_total}")  # Debug log
-    return running_total
+    try:
+        document_date = datetime.strptime(str(item.get('document_date') or ''), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValidationError("Invalid document date, expected YYYY-MM-DD")
+
+    received = _batch_quantity(item.get('cylinders_received'))
+    returned = _batch_quantity(item.get('cylinders_returned'))
+    validate_movements(document_type, received, returned)
+
+    number = item.get('document_number')
+    lines = []
+    if received:
+        lines.append({'movement_type': 'R', 'quantity': received, 'item_code': None})
+    if returned:
+        lines.append({'movement_type': 'E', 'quantity': returned, 'item_code': None})
+    return {
+        'number': normalize_document_number(str(number), document_type) if number else None,
+        'document_type': document_type,
+        'date': document_date,
+        'customer': customer,
+        'lines': lines,
+    }
 
 @login_required
-def get_customer_info(request):
-    account_number = request.GET.get('account_number')
-    print(f"Searching for customer with account number: {account_number}")
-    
+def save_documents(request):
+    """
+    Save a batch of documents posted as JSON ({"documents": [...]}, each shaped like
+    the save-document form). Valid entries are written together in one transaction;
+    every entry gets its own result.
+    """
+    if request.method != 'POST':
+        return JsonResponse({
+            'success': False,
+            'message': 'Invalid request method'
+        })
+
     try:
-        customer = Customer.objects.get(account_number=account_number)
-        print(f"Found customer: {customer.name}")
-        
-        # Get total holdings using the model method
-        total_holdings = customer.get_total_holdings()
-        print(f"Total holdings: {total_holdings}")
-        
+        items = json.loads(request.body)
+        if isinstance(items, dict):
+            items = items.get('documents')
+        if not isinstance(items, list):
+            raise ValueError
+    except ValueError:
         return JsonResponse({
-            'success': True,
-            'customer': {
-                'name': customer.name,
-                'account_number': customer.account_number,
-                'total_holdings': total_holdings,
-                'contact_person': customer.contact_person,
-                'phone_number': customer.phone_number,
-                'email': customer.email
+            'success': False,
+            'message': 'Expected a JSON list of documents'
+        }, status=400)
+    if len(items) > MAX_BATCH_DOCUMENTS:
+        return JsonResponse({
+            'success': False,
+            'message': f'At most {MAX_BATCH_DOCUMENTS} documents per batch'
+        }, status=400)
+
+    accounts = {str(item.get('customer_account') or '').strip() for item in items if isinstance(item, dict)}
+    customers = Customer.objects.in_bulk(list(accounts), field_name='account_number')
+
+    results = [None] * len(items)
+    documents = {}
+    for index, item in enumerate(items):
+        try:
+            documents[index] = _clean_batch_item(item, customers)
+        except ValidationError as e:
+            results[index] = {'index': index, 'success': False, 'message': ' '.join(e.messages)}
+
+    # Duplicates against the database and within the batch, with one lookup
+    existing = existing_document_numbers(doc['number'] for doc in documents.values() if doc['number'])
+    seen = set()
+    for index, document in list(documents.items()):
+        number = document['number']
+        if number and (number in existing or number in seen):
+            results[index] = {'index': index, 'success': False, 'message': 'This document number already exists'}
+            del documents[index]
+        elif number:
+            seen.add(number)
+
+    if documents:
+        status = 'PENDING_SYNC' if settings.PASTEL_SYNC_LOCAL_DOCUMENTS else 'ACTIVE'
+        try:
+            with transaction.atomic():
+                # Number unnumbered slips from one reserved block per type,
+                # after moving the sequence past any numbers typed in this batch
+                for document_type, _ in Document.DOCUMENT_TYPES:
+                    of_type = [doc for doc in documents.values() if doc['document_type'] == document_type]
+                    unnumbered = [doc for doc in of_type if not doc['number']]
+                    if unnumbered:
+                        typed = [document_number_value(doc['number']) for doc in of_type if doc['number']]
+                        if typed:
+                            DocumentSequence.observe(document_type, max(typed))
+                        block = DocumentSequence.reserve(document_type, len(unnumbered))
+                        for document, value in zip(unnumbered, block):
+                            document['number'] = format_document_number(document_type, value)
+                write_documents(list(documents.values()), request.user, status)
+                # One event per customer; open lists reload rather than replay the batch
+                for customer in {doc['customer'].pk: doc['customer'] for doc in documents.values()}.values():
+                    events.publish(customer.account_number, 'documents.added', {
+                        'count': sum(doc['customer'] == customer for doc in documents.values()),
+                        **_ledger_state(customer)
+                    })
+        except Exception as e:
+            logger.exception("Error saving document batch")
+            return JsonResponse({
+                'success': False,
+                'message': str(e)
+            })
+
+        for index, document in documents.items():
+            results[index] = {
+                'index': index,
+                'success': True,
+                'document': {
+                    'id': document['id'],
+                    'document_number': document['number']
+                }
             }
-        })
+
+    saved = len(documents)
+    return JsonResponse({
+        'success': saved == len(items),
+        'message': f'Saved {saved} of {len(items)} documents',
+        'saved': saved,
+        'failed': len(items) - saved,
+        'results': results
+    })
+
+async def _customer_info(account_number):
+    customer = await Customer.objects.select_related('balance').aget(account_number=account_number)
+    
+    # Get total holdings using the model method
+    total_holdings = await customer.aget_total_holdings()
+    
+    return {
+        'success': True,
+        'customer': {
+            'name': customer.name,
+            'account_number': customer.account_number,
+            'total_holdings': total_holdings,
+            'contact_person': customer.contact_person,
+            'phone_number': customer.phone_number,
+            'email': customer.email
+        }
+    }
+
+@login_required
+@revalidated('customer-info')
+async def get_customer_info(request):
+    account_number = request.GET.get('account_number')
+    
+    try:
+        return JsonResponse(await api_cache.aget_or_build(
+            await api_cache.amake_key('customer-info', (account_number,)),
+            lambda: _customer_info(account_number)
+        ))
     except Customer.DoesNotExist:
-        print(f"No customer found with account number: {account_number}")
         return JsonResponse({
             'success': False,
             'message': 'Customer not found'
         })
     except Exception as e:
-        print(f"Error in get_customer_info: {str(e)}")
+        logger.exception("Error in get_customer_info")
         return JsonResponse({
             'success': False,
             'message': f'Error: {str(e)}'
         })
 
+def _document_row(doc, received, returned):
+    """One row of the customer's document table"""
+    return {
+        'id': doc.id,
+        'document_number': doc.document_number,
+        'document_type': doc.get_document_type_display(),
+        'document_date': doc.document_date.strftime('%Y-%m-%d'),
+        'received': received,
+        'returned': returned
+    }
+
+def _ledger_state(customer):
+    """Holdings and list version after a change, from the balance record"""
+    state = CustomerBalance.objects.filter(customer=customer).values('balance', 'version').first()
+    if state is None:
+        return {'total_holdings': customer.get_total_holdings(), 'list_version': ledger.list_version(customer)}
+    return {'total_holdings': state['balance'], 'list_version': state['version']}
+
+def _parse_documents_cursor(cursor):
+    """Split a "YYYY-MM-DD_id" page cursor into (date, id)"""
+    try:
+        day, document_id = cursor.split('_')
+        return datetime.strptime(day, '%Y-%m-%d').date(), int(document_id)
+    except ValueError:
+        raise ValidationError("Invalid cursor")
+
+def _document_history_filters(request):
+    """Month (YYYY-MM) and date range filters from the query string, as a Q"""
+    filters = Q()
+    month_filter = request.GET.get('month', '').strip()
+    if month_filter:
+        try:
+            year, month = (int(part) for part in month_filter.split('-'))
+            filters &= Q(document_date__gte=date(year, month, 1))
+            filters &= Q(document_date__lt=date(year + month // 12, month % 12 + 1, 1))
+        except ValueError:
+            # Unreadable month: show the whole history, as before
+            month_filter = ''
+    for param, lookup in (('start_date', 'document_date__gte'), ('end_date', 'document_date__lte')):
+        value = request.GET.get(param, '').strip()
+        if value:
+            try:
+                filters &= Q(**{lookup: datetime.strptime(value, '%Y-%m-%d').date()})
+            except ValueError:
+                raise ValidationError(f"Invalid {param.replace('_', ' ')}, expected YYYY-MM-DD")
+    return filters, month_filter
+
 @login_required
-def get_customer_documents(request):
+@revalidated('customer-documents')
+async def get_customer_documents(request):
+    """
+    One page of a customer's documents, newest first, with received/returned
+    summed in SQL. Pass the returned next_cursor as ``cursor`` for the next page.
+    """
     account_number = request.GET.get('account_number')
-    month_filter = request.GET.get('month', '')
+    cache_key = await api_cache.amake_key('customer-documents', (account_number,), *(
+        request.GET.get(param, '') for param in ('month', 'start_date', 'end_date', 'cursor', 'limit')
+    ))
+    cached = await api_cache.acached_json(cache_key)
+    if cached is not None:
+        return cached
     
     try:
-        customer = Customer.objects.get(account_number=account_number)
-        # Get all documents with a single query
-        base_query = Document.objects.filter(
-            customer=customer
-        ).select_related(
-            'customer'
-        ).prefetch_related(
-            'movements'
-        ).order_by(
-            '-document_date'
-        )
+        customer = await Customer.objects.aget(account_number=account_number)
+        filters, month_filter = _document_history_filters(request)
+        try:
+            limit = min(max(int(request.GET.get('limit') or DOCUMENTS_PAGE_SIZE), 1), MAX_DOCUMENTS_PAGE_SIZE)
+        except ValueError:
+            limit = DOCUMENTS_PAGE_SIZE
         
-        # Convert to list directly instead of using iterator
-        all_documents = list(base_query)
+        documents = Document.objects.filter(customer=customer).filter(filters)
+        filter_applied = bool(filters)
+        if filter_applied:
+            total_documents = await documents.acount()
+        else:
+            total_documents = await CustomerBalance.objects.filter(customer=customer).values_list(
+                'document_count', flat=True
+            ).afirst() or 0
         
-        print("\nInitial query details:")
-        print(f"Customer: {customer.name} ({customer.account_number})")
-        print(f"Documents in database: {len(all_documents)}")
+        cursor = request.GET.get('cursor')
+        if cursor:
+            cursor_date, cursor_id = _parse_documents_cursor(cursor)
+            # The plain bound lets SQLite seek the (customer, date) index to the cursor
+            documents = documents.filter(document_date__lte=cursor_date).filter(
+                Q(document_date__lt=cursor_date) | Q(document_date=cursor_date, id__lt=cursor_id)
+            )
         
-        # Debug print all documents
-        for doc in all_documents:
-            print(f"Found document: {doc.document_number}")
-            print(f"  Date: {doc.document_date}")
-            print(f"  Type: {doc.document_type}")
-            print(f"  Status: {doc.status}")
-            movements = list(doc.movements.all())
-            print(f"  Movements: {len(movements)}")
-            for m in movements:
-                print(f"    {m.movement_type}: {m.quantity}")
-            print("---")
+        # Per-row subqueries rather than a join and GROUP BY, so the page is read
+        # straight off the index in order and stops at the limit
+        rows = documents.order_by('-document_date', '-id').annotate(
+            received=ledger.movement_total('R'),
+            returned=ledger.movement_total('E'),
+        ).values(
+            'id', 'document_number', 'document_type', 'document_date', 'status', 'received', 'returned'
+        )[:limit + 1]
         
-        # Apply month filter if provided
-        if month_filter and month_filter.strip():
-            try:
-                year, month = month_filter.split('-')
-                year, month = int(year), int(month)
-                documents = [
-                    doc for doc in all_documents
-                    if doc.document_date.year == year and doc.document_date.month == month
-                ]
-                print(f"\nFiltered for {year}-{month}: {len(documents)} documents")
-            except ValueError:
-                documents = all_documents
-                print("\nInvalid month filter, using all documents")
-        else:
-            documents = all_documents
-            print("\nNo month filter, using all documents")
+        type_names = dict(Document.DOCUMENT_TYPES)
+        traced = tracer.sampled()
+        page = {'count': 0, 'last': None, 'has_more': False}
         
-        # Create document list for response
-        document_list = []
-        print("\nProcessing documents for response:")
-        for doc in documents:
-            # Calculate received and returned quantities
-            received = sum(m.quantity for m in doc.movements.all() if m.movement_type == 'R')
-            returned = sum(m.quantity for m in doc.movements.all() if m.movement_type == 'E')
-            
-            doc_data = {
-                'id': doc.id,
-                'document_number': doc.document_number,
-                'document_type': doc.get_document_type_display(),
-                'document_date': doc.document_date.strftime('%Y-%m-%d'),
-                'received': received,
-                'returned': returned
+        def document_row(row):
+            # Rows are encoded as they come off the cursor; the extra row only signals another page
+            if page['count'] == limit:
+                page['has_more'] = True
+                return None
+            page['count'] += 1
+            page['last'] = row
+            if traced:
+                tracer.emit(
+                    'documents.loaded',
+                    customer=customer.account_number,
+                    document=row['document_number'],
+                    date=row['document_date'],
+                    type=row['document_type'],
+                    status=row['status'],
+                    received=row['received'],
+                    returned=row['returned']
+                )
+            return {
+                'id': row['id'],
+                'document_number': row['document_number'],
+                'document_type': type_names.get(row['document_type'], row['document_type']),
+                'document_date': row['document_date'].strftime('%Y-%m-%d'),
+                'received': row['received'],
+                'returned': row['returned']
             }
-            document_list.append(doc_data)
-            print(f"Added to response: {doc.document_number} ({doc.document_date})")
         
-        # Sort by date, newest first
-        document_list.sort(key=lambda x: x['document_date'], reverse=True)
+        def trailer():
+            next_cursor = None
+            if page['has_more']:
+                last = page['last']
+                next_cursor = f"{last['document_date']:%Y-%m-%d}_{last['id']}"
+            if traced:
+                tracer.emit(
+                    'documents.response',
+                    customer=customer.account_number,
+                    month_filter=month_filter or 'none',
+                    page_documents=page['count'],
+                    total_documents=total_documents
+                )
+            return {'next_cursor': next_cursor}
         
-        response_data = {
+        return api_cache.store_streamed(StreamingJsonResponse({
             'success': True,
-            'documents': document_list,
-            'filter_applied': bool(month_filter and month_filter.strip()),
-            'total_documents': len(document_list),
-            'month_filter': month_filter if month_filter else 'none',
-            'all_dates': sorted([doc['document_date'] for doc in document_list], reverse=True)
-        }
-        
-        print("\nResponse Summary:")
-        print(f"Total documents in response: {len(document_list)}")
-        print("Document dates:", response_data['all_dates'])
-        
-        return JsonResponse(response_data)
+            'list_version': await ledger.alist_version(customer),
+            'filter_applied': filter_applied,
+            'total_documents': total_documents,
+            'month_filter': month_filter if month_filter else 'none'
+        }, 'documents', map_rows(rows_for_handler(request, rows, DOCUMENTS_PAGE_SIZE), document_row), trailer),
+            cache_key)
         
     except Customer.DoesNotExist:
         return JsonResponse({
             'success': False,
             'message': 'Customer not found'
         })
+    except ValidationError as e:
+        return JsonResponse({
+            'success': False,
+            'message': ' '.join(e.messages)
+        }, status=400)
     except Exception as e:
-        print(f"Error in get_customer_documents: {str(e)}")
+        logger.exception("Error in get_customer_documents")
         return JsonResponse({
             'success': False,
             'message': str(e)
         })
 
 @login_required
-def check_document_number(request):
+async def check_document_number(request):
     doc_number = request.GET.get('document_number')
-    exists = Document.objects.filter(document_number=doc_number).exists()
+    exists = await Document.objects.filter(document_number=doc_number).aexists()
     return JsonResponse({
         'exists': exists
     })
 
 @login_required
-def get_document_details(request, document_number):
+async def get_document_details(request, document_number):
     try:
-        document = Document.objects.get(document_number=document_number)
-        received = document.movements.filter(movement_type='R').first()
-        returned = document.movements.filter(movement_type='E').first()
-        
-        print(f"Found document: {document}")  # Debug log
+        document = await Document.objects.select_related('customer').aget(document_number=document_number)
+        received = await document.movements.filter(movement_type='R').afirst()
+        returned = await document.movements.filter(movement_type='E').afirst()
         
         return JsonResponse({
             'success': True,
@@ -373,13 +620,12 @@ def get_document_details(request, document_number):
             }
         })
     except Document.DoesNotExist:
-        print(f"Document not found: {document_number}")  # Debug log
         return JsonResponse({
             'success': False,
             'message': 'Document not found'
         })
     except Exception as e:
-        print(f"Error: {str(e)}")  # Debug log
+        logger.exception("Error in get_document_details")
         return JsonResponse({
             'success': False,
             'message': str(e)
@@ -392,66 +638,35 @@ def update_document(request, document_id):
         document = Document.objects.get(id=document_id)
         
         if request.method == 'POST':
-            # Update document fields
-            document.document_date = request.POST.get('document_date')
-            document.save()
-            
-            # Delete existing movements
-            CylinderMovement.objects.filter(document=document).delete()
-            
-            # Create new movements based on document type
-            if document.document_type == 'NR':
-                # Only handle returned cylinders for NR
-                returned = request.POST.get('cylinders_returned')
-                if returned and int(returned) > 0:
-                    CylinderMovement.objects.create(
-                        document=document,
-                        movement_type='E',
-                        quantity=int(returned)
-                    )
-            else:
-                # Handle both received and returned for IN
-                received = request.POST.get('cylinders_received')
-                returned = request.POST.get('cylinders_returned')
+            with transaction.atomic():
+                base_version = ledger.list_version(document.customer)
+                old_received, old_returned = ledger.document_totals(document)
+                old_date = document.document_date
                 
-                if received and int(received) > 0:
-                    CylinderMovement.objects.create(
-                        document=document,
-                        movement_type='R',
-                        quantity=int(received)
-                    )
+                # Update document fields
+                document.document_date = request.POST.get('document_date')
+                document.save()
                 
-                if returned and int(returned) > 0:
-                    CylinderMovement.objects.create(
-                        document=document,
-                        movement_type='E',
-                        quantity=int(returned)
-                    )
-            
-            # Get updated document list
-            updated_documents = Document.objects.filter(
-                customer=document.customer
-            ).prefetch_related('movements').order_by('-document_date')
-            
-            # Create document list for response
-            document_list = []
-            for doc in updated_documents:
-                received = sum(m.quantity for m in doc.movements.all() if m.movement_type == 'R')
-                returned = sum(m.quantity for m in doc.movements.all() if m.movement_type == 'E')
+                # Replace existing movements
+                CylinderMovement.objects.filter(document=document).delete()
+                received, returned = _create_movements(document, request.POST)
+                # Take the old movements out of their month and add the new ones
+                ledger.record_movements(document.customer, old_date, -old_received, -old_returned)
+                ledger.record_movements(document.customer, document.document_date, received, returned)
                 
-                document_list.append({
-                    'id': doc.id,
-                    'document_number': doc.document_number,
-                    'document_type': doc.get_document_type_display(),
-                    'document_date': doc.document_date.strftime('%Y-%m-%d'),
-                    'received': received,
-                    'returned': returned
-                })
+                # Only the changed row goes back; clients refetch the list if their version is stale
+                document.refresh_from_db(fields=['document_date'])
+                change = {
+                    'document': _document_row(document, received, returned),
+                    'base_version': base_version,
+                    **_ledger_state(document.customer)
+                }
+                events.publish(document.customer.account_number, 'document.updated', change)
             
             return JsonResponse({
                 'success': True,
                 'message': f'Document {document.document_number} has been updated',
-                'updated_documents': document_list
+                **change
             })
             
     except Document.DoesNotExist:
@@ -460,7 +675,7 @@ def update_document(request, document_id):
             'message': 'Document not found'
         })
     except Exception as e:
-        print(f"Error updating document: {str(e)}")
+        logger.exception("Error updating document %s", document_id)
         return JsonResponse({
             'success': False,
             'message': f'Error updating document: {str(e)}'
@@ -472,43 +687,35 @@ def delete_document(request, document_id):
     try:
         document = Document.objects.get(id=document_id)
         
-        # Delete associated movements first
-        CylinderMovement.objects.filter(document=document).delete()
-        
         # Store document info for response
         document_info = {
             'number': document.document_number,
             'id': document.id
         }
         
-        # Delete the document
-        document.delete()
-        
-        # Get updated document list
-        updated_documents = Document.objects.filter(
-            customer=document.customer
-        ).prefetch_related('movements').order_by('-document_date')
-        
-        # Create document list for response
-        document_list = []
-        for doc in updated_documents:
-            received = sum(m.quantity for m in doc.movements.all() if m.movement_type == 'R')
-            returned = sum(m.quantity for m in doc.movements.all() if m.movement_type == 'E')
+        with transaction.atomic():
+            base_version = ledger.list_version(document.customer)
+            received, returned = ledger.document_totals(document)
             
-            document_list.append({
-                'id': doc.id,
-                'document_number': doc.document_number,
-                'document_type': doc.get_document_type_display(),
-                'document_date': doc.document_date.strftime('%Y-%m-%d'),
-                'received': received,
-                'returned': returned
-            })
+            # Delete associated movements first
+            CylinderMovement.objects.filter(document=document).delete()
+            
+            # Delete the document
+            document.delete()
+            ledger.record_movements(
+                document.customer, document.document_date, -received, -returned, documents=-1
+            )
+            change = {
+                'deleted_document': document_info,
+                'base_version': base_version,
+                **_ledger_state(document.customer)
+            }
+            events.publish(document.customer.account_number, 'document.deleted', change)
         
         return JsonResponse({
             'success': True,
             'message': f'Document {document_info["number"]} has been deleted',
-            'deleted_document': document_info,
-            'updated_documents': document_list
+            **change
         })
     except Document.DoesNotExist:
         return JsonResponse({
@@ -516,7 +723,7 @@ def delete_document(request, document_id):
             'message': 'Document not found'
         })
     except Exception as e:
-        print(f"Error deleting document: {str(e)}")
+        logger.exception("Error deleting document %s", document_id)
         return JsonResponse({
             'success': False,
             'message': f'Error deleting document: {str(e)}'
@@ -529,14 +736,14 @@ def get_user_permissions(request):
     })
 
 @login_required
-def get_customer_details(request, account_number):
+async def get_customer_details(request, account_number):
     try:
-        customer = Customer.objects.get(account_number=account_number)
+        customer = await Customer.objects.select_related('balance').aget(account_number=account_number)
         # Get recent transactions
         recent_transactions = []
-        for doc in customer.documents.order_by('-document_date')[:5]:
-            received = doc.movements.filter(movement_type='R').first()
-            returned = doc.movements.filter(movement_type='E').first()
+        async for doc in customer.documents.order_by('-document_date')[:5]:
+            received = await doc.movements.filter(movement_type='R').afirst()
+            returned = await doc.movements.filter(movement_type='E').afirst()
             recent_transactions.append({
                 'date': doc.document_date.strftime('%Y-%m-d'),
                 'document_number': doc.document_number,
@@ -544,6 +751,7 @@ def get_customer_details(request, account_number):
                 'returned': returned.quantity if returned else None
             })
 
+        last_document = await customer.documents.order_by('-document_date').afirst()
         return JsonResponse({
             'success': True,
             'customer': {
@@ -552,8 +760,8 @@ def get_customer_details(request, account_number):
                 'contact_person': customer.contact_person,
                 'phone_number': customer.phone_number,
                 'email': customer.email,
-                'total_holdings': customer.get_total_holdings(),
-                'last_transaction': customer.documents.order_by('-document_date').first().document_date.strftime('%Y-%m-%d') if customer.documents.exists() else 'No transactions'
+                'total_holdings': await customer.aget_total_holdings(),
+                'last_transaction': last_document.document_date.strftime('%Y-%m-%d') if last_document else 'No transactions'
             },
             'recent_transactions': recent_transactions
         })
@@ -568,71 +776,67 @@ def get_customer_details(request, account_number):
             'message': str(e)
         })
 
-def get_monthly_holdings(request):
+async def _monthly_holdings(customer, year):
+    """Twelve month-end holdings for a customer, or for the fleet when customer is None"""
+    monthly_data = []
+    
+    # The year's rollup rows plus the latest row before it, newest first.
+    # Thirteen rows always reach back past the start of the year.
+    start_of_year = timezone.datetime(year, 1, 1).date()
+    rollup = MonthlyHoldings.objects.filter(
+        customer=customer,
+        month__lt=timezone.datetime(year + 1, 1, 1).date()
+    ).order_by('-month').values_list('month', 'closing_balance')[:13]
+    
+    closing_balances = {}
+    running_total = 0  # Opening balance for the year
+    async for month_start, closing_balance in rollup:
+        if month_start < start_of_year:
+            running_total = closing_balance
+            break
+        closing_balances[month_start.month] = closing_balance
+    
+    # Months without movements carry the previous closing balance forward
+    for month in range(1, 13):
+        running_total = closing_balances.get(month, running_total)
+        monthly_data.append({
+            'month': f"{year}-{str(month).zfill(2)}",
+            'holdings': running_total
+        })
+    
+    return {
+        'success': True,
+        'data': monthly_data,
+        'title': (f"Monthly Cylinder Holdings for {customer.name}" if customer else "Total Cylinder Holdings")
+    }
+
+@revalidated('monthly-holdings')
+async def get_monthly_holdings(request):
     account_number = request.GET.get('account_number')
     year = request.GET.get('year', timezone.now().year)
     
     try:
-        monthly_data = []
+        year = int(year)
         
-        # Filter by customer if account_number is provided, otherwise get all movements
-        movements_query = CylinderMovement.objects.all()
-        if account_number:
-            try:
-                customer = Customer.objects.get(account_number=account_number)
-                movements_query = movements_query.filter(document__customer=customer)
-                title = f"Monthly Cylinder Holdings for {customer.name}"
-            except Customer.DoesNotExist:
-                return JsonResponse({
-                    'success': False,
-                    'message': 'Customer not found'
-                })
-        else:
-            title = "Total Cylinder Holdings"
-
-        # Calculate opening balance (all movements before the year)
-        start_of_year = timezone.datetime(int(year), 1, 1)
-        prior_movements = movements_query.filter(document__document_date__lt=start_of_year)
-        prior_received = prior_movements.filter(movement_type='R').aggregate(Sum('quantity'))['quantity__sum'] or 0
-        prior_returned = prior_movements.filter(movement_type='E').aggregate(Sum('quantity'))['quantity__sum'] or 0
-        running_total = prior_received - prior_returned
+        # Filter by customer if account_number is provided, otherwise use the fleet total rollup
+        async def build():
+            customer = None
+            if account_number:
+                customer = await Customer.objects.aget(account_number=account_number)
+            return await _monthly_holdings(customer, year)
         
-        # Calculate for each month
-        for month in range(1, 13):
-            start_date = timezone.datetime(int(year), month, 1)
-            if month == 12:
-                end_date = timezone.datetime(int(year) + 1, 1, 1)
-            else:
-                end_date = timezone.datetime(int(year), month + 1, 1)
-            
-            # Get movements for this month
-            month_movements = movements_query.filter(
-                document__document_date__gte=start_date,
-                document__document_date__lt=end_date
-            )
-            
-            # Calculate month's movements
-            month_received = month_movements.filter(movement_type='R').aggregate(Sum('quantity'))['quantity__sum'] or 0
-            month_returned = month_movements.filter(movement_type='E').aggregate(Sum('quantity'))['quantity__sum'] or 0
-            
-            # Update running total
-            running_total += (month_received - month_returned)
-            
-            monthly_data.append({
-                'month': f"{year}-{str(month).zfill(2)}",
-                'holdings': running_total
-            })
-            
-            print(f"Month {month}: Received={month_received}, Returned={month_returned}, Total={running_total}")  # Debug log
+        return JsonResponse(await api_cache.aget_or_build(
+            await api_cache.amake_key('monthly-holdings', (account_number or api_cache.FLEET,), year),
+            build
+        ))
         
+    except Customer.DoesNotExist:
         return JsonResponse({
-            'success': True,
-            'data': monthly_data,
-            'title': title
+            'success': False,
+            'message': 'Customer not found'
         })
-        
     except Exception as e:
-        print(f"Error in get_monthly_holdings: {str(e)}")  # Debug log
+        logger.exception("Error in get_monthly_holdings")
         return JsonResponse({
             'success': False,
             'message': str(e)
@@ -648,44 +852,26 @@ def get_monthly_holdings_report(request):
             'message': 'Date parameter is required'
         })
     
+    if request.GET.get('background') in ('1', 'true'):
+        # Large fleets: build the report in the job worker and poll for it
+        return _job_accepted(jobs.submit('holdings_report', {'date': report_date}, request.user))
+    
+    cache_key = api_cache.make_key('holdings-report', (api_cache.FLEET,), report_date)
+    cached = api_cache.cached_json(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
         report_date = timezone.datetime.strptime(report_date, '%Y-%m-%d').date()
         
-        # Get all active customers
-        customers = Customer.objects.filter(is_active=True)
-        
-        # Calculate holdings for each customer at specified date
-        holdings_data = []
-        for customer in customers:
-            # Get all movements up to and including the specified date
-            movements = CylinderMovement.objects.filter(
-                document__customer=customer,
-                document__document_date__lte=report_date
-            )
-            
-            # Calculate total holdings
-            received = movements.filter(movement_type='R').aggregate(Sum('quantity'))['quantity__sum'] or 0
-            returned = movements.filter(movement_type='E').aggregate(Sum('quantity'))['quantity__sum'] or 0
-            holdings = received - returned
-            
-            if holdings != 0:  # Only include customers with non-zero holdings
-                holdings_data.append({
-                    'account_number': customer.account_number,
-                    'customer_name': customer.name,
-                    'holdings': holdings,
-                    'last_movement_date': customer.documents.filter(
-                        document_date__lte=report_date
-                    ).order_by('-document_date').values_list('document_date', flat=True).first()
-                })
-        
-        # Sort by account number
-        holdings_data.sort(key=lambda x: x['account_number'])
+        holdings_data = ledger.holdings_at(report_date)
         
-        return JsonResponse({
+        # Stream the rows straight off the cursor rather than building the whole report,
+        # as the kind of iterator this handler sends without reading it all first
+        return api_cache.store_streamed(StreamingJsonResponse({
             'success': True,
-            'report_date': report_date.strftime('%Y-%m-%d'),
-            'data': holdings_data
-        })
+            'report_date': report_date.strftime('%Y-%m-%d')
+        }, 'data', rows_for_handler(request, holdings_data, 2000)), cache_key)
         
     except Exception as e:
         return JsonResponse({
@@ -694,3 +880,215 @@ def get_monthly_holdings_report(request):
         })
 
 
+
+
+def _csv_download(request, rows, filename):
+    """Stream export rows as a CSV attachment, gzipped when ?gzip=1"""
+    chunks = exports.to_csv(rows)
+    content_type = 'text/csv; charset=utf-8'
+    if request.GET.get('gzip') in ('1', 'true'):
+        chunks = exports.gzipped(chunks)
+        content_type = 'application/gzip'
+        filename += '.gz'
+    response = StreamingHttpResponse(for_handler(request, chunks), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def _export_date(request, param):
+    value = request.GET.get(param, '').strip()
+    if not value:
+        return None
+    try:
+        return ledger.parse_date(value)
+    except ValueError:
+        raise ValidationError(f"Invalid {param.replace('_', ' ')}, expected YYYY-MM-DD")
+
+@login_required
+def export_holdings_report(request):
+    """The holdings report for ?date= as CSV"""
+    try:
+        report_date = _export_date(request, 'date')
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'message': ' '.join(e.messages)}, status=400)
+    if report_date is None:
+        return JsonResponse({'success': False, 'message': 'Date parameter is required'}, status=400)
+    return _csv_download(request, exports.holdings_report(report_date), f'holdings-{report_date:%Y-%m-%d}.csv')
+
+@login_required
+def export_customer_documents(request):
+    """A customer's whole document history as CSV, with the history view's month/date filters"""
+    try:
+        customer = Customer.objects.get(account_number=request.GET.get('account_number'))
+        filters, _ = _document_history_filters(request)
+    except Customer.DoesNotExist:
+        return JsonResponse({'success': False, 'message': 'Customer not found'}, status=404)
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'message': ' '.join(e.messages)}, status=400)
+    return _csv_download(
+        request, exports.document_history(customer, filters), f'documents-{customer.account_number}.csv'
+    )
+
+@login_required
+def export_movements(request):
+    """Every recorded movement as CSV, optionally limited by start_date, end_date and account_number"""
+    try:
+        start, end = _export_date(request, 'start_date'), _export_date(request, 'end_date')
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'message': ' '.join(e.messages)}, status=400)
+    account_number = request.GET.get('account_number') or None
+    return _csv_download(request, exports.movements(start, end, account_number), 'movements.csv')
+
+def _statement_month(value):
+    try:
+        return datetime.strptime(value or '', '%Y-%m').date()
+    except ValueError:
+        raise ValidationError("Invalid month, expected YYYY-MM")
+
+@staff_member_required
+def customer_statement(request):
+    """One customer's statement for ?month=YYYY-MM as csv, html or pdf (?format=, default pdf)"""
+    fmt = request.GET.get('format', 'pdf')
+    try:
+        month = _statement_month(request.GET.get('month'))
+        if fmt not in statements.FORMATS:
+            raise ValidationError(f"Unknown format {fmt!r}")
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'message': ' '.join(e.messages)}, status=400)
+    
+    account_number = request.GET.get('account_number')
+    statement = next(statements.build_statements(month, [account_number]), None)
+    if statement is None:
+        return JsonResponse({'success': False, 'message': 'Customer not found'}, status=404)
+    response = HttpResponse(statements.RENDERERS[fmt](statement), content_type=statements.CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{account_number}-{month:%Y-%m}.{fmt}"'
+    return response
+
+@staff_member_required
+def generate_statements(request):
+    """Queue a job writing every active customer's statement for the posted month to STATEMENTS_DIR"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Invalid request method'}, status=405)
+    formats = request.POST.getlist('format') or list(statements.FORMATS)
+    try:
+        month = _statement_month(request.POST.get('month'))
+        unknown = set(formats) - set(statements.FORMATS)
+        if unknown:
+            raise ValidationError(f"Unknown format(s): {', '.join(sorted(unknown))}")
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'message': ' '.join(e.messages)}, status=400)
+    return _job_accepted(jobs.submit('statements', {'month': f'{month:%Y-%m}', 'formats': formats}, request.user))
+
+def _job_state(job):
+    state = {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': {'done': job.progress_done, 'total': job.progress_total},
+        'message': job.message,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'status_url': reverse('job_status', args=[job.id]),
+    }
+    if job.status == 'DONE':
+        state['result'] = job.result
+        if job.result_file:
+            state['download_url'] = reverse('job_download', args=[job.id])
+    return state
+
+def _job_accepted(job):
+    response = JsonResponse({'success': True, 'job': _job_state(job)}, status=202)
+    response['Location'] = reverse('job_status', args=[job.id])
+    return response
+
+def _visible_job(request, job_id):
+    """The job if this user may see it (its submitter or staff), else None"""
+    job = Job.objects.filter(pk=job_id).first()
+    if job is None or not (request.user.is_staff or job.created_by_id == request.user.id):
+        return None
+    return job
+
+@login_required
+def submit_job(request):
+    """Queue a job from a JSON body {"kind": ..., "params": {...}}"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Invalid request method'}, status=405)
+    try:
+        body = json.loads(request.body)
+        kind, params = body['kind'], body.get('params') or {}
+        if not isinstance(params, dict):
+            raise ValueError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'message': 'Expected {"kind": ..., "params": {...}}'}, status=400)
+    
+    handler = jobs.HANDLERS.get(kind)
+    if handler is None:
+        return JsonResponse({'success': False, 'message': f'Unknown job kind {kind!r}'}, status=400)
+    if handler.staff_only and not request.user.is_staff:
+        return JsonResponse({'success': False, 'message': 'Staff only'}, status=403)
+    return _job_accepted(jobs.submit(kind, params, request.user))
+
+@login_required
+def job_status(request, job_id):
+    """Poll a job: status, progress and, once done, its result"""
+    job = _visible_job(request, job_id)
+    if job is None:
+        return JsonResponse({'success': False, 'message': 'Job not found'}, status=404)
+    return JsonResponse({'success': True, 'job': _job_state(job)})
+
+@login_required
+def job_download(request, job_id):
+    """The file a finished job wrote"""
+    job = _visible_job(request, job_id)
+    if job is None or job.status != 'DONE' or not job.result_file:
+        return JsonResponse({'success': False, 'message': 'No file for this job'}, status=404)
+    try:
+        return FileResponse(open(job.result_file, 'rb'), as_attachment=True,
+                            filename=os.path.basename(job.result_file))
+    except FileNotFoundError:
+        return JsonResponse({'success': False, 'message': 'The job file has been removed'}, status=410)
+
+def _last_event_id(request):
+    """Where a reconnecting EventSource left off (header), or a client-supplied start"""
+    value = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+@login_required
+async def document_events(request):
+    """
+    Server-sent events for committed document changes: one customer's with
+    ``account_number``, otherwise the whole fleet's. A new connection starts at
+    the present; Last-Event-ID resumes after the last event a client saw.
+    """
+    account_number = request.GET.get('account_number') or None
+    last_id = _last_event_id(request)
+    if last_id is None:
+        last_id = await events.latest_id()
+    
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(events.stream(account_number, last_id), content_type='text/event-stream')
+    else:
+        # A WSGI worker can't be held open per tab: send what is pending and let
+        # EventSource reconnect, which turns the stream into cheap polling
+        pending = await events.since(account_number, last_id)
+        if pending:
+            last_id = pending[-1].id
+        response = HttpResponse(
+            events.preamble(last_id, getattr(settings, 'EVENTS_POLL_RETRY_MS', 5000))
+            + b''.join(events.encode(event) for event in pending),
+            content_type='text/event-stream'
+        )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@staff_member_required
+def metrics(request):
+    """Prometheus scrape endpoint for this worker's request metrics"""
+    return HttpResponse(
+        registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )